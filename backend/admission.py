@@ -0,0 +1,275 @@
+"""
+Adaptive concurrency limits and load shedding
+
+Each named limiter ('pipeline', 'searchcans', 'llm:openai', ...) admits up
+to `limit` concurrent calls. Callers beyond the limit wait in a bounded
+FIFO queue; when the queue is full, or a waiter's queue timeout passes, the
+call is rejected immediately with Overloaded instead of piling up until
+upstream timeouts fire. No call waits past its request's deadline: when
+that runs out first the wait ends with DeadlineExceeded (a 504, not a
+"retry later").
+
+The limit adapts to observed latency (gradient style, as in Netflix's
+concurrency-limits): while latency stays within `tolerance` x the
+baseline (smoothed minimum) latency the limit grows by about sqrt(limit)
+per sample; as latency rises past that the gradient shrinks the limit
+proportionally, and failures (timeouts, 5xx) cut it multiplicatively.
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+from deadlines import DeadlineExceeded, remaining
+
+
+class Overloaded(Exception):
+    """A limiter rejected the call (queue full or queue timeout passed)"""
+
+    def __init__(self, name: str, reason: str, retry_after: int):
+        super().__init__(f"{name} is overloaded ({reason}), retry after {retry_after}s")
+        self.name = name
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def _is_client_error(exc: BaseException) -> bool:
+    status_code = getattr(exc, "status_code", None)
+    return status_code is not None and 400 <= status_code < 500 and status_code != 429
+
+
+class Permit:
+    """One admitted call; release() feeds its latency back into the limiter"""
+
+    def __init__(self, limiter: "AdaptiveLimiter"):
+        self.limiter = limiter
+        self.started = time.monotonic()
+        self.latency: Optional[float] = None
+        self.dropped = False
+        self.released = False
+
+    def mark(self):
+        """Take the latency sample now (e.g. at the first streamed token)"""
+        if self.latency is None:
+            self.latency = time.monotonic() - self.started
+
+    def drop(self):
+        """Report the call as an upstream failure (multiplicative decrease)"""
+        self.dropped = True
+
+    def release(self):
+        if self.released:
+            return
+        self.released = True
+        self.mark()
+        self.limiter._on_release(self.latency, self.dropped)
+
+    async def __aenter__(self) -> "Permit":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc is not None and not isinstance(exc, Overloaded) and not _is_client_error(exc):
+            self.dropped = True
+        self.release()
+
+
+class AdaptiveLimiter:
+    """Latency-gradient concurrency limit with a bounded wait queue"""
+
+    def __init__(
+        self,
+        name: str,
+        initial_limit: float = 20,
+        min_limit: float = 2,
+        max_limit: float = 200,
+        queue_size: int = 100,
+        queue_timeout: float = 5.0,
+        tolerance: float = 2.0,
+        smoothing: float = 0.2,
+        backoff: float = 0.9,
+        adaptive: bool = True
+    ):
+        self.name = name
+        self.adaptive = adaptive
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.backoff = backoff
+        self.inflight = 0
+        self.baseline: Optional[float] = None
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.dropped = 0
+
+    def _has_capacity(self) -> bool:
+        return self.inflight < max(1, int(self.limit))
+
+    def load(self) -> float:
+        """In-flight plus queued calls per slot; 1.0 means every slot is in use"""
+        return (self.inflight + len(self._waiters)) / max(self.limit, 1.0)
+
+    def retry_after(self) -> int:
+        """Seconds until the current queue is expected to drain"""
+        per_call = self.baseline or 1.0
+        return max(1, math.ceil(len(self._waiters) / max(self.limit, 1.0) * per_call * self.tolerance))
+
+    async def acquire(self, timeout: Optional[float] = None) -> Permit:
+        """
+        Wait for a slot
+
+        Args:
+            timeout: Max seconds to wait in the queue (default: queue_timeout)
+
+        Raises:
+            Overloaded: When the queue is full or the wait times out
+            DeadlineExceeded: When the request's deadline runs out before a slot is free
+        """
+        if self._has_capacity() and not self._waiters:
+            self.inflight += 1
+            self.admitted += 1
+            return Permit(self)
+        timeout = self.queue_timeout if timeout is None else timeout
+        left = remaining()
+        cut_by_deadline = left is not None and left < timeout
+        if cut_by_deadline:
+            if left <= 0:
+                raise DeadlineExceeded("admission")
+            timeout = left
+        if len(self._waiters) >= self.queue_size:
+            self.rejected_queue_full += 1
+            raise Overloaded(self.name, "queue full", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            self._forget(waiter)
+            if cut_by_deadline:
+                raise DeadlineExceeded("admission") from None
+            self.rejected_timeout += 1
+            raise Overloaded(self.name, "queue timeout", self.retry_after())
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we were cancelled
+                self._release_slot()
+            else:
+                self._forget(waiter)
+            raise
+        self.admitted += 1
+        return Permit(self)
+
+    def _forget(self, waiter: asyncio.Future):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def _release_slot(self):
+        self.inflight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self._has_capacity():
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.inflight += 1
+                waiter.set_result(None)
+
+    def _on_release(self, latency: float, dropped: bool):
+        if dropped:
+            self.dropped += 1
+            if self.adaptive:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+        elif self.adaptive:
+            self._update_limit(latency)
+        self._release_slot()
+
+    def _update_limit(self, latency: float):
+        latency = max(latency, 1e-4)
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+        else:
+            # Let the baseline drift up slowly so a permanent shift is learned
+            self.baseline += (latency - self.baseline) * 0.001
+        gradient = max(0.5, min(1.0, self.tolerance * self.baseline / latency))
+        target = self.limit * gradient + math.sqrt(self.limit)
+        new_limit = self.limit * (1 - self.smoothing) + target * self.smoothing
+        # Only grow when the limit is actually being used
+        if new_limit > self.limit and self.inflight * 2 < self.limit:
+            return
+        self.limit = min(self.max_limit, max(self.min_limit, new_limit))
+        self._wake()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": round(self.limit, 2),
+            "adaptive": self.adaptive,
+            "inflight": self.inflight,
+            "queue_depth": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "dropped": self.dropped,
+            "baseline_latency_ms": round(self.baseline * 1000, 1) if self.baseline else None,
+        }
+
+
+class AdmissionController:
+    """
+    Named limiters sharing one configuration
+
+    Names listed in fixed_limits get a constant limit instead of an adaptive
+    one; used for whole pipelines, whose latency mixes cache hits and
+    upstream calls and is no signal of upstream congestion.
+    """
+
+    def __init__(self, fixed_limits: Optional[Dict[str, int]] = None, **limiter_settings: Any):
+        self.fixed_limits = fixed_limits or {}
+        self.limiter_settings = limiter_settings
+        self.limiters: Dict[str, AdaptiveLimiter] = {}
+
+    @classmethod
+    def from_env(cls) -> Optional["AdmissionController"]:
+        """Build from ADMISSION_* variables; None when ADMISSION_ENABLED is false"""
+        if os.getenv("ADMISSION_ENABLED", "true").lower() not in ("1", "true", "yes"):
+            return None
+        return cls(
+            fixed_limits={"pipeline": int(os.getenv("ADMISSION_MAX_PIPELINES", 64))},
+            initial_limit=float(os.getenv("ADMISSION_INITIAL_LIMIT", 20)),
+            min_limit=float(os.getenv("ADMISSION_MIN_LIMIT", 2)),
+            max_limit=float(os.getenv("ADMISSION_MAX_LIMIT", 200)),
+            queue_size=int(os.getenv("ADMISSION_QUEUE_SIZE", 100)),
+            queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", 5000)) / 1000,
+            tolerance=float(os.getenv("ADMISSION_LATENCY_TOLERANCE", 2.0)),
+        )
+
+    def limiter(self, name: str) -> AdaptiveLimiter:
+        limiter = self.limiters.get(name)
+        if limiter is None:
+            settings = dict(self.limiter_settings)
+            if name in self.fixed_limits:
+                fixed = self.fixed_limits[name]
+                settings.update(initial_limit=fixed, min_limit=fixed, max_limit=fixed, adaptive=False)
+            limiter = self.limiters[name] = AdaptiveLimiter(name, **settings)
+        return limiter
+
+    @asynccontextmanager
+    async def slot(self, name: str, timeout: Optional[float] = None) -> AsyncIterator[Permit]:
+        """Hold a slot of the named limiter for the duration of the block"""
+        permit = await self.limiter(name).acquire(timeout)
+        async with permit:
+            yield permit
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: limiter.stats() for name, limiter in self.limiters.items()}
@@ -0,0 +1,241 @@
+"""
+Cache of complete AI answers
+
+Exact mode: keyed on (normalized query, provider, model, context hash), so a
+hit is only possible when the LLM would have seen exactly the same prompt.
+
+Semantic mode (optional): paraphrased queries are matched before searching
+by cosine similarity of hashed character n-gram vectors. Vectors live in one
+preallocated NumPy matrix, so a lookup is a single matrix-vector product.
+
+With a shared store (multi-worker mode) exact entries are also written
+there; a local miss checks the store and promotes the entry, so workers
+serve each other's answers. Semantic matching only covers entries this
+worker has seen.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from search_cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+AnswerKey = Tuple[str, str, str, str]
+
+
+def hash_context(context: str) -> str:
+    return hashlib.sha256(context.encode("utf-8")).hexdigest()
+
+
+def embed_query(query: str, dim: int = 512, n: int = 3) -> np.ndarray:
+    """
+    Unit-length hashed character n-gram vector for a query
+
+    Args:
+        query: Query text
+        dim: Vector dimension (number of hash buckets)
+        n: n-gram length
+
+    Returns:
+        float32 vector of shape (dim,)
+    """
+    text = f" {normalize_query(query)} "
+    grams = [text[i:i + n] for i in range(max(len(text) - n + 1, 1))]
+    buckets = np.fromiter((zlib.crc32(g.encode("utf-8")) % dim for g in grams), dtype=np.int64, count=len(grams))
+    vector = np.bincount(buckets, minlength=dim).astype(np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+@dataclass
+class CachedAnswer:
+    answer: str
+    sources: List[str]
+    query: str
+    provider: str
+    model: str
+    expires_at: float
+    # Retrieval options the answer was built with (engines, pages, deep retrieval)
+    profile: str = ""
+    row: int = -1
+
+
+class AnswerCache:
+    """LRU + TTL answer cache with optional near-duplicate lookup"""
+
+    def __init__(
+        self,
+        ttl: float = 1800,
+        max_entries: int = 2048,
+        semantic: bool = False,
+        threshold: float = 0.9,
+        dim: int = 512,
+        store: Any = None
+    ):
+        self.ttl = ttl
+        # Only a cross-process store adds anything over the local entries
+        self.store = store if store is not None and store.shared else None
+        self.max_entries = max_entries
+        self.semantic = semantic
+        self.threshold = threshold
+        self.dim = dim
+        self._entries: "OrderedDict[AnswerKey, CachedAnswer]" = OrderedDict()
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32) if semantic else None
+        self._row_keys: List[Optional[AnswerKey]] = [None] * max_entries if semantic else []
+        self._free_rows = list(range(max_entries - 1, -1, -1)) if semantic else []
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.misses = 0
+        self.evictions = 0
+        self.hits_shared = 0
+
+    @classmethod
+    def from_env(cls, store: Any = None) -> Optional["AnswerCache"]:
+        """Build the cache from environment variables (None when disabled)"""
+        if os.getenv("ANSWER_CACHE_ENABLED", "true").lower() not in ("1", "true", "yes"):
+            return None
+        return cls(
+            ttl=float(os.getenv("ANSWER_CACHE_TTL", 1800)),
+            max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 2048)),
+            semantic=os.getenv("ANSWER_CACHE_SEMANTIC", "false").lower() in ("1", "true", "yes"),
+            threshold=float(os.getenv("ANSWER_CACHE_SIMILARITY", 0.9)),
+            store=store,
+        )
+
+    @staticmethod
+    def make_key(query: str, provider: str, model: str, context_hash: str) -> AnswerKey:
+        return (normalize_query(query), provider, model, context_hash)
+
+    @staticmethod
+    def _store_key(key: AnswerKey) -> str:
+        return "answer:" + json.dumps(key, ensure_ascii=False)
+
+    async def get_exact(self, key: AnswerKey) -> Optional[CachedAnswer]:
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at < time.time():
+            self._remove(key)
+            entry = None
+        if entry is None and self.store is not None:
+            entry = await self._get_shared(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits_exact += 1
+        return entry
+
+    async def _get_shared(self, key: AnswerKey) -> Optional[CachedAnswer]:
+        try:
+            encoded = await asyncio.to_thread(self.store.get, self._store_key(key))
+        except Exception as e:
+            logger.warning("Shared answer cache read failed: %s", e)
+            return None
+        if encoded is None:
+            return None
+        data = json.loads(encoded)
+        self.hits_shared += 1
+        return self._insert(key, data["answer"], data["sources"], data["query"], data["expires_at"], data.get("profile", ""))
+
+    def get_similar(self, query: str, provider: str, model: str, profile: str = "") -> Optional[Tuple[CachedAnswer, float]]:
+        """
+        Find the most similar cached answer for the same provider, model and retrieval profile
+
+        Unlike an exact hit, a near-duplicate hit is served before any search
+        runs, so the answer must come from the same kind of retrieval.
+
+        Returns:
+            (entry, similarity) when the best match clears the threshold, else None
+        """
+        if not self.semantic or not self._entries:
+            return None
+
+        scores = self._vectors @ embed_query(query, self.dim)
+        top = min(8, len(scores))
+        candidates = np.argpartition(-scores, top - 1)[:top]
+        now = time.time()
+        for row in candidates[np.argsort(-scores[candidates])]:
+            score = float(scores[row])
+            if score < self.threshold:
+                break
+            key = self._row_keys[row]
+            entry = self._entries.get(key) if key else None
+            if entry is None or entry.provider != provider or entry.model != model or entry.profile != profile:
+                continue
+            if entry.expires_at < now:
+                self._remove(key)
+                continue
+            self._entries.move_to_end(key)
+            self.hits_semantic += 1
+            return entry, score
+        return None
+
+    async def put(self, key: AnswerKey, answer: str, sources: List[str], query: str, profile: str = ""):
+        entry = self._insert(key, answer, sources, query, time.time() + self.ttl, profile)
+        if self.store is not None:
+            encoded = json.dumps({
+                "answer": entry.answer,
+                "sources": entry.sources,
+                "query": entry.query,
+                "expires_at": entry.expires_at,
+                "profile": entry.profile,
+            }, ensure_ascii=False)
+            try:
+                await asyncio.to_thread(self.store.set, self._store_key(key), encoded, self.ttl)
+            except Exception as e:
+                logger.warning("Shared answer cache write failed: %s", e)
+
+    def _insert(self, key: AnswerKey, answer: str, sources: List[str], query: str, expires_at: float, profile: str = "") -> CachedAnswer:
+        if key in self._entries:
+            self._remove(key)
+        while len(self._entries) >= self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+        entry = CachedAnswer(
+            answer=answer,
+            sources=list(sources),
+            query=query,
+            provider=key[1],
+            model=key[2],
+            expires_at=expires_at,
+            profile=profile,
+        )
+        if self.semantic:
+            entry.row = self._free_rows.pop()
+            self._vectors[entry.row] = embed_query(query, self.dim)
+            self._row_keys[entry.row] = key
+        self._entries[key] = entry
+        return entry
+
+    def _remove(self, key: AnswerKey):
+        entry = self._entries.pop(key)
+        if entry.row >= 0:
+            self._vectors[entry.row] = 0
+            self._row_keys[entry.row] = None
+            self._free_rows.append(entry.row)
+
+    def stats(self) -> Dict[str, Any]:
+        """Cache counters for /health"""
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "semantic": self.semantic,
+            "similarity_threshold": self.threshold,
+            "hits_exact": self.hits_exact,
+            "hits_semantic": self.hits_semantic,
+            "hits_shared": self.hits_shared,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,129 @@
+"""
+Concurrency benchmark: blocking vs non-blocking smart_search pipeline
+
+Starts local mock upstreams, then fires N concurrent /api/smart_search
+requests at two servers:
+
+- "blocking": the previous implementation, which called requests.post and
+  the synchronous OpenAI client directly inside the async endpoint
+- "async": the current backend (httpx + AsyncOpenAI)
+
+The blocking server needs `requests`, which only requirements-dev.txt installs.
+
+Usage (from the backend directory):
+    python benchmarks/bench_async_pipeline.py --concurrency 50
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+MOCK_PORT = 18081
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_upstreams import ServerThread, backend_env, create_mock_app  # noqa: E402
+
+# Point the backend at the mock upstreams before it is imported
+os.environ.update(backend_env(MOCK_PORT))
+
+import httpx  # noqa: E402
+import requests  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+from openai import OpenAI  # noqa: E402
+
+import main  # noqa: E402
+
+
+def legacy_search_context(search_data: dict) -> tuple:
+    """The old context builder: every result with content and a URL, in order"""
+    context_parts = []
+    sources = []
+    for idx, result in enumerate(search_data.get("data") or [], 1):
+        content, url = result.get("content", ""), result.get("url", "")
+        if content and url:
+            context_parts.append(f"[Source {idx}] {result.get('title', 'No title')}\n{content}\nURL: {url}")
+            sources.append(url)
+    return "\n\n".join(context_parts), list(dict.fromkeys(sources))
+
+
+def create_blocking_app() -> FastAPI:
+    """Reproduce the old pipeline: sync I/O inside an async endpoint"""
+    legacy = FastAPI()
+
+    @legacy.post("/api/smart_search")
+    async def smart_search(search_query: main.SearchQuery):
+        response = requests.post(
+            main.SEARCHCANS_API_ENDPOINT,
+            headers={"Authorization": f"Bearer {main.SEARCHCANS_API_KEY}"},
+            json={"s": search_query.query, "t": search_query.search_engine, "d": 10000, "p": 1},
+            timeout=15,
+        )
+        context, sources = legacy_search_context(response.json())
+        messages = main.build_enhanced_prompt(search_query.query, context)
+        client = OpenAI(api_key=main.DEFAULT_OPENAI_API_KEY)
+        completion = client.chat.completions.create(
+            model="gpt-4o-mini", messages=messages, temperature=0.7, max_tokens=2000
+        )
+        return {"answer": completion.choices[0].message.content, "sources": sources}
+
+    return legacy
+
+
+async def run_load(base_url: str, concurrency: int) -> dict:
+    """Send `concurrency` simultaneous queries and collect latencies"""
+    latencies = []
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+
+        async def one(i: int):
+            started = time.perf_counter()
+            response = await client.post("/api/smart_search", json={"query": f"benchmark query {i}"})
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p99_index = max(0, int(round(0.99 * len(latencies))) - 1)
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[p99_index] * 1000,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--search-latency", type=float, default=0.2)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    args = parser.parse_args()
+
+    mock = ServerThread(create_mock_app(args.search_latency, args.llm_latency), MOCK_PORT).start()
+    try:
+        for name, app, port in (
+            ("blocking", create_blocking_app(), 18082),
+            ("async", main.app, 18083),
+        ):
+            server = ServerThread(app, port).start()
+            try:
+                result = asyncio.run(run_load(server.url, args.concurrency))
+            finally:
+                server.stop()
+            print(
+                f"{name:>9}: {result['requests']} requests, {result['rps']:.1f} req/s, "
+                f"p50 {result['p50_ms']:.0f} ms, p99 {result['p99_ms']:.0f} ms"
+            )
+    finally:
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,123 @@
+"""
+Logging overhead benchmark
+
+Measures what logging costs on the event loop, per log call and per
+/api/smart_search request (mock upstreams with no latency, requests sent
+one at a time), for several configurations:
+
+- "off": LOG_LEVEL=WARNING, INFO records are rejected up front
+- "sync-text": the classic setup, text lines written inline by the caller
+- "queued-json": JSON records formatted and written by the listener thread
+- "queued-json-10%": as above, keeping INFO records of 10% of requests
+
+Output goes to a sink that takes `--sink-latency-us` per write, like a busy
+terminal, pipe or log shipper; sync handlers pay that on the event loop.
+
+Usage (from the backend directory):
+    python benchmarks/bench_logging.py --requests 200 --sink-latency-us 200
+"""
+
+import argparse
+import asyncio
+import io
+import logging
+import os
+import sys
+import time
+
+MOCK_PORT = 18094
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_upstreams import ServerThread, backend_env, create_mock_app  # noqa: E402
+
+# Point the backend at the mock upstream before it is imported; every
+# request runs the full pipeline (and all of its log calls)
+os.environ.update(backend_env(
+    MOCK_PORT, SEARCH_CACHE_ENABLED="false", ANSWER_CACHE_ENABLED="false", COALESCE_ENABLED="false"
+))
+
+import httpx  # noqa: E402
+
+import logging_config  # noqa: E402
+import main  # noqa: E402
+
+MODES = [
+    ("off", {"level": "WARNING", "fmt": "text", "use_queue": False}),
+    ("sync-text", {"level": "INFO", "fmt": "text", "use_queue": False}),
+    ("queued-json", {"level": "INFO", "fmt": "json", "use_queue": True}),
+    ("queued-json-10%", {"level": "INFO", "fmt": "json", "use_queue": True, "sample_rate": 0.1}),
+]
+
+
+class SlowSink(io.TextIOBase):
+    """Discards output, but every write takes `latency` seconds"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.writes = 0
+
+    def write(self, text: str) -> int:
+        self.writes += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def measure_calls(calls: int) -> float:
+    """Caller-side microseconds per logger.info call with arguments"""
+    logger = logging.getLogger("bench")
+    logging_config.bind_request()
+    started = time.perf_counter()
+    for i in range(calls):
+        logger.info("Search cache hit - Query: '%s', Engine: %s, Page: %s", "benchmark query", "google", i)
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+async def measure_requests(requests: int) -> float:
+    """Mean milliseconds per /api/smart_search request"""
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            for i in range(5):
+                (await client.post("/api/smart_search", json={"query": f"warm-up {i}"})).raise_for_status()
+            started = time.perf_counter()
+            for i in range(requests):
+                response = await client.post("/api/smart_search", json={"query": f"logging benchmark {i}"})
+                response.raise_for_status()
+            return (time.perf_counter() - started) / requests * 1000
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--calls", type=int, default=5000, help="logger.info calls in the per-call test")
+    parser.add_argument("--sink-latency-us", type=float, default=200)
+    args = parser.parse_args()
+
+    mock = ServerThread(create_mock_app(search_latency=0.0, llm_latency=0.0), MOCK_PORT).start()
+    baseline = None
+    try:
+        for name, settings in MODES:
+            sink = SlowSink(args.sink_latency_us / 1e6)
+            logging_config.configure_logging(stream=sink, **settings)
+            per_call_us = measure_calls(args.calls)
+            logging_config.flush_logging()
+            writes = sink.writes
+            per_request_ms = asyncio.run(measure_requests(args.requests))
+            logging_config.flush_logging()
+            baseline = per_request_ms if baseline is None else baseline
+            print(
+                f"{name:>16}: {per_call_us:6.1f} us per log call, {per_request_ms:6.2f} ms per request "
+                f"(+{(per_request_ms - baseline) * 1000:5.0f} us), "
+                f"{(sink.writes - writes) / (args.requests + 5):4.1f} lines per request"
+            )
+    finally:
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,166 @@
+"""
+CPU cost of the /api/smart_search response path
+
+Compares two tiny apps that return the same realistic payload (long
+answer, sources, retrieval and context metadata) for the same SearchQuery
+body, so only the response path differs:
+
+- "default": SearchResponse built with validation, returned through
+  response_model (re-validation + jsonable_encoder + stdlib json)
+- "fast": SearchResponse.model_construct returned as FastJSONResponse
+  (no re-validation, pydantic-core / orjson encoding)
+
+First the response path alone is timed (model construction, FastAPI's
+serialize_response where it applies, and rendering the body). Then each
+app is driven end to end through httpx's ASGI transport, with no
+compression and with gzip (and brotli when installed) negotiated by
+CompressionMiddleware. CPU time is process time per request, so the load
+generator's share is included equally in both.
+
+Usage (from the backend directory):
+    python benchmarks/bench_response_path.py --requests 2000
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_model_field  # noqa: E402
+
+import main  # noqa: E402
+from compression import CompressionMiddleware, brotli  # noqa: E402
+from serialization import JSON_BACKEND, FastJSONResponse  # noqa: E402
+
+ANSWER = ("Retrieval-augmented generation combines a search step with a language model [Source 1]. " * 40).strip()
+SOURCES = [f"https://example.com/articles/{i}/retrieval-augmented-generation" for i in range(10)]
+METADATA = {
+    "query": "what is retrieval augmented generation",
+    "search_engine": "google",
+    "llm_provider": "openai",
+    "llm_model": None,
+    "results_found": 10,
+    "processing_time_ms": 1834,
+    "answer_cache": {"hit": False},
+    "context": {
+        "token_budget": 6000, "passages_total": 20, "duplicates_removed": 3, "passages_used": 10,
+        "passages_dropped": 7, "passages_truncated": 1, "context_tokens": 2950, "prompt_tokens": 3120,
+    },
+    "retrieval": {
+        "mode": "fanout", "deadline_ms": 8000, "elapsed_ms": 640,
+        "sources": [
+            {"engine": engine, "page": page, "status": "ok", "elapsed_ms": 400 + page * 50, "results": 10}
+            for engine in ("google", "bing") for page in (1, 2, 3)
+        ],
+        "dropped_late": [], "results_merged": 54,
+    },
+    "llm": {
+        "provider": "openai", "model": "gpt-4o-mini", "hedged": False, "failover": False,
+        "attempts": [{"target": "openai:gpt-4o-mini", "outcome": "won", "first_token_ms": 420}],
+    },
+}
+
+
+def create_default_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/api/smart_search", response_model=main.SearchResponse)
+    async def smart_search(search_query: main.SearchQuery):
+        return main.SearchResponse(answer=ANSWER, sources=SOURCES, metadata=dict(METADATA, query=search_query.query))
+
+    return app
+
+
+def create_fast_app() -> FastAPI:
+    app = FastAPI(default_response_class=FastJSONResponse)
+
+    @app.post("/api/smart_search", response_model=main.SearchResponse)
+    async def smart_search(search_query: main.SearchQuery):
+        return FastJSONResponse(main.SearchResponse.model_construct(
+            answer=ANSWER, sources=SOURCES, metadata=dict(METADATA, query=search_query.query)
+        ))
+
+    return app
+
+
+async def measure_response_path(requests: int) -> dict:
+    """Process time per response for model construction + serialization only"""
+    field = create_model_field(name="Response_smart_search", type_=main.SearchResponse, mode="serialization")
+
+    async def default() -> bytes:
+        response = main.SearchResponse(answer=ANSWER, sources=SOURCES, metadata=dict(METADATA))
+        content = await serialize_response(field=field, response_content=response, is_coroutine=True)
+        return JSONResponse(content).body
+
+    async def fast() -> bytes:
+        response = main.SearchResponse.model_construct(answer=ANSWER, sources=SOURCES, metadata=dict(METADATA))
+        return FastJSONResponse(response).body
+
+    results = {}
+    for name, render in (("default", default), ("fast", fast)):
+        for _ in range(100):
+            await render()
+        started = time.process_time()
+        for _ in range(requests):
+            await render()
+        results[name] = (time.process_time() - started) / requests * 1e6
+    return results
+
+
+async def measure(app, requests: int, accept_encoding: str) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    headers = {"Accept-Encoding": accept_encoding}
+    body = {"query": "what is retrieval augmented generation", "search_engine": "google", "llm_provider": "openai"}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers) as client:
+        # Warm up
+        for _ in range(50):
+            response = await client.post("/api/smart_search", json=body)
+        response.raise_for_status()
+        wire_bytes = int(response.headers.get("content-length", len(response.content)))
+
+        cpu_started = time.process_time()
+        wall_started = time.perf_counter()
+        for _ in range(requests):
+            await client.post("/api/smart_search", json=body)
+        cpu = time.process_time() - cpu_started
+        wall = time.perf_counter() - wall_started
+    return {
+        "cpu_us_per_request": cpu / requests * 1e6,
+        "wall_us_per_request": wall / requests * 1e6,
+        "wire_bytes": wire_bytes,
+        "encoding": response.headers.get("content-encoding", "identity"),
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    encodings = ["identity", "gzip"] + (["br"] if brotli is not None else [])
+    print(f"JSON encoder: {JSON_BACKEND}, brotli: {'yes' if brotli is not None else 'not installed'}")
+    path = asyncio.run(measure_response_path(args.requests * 5))
+    print(f"Response path only: default {path['default']:.1f} us CPU/response, fast {path['fast']:.1f} us CPU/response")
+    print("End to end:")
+    for name, factory in (("default", create_default_app), ("fast", create_fast_app)):
+        for encoding in encodings:
+            app = factory()
+            if encoding != "identity":
+                app.add_middleware(CompressionMiddleware)
+            result = asyncio.run(measure(app, args.requests, encoding))
+            print(
+                f"{name:>8} / {encoding:<8}: {result['cpu_us_per_request']:7.0f} us CPU/request, "
+                f"{result['wall_us_per_request']:7.0f} us wall/request, "
+                f"{result['wire_bytes']:6d} bytes ({result['encoding']})"
+            )
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,158 @@
+"""
+Cold start benchmark
+
+Measures what a freshly started instance (an autoscaled replica, a
+serverless cold start) pays before it can answer, each run in a new
+Python process:
+
+- import: `import main`
+- ready: until the lifespan startup has finished (the server accepts requests)
+- first answer: until the first /api/smart_search returns, sent as soon as
+  the app is ready (as when the request itself triggered the cold start)
+
+Modes:
+
+- "eager": the provider SDK imported up front, as importing the app used to do
+- "lazy-off": SDK imported by the first request that needs an LLM client
+- "lazy-background": SDK import and client warm-up run after startup (default)
+- "lazy-blocking": warm-up finishes before the app reports ready
+
+It also prints the slowest imports under main from `python -X importtime`.
+The process exits with status 1 when the default mode's median import or
+ready time is over its budget, so it can gate CI or a deploy.
+
+Usage (from the backend directory):
+    python benchmarks/bench_startup.py --runs 5 --import-budget-ms 700 --ready-budget-ms 800
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Heavy imports (the app, httpx, the mock upstreams) stay inside functions:
+# child processes must pay for nothing but what they measure
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+MOCK_PORT = 18100
+
+MODES = {
+    "eager": {"STARTUP_WARMUP": "off"},
+    "lazy-off": {"STARTUP_WARMUP": "off"},
+    "lazy-background": {"STARTUP_WARMUP": "background", "WARMUP_CONNECT": "true"},
+    "lazy-blocking": {"STARTUP_WARMUP": "blocking", "WARMUP_CONNECT": "true"},
+}
+DEFAULT_MODE = "lazy-background"
+
+
+def run_child(mode: str):
+    """Cold start the app in this process and print its timings as JSON"""
+    started = time.perf_counter()
+    if mode == "eager":
+        import openai  # noqa: F401
+    import main
+    imported = time.perf_counter()
+    import httpx
+
+    async def first_request() -> dict:
+        async with main.app.router.lifespan_context(main.app):
+            ready = time.perf_counter()
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=30) as client:
+                response = await client.post("/api/smart_search", json={"query": "cold start question"})
+            answered = time.perf_counter()
+        return {
+            "import_ms": (imported - started) * 1000,
+            "ready_ms": (ready - started) * 1000,
+            "first_answer_ms": (answered - started) * 1000,
+            "status": response.status_code,
+        }
+
+    print(json.dumps(asyncio.run(first_request())))
+
+
+def cold_start(mode: str) -> dict:
+    from benchmarks.mock_upstreams import backend_env
+
+    env = {**os.environ, **backend_env(MOCK_PORT, LLM_FALLBACKS="", LOG_LEVEL="WARNING", **MODES[mode])}
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", mode],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(top: int) -> list:
+    """(cumulative ms, module) of main and its slowest direct imports"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND_DIR, env={**os.environ, "LOG_LEVEL": "WARNING"}, capture_output=True, text=True, check=True,
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # Nesting is shown as two spaces per level after the separator's own space
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1 or name.strip() == "main":
+            rows.append((int(cumulative) / 1000, name.strip()))
+    return sorted(rows, reverse=True)[:top + 1]
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Cold starts per mode (medians are reported)")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--import-budget-ms", type=float, default=700)
+    parser.add_argument("--ready-budget-ms", type=float, default=800)
+    parser.add_argument("--top", type=int, default=8, help="Slowest imports to list")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return
+
+    from benchmarks.mock_upstreams import ServerThread, create_mock_app
+
+    print("Slowest imports under main (cumulative):")
+    for ms, name in slowest_imports(args.top):
+        print(f"  {ms:7.1f} ms  {name}")
+
+    mock = ServerThread(create_mock_app(search_latency=0.3, llm_latency=0.3), MOCK_PORT).start()
+    medians = {}
+    try:
+        for mode in args.modes.split(","):
+            runs = [cold_start(mode) for _ in range(args.runs)]
+            if any(run["status"] != 200 for run in runs):
+                print(f"{mode}: unexpected status {[run['status'] for run in runs]}")
+            medians[mode] = {key: statistics.median(run[key] for run in runs) for key in ("import_ms", "ready_ms", "first_answer_ms")}
+            result = medians[mode]
+            print(
+                f"{mode:>15}: import {result['import_ms']:6.0f} ms, ready {result['ready_ms']:6.0f} ms, "
+                f"first answer {result['first_answer_ms']:6.0f} ms"
+            )
+    finally:
+        mock.stop()
+
+    if DEFAULT_MODE not in medians:
+        return
+    over = []
+    for key, limit in (("import_ms", args.import_budget_ms), ("ready_ms", args.ready_budget_ms)):
+        value = medians[DEFAULT_MODE][key]
+        print(f"{DEFAULT_MODE} {key[:-3]}: {value:.0f} ms (budget {limit:.0f} ms)")
+        if value > limit:
+            over.append(key[:-3])
+    if over:
+        print(f"OVER BUDGET: {', '.join(over)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,286 @@
+"""
+Offline open-loop load test for the backend
+
+For each scenario this starts the mock upstreams (latency distributions,
+error rates, streaming) on a background thread and the real backend in a
+separate uvicorn process pointed at them, then sends requests at a fixed
+Poisson arrival rate - new requests go out on schedule whether or not
+earlier ones have finished, so overload shows up as latency and errors
+instead of being hidden by a slowed-down client.
+
+Reported per scenario: achieved throughput, p50/p95/p99 latency (time to
+first answer token too, for streaming), status code counts, and the
+backend process's CPU time and peak RSS (read from /proc, Linux only).
+
+Usage (from the backend directory):
+    python benchmarks/loadtest.py                         # all scenarios
+    python benchmarks/loadtest.py --scenarios baseline,stream --duration 10
+    python benchmarks/loadtest.py --save benchmarks/baseline.json
+    python benchmarks/loadtest.py --compare benchmarks/baseline.json
+
+--compare exits with status 1 when a scenario's p95 latency or CPU time per
+request regresses by more than --tolerance (default 20%).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import httpx  # noqa: E402
+
+from benchmarks.mock_upstreams import ServerThread, backend_env, create_mock_app  # noqa: E402
+
+MOCK_PORT = 18087
+APP_PORT = 18088
+
+# name -> mock upstream settings, load shape and extra backend environment
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    "baseline": {
+        "description": "Unique queries, realistic upstream latency",
+        "mock": {"search_latency": "lognormal:0.25:0.4", "llm_latency": "lognormal:0.8:0.4"},
+        "rate": 20, "queries": None, "stream": False,
+    },
+    "cached": {
+        "description": "Small query pool, so most requests hit the caches",
+        "mock": {"search_latency": "lognormal:0.25:0.4", "llm_latency": "lognormal:0.8:0.4"},
+        "rate": 50, "queries": 20, "stream": False,
+    },
+    "stream": {
+        "description": "Streaming endpoint, unique queries",
+        "mock": {"search_latency": "lognormal:0.25:0.4", "llm_latency": "lognormal:0.8:0.4", "answer_words": 60},
+        "rate": 20, "queries": None, "stream": True,
+    },
+    "flaky": {
+        "description": "5% upstream errors and a slow LLM tail",
+        "mock": {
+            "search_latency": "lognormal:0.25:0.6", "llm_latency": "lognormal:0.8:0.8",
+            "search_error_rate": 0.05, "llm_error_rate": 0.05,
+        },
+        "rate": 20, "queries": None, "stream": False,
+    },
+    "overload": {
+        "description": "Offered load far above capacity; goodput and shedding",
+        "mock": {"search_latency": "lognormal:0.25:0.4", "llm_latency": "lognormal:1.5:0.4"},
+        "rate": 150, "queries": None, "stream": False,
+        "env": {"ADMISSION_MAX_PIPELINES": "64", "ADMISSION_QUEUE_SIZE": "32"},
+    },
+}
+
+
+def read_process_usage(pid: int) -> Dict[str, Optional[float]]:
+    """CPU seconds and peak RSS of a process, from /proc (None elsewhere)"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        ticks = os.sysconf("SC_CLK_TCK")
+        cpu = (int(fields[11]) + int(fields[12])) / ticks
+        peak_rss = None
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    peak_rss = int(line.split()[1]) / 1024
+        return {"cpu_seconds": cpu, "peak_rss_mb": peak_rss}
+    except (OSError, ValueError, IndexError):
+        return {"cpu_seconds": None, "peak_rss_mb": None}
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, int(round(pct / 100 * len(ordered))) - 1)]
+
+
+def start_backend(env: Dict[str, str]) -> subprocess.Popen:
+    """Run the backend in its own process so its CPU and memory can be measured"""
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(APP_PORT), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env={**os.environ, **env},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{APP_PORT}/health", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        if process.poll() is not None:
+            break
+        time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Backend did not start; run from the backend directory with its dependencies installed")
+
+
+async def drive(rate: float, duration: float, queries: Optional[int], stream: bool, seed: int) -> Dict[str, Any]:
+    """Open-loop Poisson load for `duration` seconds at `rate` requests/second"""
+    rng = random.Random(seed)
+    latencies: List[float] = []
+    first_tokens: List[float] = []
+    statuses: Counter = Counter()
+    path = "/api/smart_search/stream" if stream else "/api/smart_search"
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=200)
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{APP_PORT}", timeout=60, limits=limits) as client:
+
+        async def one(i: int):
+            query = f"load test query {rng.randrange(queries) if queries else i}"
+            started = time.perf_counter()
+            try:
+                if not stream:
+                    response = await client.post(path, json={"query": query})
+                    statuses[response.status_code] += 1
+                    if response.status_code == 200:
+                        latencies.append(time.perf_counter() - started)
+                    return
+                async with client.stream("POST", path, json={"query": query}) as response:
+                    statuses[response.status_code] += 1
+                    failed = response.status_code != 200
+                    async for line in response.aiter_lines():
+                        if line == "event: delta" and not first_tokens_seen[i]:
+                            first_tokens_seen[i] = True
+                            first_tokens.append(time.perf_counter() - started)
+                        elif line == "event: error":
+                            failed = True
+                    if not failed:
+                        latencies.append(time.perf_counter() - started)
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+
+        first_tokens_seen: Dict[int, bool] = {}
+        tasks = []
+        started = time.perf_counter()
+        next_at = started
+        i = 0
+        while next_at - started < duration:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            first_tokens_seen[i] = False
+            tasks.append(asyncio.ensure_future(one(i)))
+            i += 1
+            next_at += rng.expovariate(rate)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    def ms(value: Optional[float]) -> Optional[float]:
+        return round(value * 1000, 1) if value is not None else None
+
+    return {
+        "offered_rps": rate,
+        "sent": i,
+        "ok": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "status_counts": {str(k): v for k, v in sorted(statuses.items(), key=lambda kv: str(kv[0]))},
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        **({
+            "first_token_p50_ms": ms(percentile(first_tokens, 50)),
+            "first_token_p95_ms": ms(percentile(first_tokens, 95)),
+        } if stream else {}),
+    }
+
+
+def run_scenario(name: str, duration: float, rate_scale: float, seed: int) -> Dict[str, Any]:
+    scenario = SCENARIOS[name]
+    mock = ServerThread(create_mock_app(seed=seed, **scenario["mock"]), MOCK_PORT).start()
+    env = backend_env(
+        MOCK_PORT,
+        DASHSCOPE_API_KEY="",
+        LLM_FALLBACKS="",
+        # Fresh, isolated caches per run
+        SEARCH_CACHE_DB="",
+        **scenario.get("env", {}),
+    )
+    backend = start_backend(env)
+    try:
+        before = read_process_usage(backend.pid)
+        result = asyncio.run(drive(scenario["rate"] * rate_scale, duration, scenario["queries"], scenario["stream"], seed))
+        after = read_process_usage(backend.pid)
+    finally:
+        backend.terminate()
+        backend.wait(timeout=10)
+        mock.stop()
+
+    if before["cpu_seconds"] is not None and after["cpu_seconds"] is not None:
+        cpu = after["cpu_seconds"] - before["cpu_seconds"]
+        result["cpu_seconds"] = round(cpu, 3)
+        result["cpu_ms_per_request"] = round(cpu * 1000 / max(result["sent"], 1), 3)
+    result["peak_rss_mb"] = round(after["peak_rss_mb"], 1) if after["peak_rss_mb"] else None
+    return result
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> bool:
+    """Print per-scenario changes against a saved baseline; False on regression"""
+    ok = True
+    for name, result in results.items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            print(f"{name:>9}: no baseline")
+            continue
+        for metric in ("p95_ms", "cpu_ms_per_request"):
+            old, new = previous.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            regressed = change > tolerance
+            ok = ok and not regressed
+            print(f"{name:>9}: {metric} {old} -> {new} ({change:+.1%}){'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated scenario names")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds of load per scenario")
+    parser.add_argument("--rate-scale", type=float, default=1.0, help="Multiply every scenario's arrival rate")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Compare against a JSON file written by --save")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    names = [n.strip() for n in args.scenarios.split(",") if n.strip()]
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)} (available: {', '.join(SCENARIOS)})")
+
+    results = {}
+    for name in names:
+        print(f"Running {name}: {SCENARIOS[name]['description']} ...", flush=True)
+        results[name] = run_scenario(name, args.duration, args.rate_scale, args.seed)
+        print(json.dumps(results[name], indent=2), flush=True)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+                "settings": {"duration": args.duration, "rate_scale": args.rate_scale, "seed": args.seed},
+                "scenarios": results,
+            }, f, indent=2)
+        print(f"Saved results to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,341 @@
+"""
+Local stand-ins for the SearchCans and OpenAI-compatible APIs
+
+Lets the benchmarks exercise the real request pipeline without network
+access or paid API calls. Each upstream sleeps for a latency drawn from a
+configurable distribution and returns a well-formed payload; chat
+completions also support `stream: true`, and either upstream can be made
+to fail (or the LLM to stall before the first token) for a fraction of
+requests.
+
+Chat completions report usage like OpenAI, including
+prompt_tokens_details.cached_tokens from a simulated prefix cache (hits in
+128-token blocks once a prompt prefix of `prompt_cache_min_tokens` has been
+seen before); streamed completions send it when asked via
+stream_options.include_usage.
+
+With `page_base_url` set, search results link to fixture HTML pages served
+by the same app under /pages/ (for deep retrieval), with ETag and
+Last-Modified revalidation. A few special pages exercise the edge cases:
+/pages/large (several MB), /pages/slow (never finishes in time),
+/pages/binary (not HTML) and /pages/missing (404).
+
+backend_env() is the environment that points the backend at a mock served
+on a given port (set it before importing main, or pass it to a subprocess).
+
+Latencies are given as seconds or as a spec string:
+
+    0.2                 constant
+    uniform:0.1:0.5     uniform between the two bounds
+    lognormal:0.3:0.6   log-normal with median 0.3 s and sigma 0.6
+    exp:0.2             exponential with mean 0.2 s
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from typing import Dict, Optional, Union
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+
+FIXTURE_SENTENCES = (
+    "Result {number} introduces {query} and the problem it was designed to solve.",
+    "The original motivation for {query} came from teams that needed fresher answers than a static index could give.",
+    "Section {part} walks through the architecture: a retriever, a ranking stage and a generator that cites its sources.",
+    "Benchmarks in this article compare {query} against fine-tuning on latency, cost and factual accuracy.",
+    "A common pitfall is stuffing too many documents into the prompt, which dilutes the relevant evidence.",
+    "Practitioners recommend chunking pages into passages of a few hundred tokens before ranking them.",
+    "Caching retrieved pages by URL and validator keeps repeat queries cheap without serving stale content.",
+    "The author measured a drop in hallucinated claims once full pages replaced search snippets.",
+    "Operational concerns include per-host politeness limits, timeouts and pages that never finish loading.",
+    "Security teams should block fetches to private addresses so user queries cannot probe internal services.",
+    "Looking ahead, result {number} expects {query} to merge with long-context models rather than disappear.",
+    "In summary, {query} trades a little latency for answers that are grounded in current sources.",
+)
+
+FIXTURE_PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+  <meta charset="utf-8">
+  <title>{title}</title>
+  <style>body {{ font-family: sans-serif; }} .cookie-banner {{ position: fixed; }}</style>
+  <script>window.analytics = {{ track: function () {{}} }};</script>
+</head>
+<body>
+  <header class="site-header"><a href="/">Example News</a> <a href="/login">Sign in</a></header>
+  <nav class="main-nav"><ul><li><a href="/tech">Technology</a></li><li><a href="/science">Science</a></li></ul></nav>
+  <div class="cookie-banner">We use cookies to improve your experience. <button>Accept all</button></div>
+  <article>
+    <h1>{title}</h1>
+    <p class="byline">By Staff Writer</p>
+    {paragraphs}
+  </article>
+  <aside class="sidebar"><h3>Related</h3><ul><li>Ten tricks for faster websites</li></ul></aside>
+  <footer class="site-footer">Copyright 2024 Example News. All rights reserved.</footer>
+</body>
+</html>
+"""
+
+
+class LatencyModel:
+    """A latency distribution that can be sampled in seconds"""
+
+    def __init__(self, kind: str = "constant", a: float = 0.0, b: float = 0.0):
+        if kind not in ("constant", "uniform", "lognormal", "exp"):
+            raise ValueError(f"Unknown latency distribution: {kind}")
+        self.kind = kind
+        self.a = a
+        self.b = b
+
+    @classmethod
+    def parse(cls, spec: Union[float, int, str, "LatencyModel"]) -> "LatencyModel":
+        if isinstance(spec, LatencyModel):
+            return spec
+        if isinstance(spec, (int, float)):
+            return cls("constant", float(spec))
+        kind, *params = spec.split(":")
+        if not params:
+            return cls("constant", float(kind))
+        values = [float(p) for p in params] + [0.0]
+        return cls(kind, values[0], values[1])
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "uniform":
+            return rng.uniform(self.a, self.b)
+        if self.kind == "lognormal":
+            return rng.lognormvariate(math.log(max(self.a, 1e-6)), self.b)
+        if self.kind == "exp":
+            return rng.expovariate(1 / self.a) if self.a > 0 else 0.0
+        return self.a
+
+    def __repr__(self) -> str:
+        return f"{self.kind}:{self.a}:{self.b}" if self.kind != "constant" else str(self.a)
+
+
+def create_mock_app(
+    search_latency: Union[float, str, LatencyModel] = 0.2,
+    llm_latency: Union[float, str, LatencyModel] = 0.5,
+    llm_stall_rate: float = 0.0,
+    llm_stall: float = 0.0,
+    llm_error_rate: float = 0.0,
+    search_error_rate: float = 0.0,
+    answer_words: int = 6,
+    page_latency: Union[float, str, LatencyModel] = 0.05,
+    page_base_url: Optional[str] = None,
+    search_topic: Optional[str] = None,
+    shuffle_results: bool = False,
+    prompt_cache_min_tokens: int = 1024,
+    seed: Optional[int] = None
+) -> FastAPI:
+    """
+    Build a FastAPI app serving fake SearchCans and chat completion endpoints
+
+    Args:
+        search_latency: Latency of /api/search (seconds or distribution spec)
+        llm_latency: Latency of /v1/chat/completions (seconds or distribution spec);
+            streamed answers spread it across the tokens
+        llm_stall_rate: Fraction of completions that stall before the first token
+        llm_stall: Extra seconds a stalled completion waits
+        llm_error_rate: Fraction of completions answered with HTTP 500
+        search_error_rate: Fraction of searches answered with HTTP 500
+        answer_words: Number of words (stream chunks) in every answer
+        page_latency: Latency of /pages/ fixture pages (seconds or distribution spec)
+        page_base_url: URL this app is served at; search results then link to its fixture pages
+        search_topic: Write every result about this topic instead of the query
+            (different questions over the same sources)
+        shuffle_results: Return the results in a random order on every call
+        prompt_cache_min_tokens: Shortest prompt prefix the simulated prompt cache serves
+        seed: Seed for the latency / stall / error draws
+
+    Returns:
+        FastAPI application
+    """
+    mock = FastAPI()
+    rng = random.Random(seed)
+    search_latency = LatencyModel.parse(search_latency)
+    llm_latency = LatencyModel.parse(llm_latency)
+    page_latency = LatencyModel.parse(page_latency)
+    words = ("Mock answer based on the sources. " * (answer_words // 6 + 1)).split()[:answer_words]
+    prompt_cache = set()
+
+    def usage_for(messages) -> dict:
+        """OpenAI-style usage; cached_tokens from the longest previously seen prompt prefix"""
+        text = "\n".join(str(m.get("content", "")) for m in messages)
+        cached = 0
+        missed = False
+        # ~4 characters per token, cached in 128-token blocks
+        for end in range(prompt_cache_min_tokens * 4, len(text) + 1, 512):
+            key = hashlib.sha1(text[:end].encode("utf-8")).hexdigest()
+            if key in prompt_cache and not missed:
+                cached = end // 4
+            else:
+                missed = True
+                prompt_cache.add(key)
+        prompt_tokens = max(1, len(text) // 4)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(words),
+            "total_tokens": prompt_tokens + len(words),
+            "prompt_tokens_details": {"cached_tokens": cached},
+        }
+
+    @mock.post("/api/search")
+    async def search(request: Request):
+        payload = await request.json()
+        await asyncio.sleep(search_latency.sample(rng))
+        if rng.random() < search_error_rate:
+            return JSONResponse({"code": -1, "msg": "mock upstream failure"}, status_code=500)
+        query = search_topic or payload.get("s", "")
+        results = [
+            {
+                "title": f"Result {i} for {query}",
+                "url": f"{page_base_url}/pages/{i}?q={query}" if page_base_url else f"https://example.com/{i}?q={query}",
+                "content": topic_snippet(i, query) if search_topic else f"Snippet {i} about {query}. " * 8,
+            }
+            for i in range(1, 11)
+        ]
+        if shuffle_results:
+            rng.shuffle(results)
+        return {"code": 0, "msg": "success", "data": results}
+
+    @mock.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        payload = await request.json()
+        if rng.random() < llm_error_rate:
+            return JSONResponse({"error": {"message": "mock upstream failure", "type": "server_error"}}, status_code=500)
+        stall = llm_stall if rng.random() < llm_stall_rate else 0.0
+        latency = llm_latency.sample(rng)
+        if payload.get("stream"):
+            return StreamingResponse(stream_chunks(payload, latency, stall), media_type="text/event-stream")
+        await asyncio.sleep(latency + stall)
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "mock"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(words)},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": usage_for(payload.get("messages", [])),
+        }
+
+    @mock.get("/pages/{name}")
+    async def page(name: str, request: Request, q: str = "the topic"):
+        await asyncio.sleep(page_latency.sample(rng))
+        if name == "slow":
+            await asyncio.sleep(30)
+        if name == "binary":
+            return Response(b"%PDF-1.4 mock", media_type="application/pdf")
+        if name == "large":
+            # Chunked, without Content-Length, so only a streaming byte cap stops it
+            chunk = "<p>Filler paragraph that goes on and on without saying anything new.</p>" * 1000
+            return StreamingResponse((chunk for _ in range(100)), media_type="text/html")
+        if not name.isdigit():
+            return JSONResponse({"detail": "Not Found"}, status_code=404)
+
+        body = fixture_page(int(name), q)
+        etag = '"' + hashlib.sha1(body.encode("utf-8")).hexdigest()[:16] + '"'
+        headers = {"ETag": etag, "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT", "Cache-Control": "max-age=60"}
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+        return HTMLResponse(body, headers=headers)
+
+    async def stream_chunks(payload, latency: float, stall: float = 0.0):
+        await asyncio.sleep(stall)
+        for i, word in enumerate(words):
+            # Spread the total latency across the tokens
+            await asyncio.sleep(latency / len(words))
+            chunk = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": payload.get("model", "mock"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"content": word if i == 0 else " " + word},
+                        "finish_reason": None,
+                    }
+                ],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            chunk = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": payload.get("model", "mock"),
+                "choices": [],
+                "usage": usage_for(payload.get("messages", [])),
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return mock
+
+
+def topic_snippet(number: int, query: str) -> str:
+    """A distinct three-sentence snippet per result (survives near-duplicate removal)"""
+    picks = (number - 1, number + 3, number + 6)
+    return " ".join(
+        FIXTURE_SENTENCES[pick % len(FIXTURE_SENTENCES)].format(number=number, query=query, part=number)
+        for pick in picks
+    )
+
+
+def fixture_page(number: int, query: str) -> str:
+    """Article page about `query`, wrapped in typical navigation / cookie / footer chrome"""
+    paragraphs = "\n    ".join(
+        f"<p>{sentence.format(query=query, number=number, part=part)}</p>"
+        for part, sentence in enumerate(FIXTURE_SENTENCES, 1)
+    )
+    return FIXTURE_PAGE.format(title=f"Result {number} for {query}", paragraphs=paragraphs)
+
+
+def backend_env(port: int, **overrides: str) -> Dict[str, str]:
+    """
+    Backend environment using the mock upstreams served on `port`
+
+    Args:
+        port: Port the mock app listens on (127.0.0.1)
+        overrides: Further backend settings, e.g. SEARCH_CACHE_ENABLED="false"
+    """
+    return {
+        "SEARCHCANS_API_ENDPOINT": f"http://127.0.0.1:{port}/api/search",
+        "SEARCHCANS_API_KEY": "bench-searchcans-key",
+        "OPENAI_API_KEY": "bench-openai-key",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{port}/v1",
+        **overrides,
+    }
+
+
+class ServerThread:
+    """Run a uvicorn server on a background thread"""
+
+    def __init__(self, app, port: int, host: str = "127.0.0.1"):
+        config = uvicorn.Config(app, host=host, port=port, log_level="warning", lifespan="on")
+        self.server = uvicorn.Server(config)
+        self.thread: Optional[threading.Thread] = None
+        self.url = f"http://{host}:{port}"
+
+    def start(self) -> "ServerThread":
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.05)
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+        if self.thread:
+            self.thread.join(timeout=5)
@@ -0,0 +1,300 @@
+"""
+Pooled HTTP / LLM client registry
+
+Keeps one long-lived client (and therefore one keep-alive connection pool)
+per (provider, base_url, api_key hash) instead of building a new client,
+and paying a new TCP+TLS handshake, on every request.
+
+- Server default keys are pinned for the lifetime of the process
+- User-supplied keys are held in an LRU with a configurable bound
+- User-key clients unused for longer than the idle TTL are closed by a sweeper
+- Clients are leased, so eviction never closes a client mid-request
+- The provider SDK is imported on first use, or by warm_up() during
+  startup, so importing this module stays cheap (openai alone takes
+  several hundred milliseconds to import)
+"""
+
+import asyncio
+import hashlib
+import importlib.util
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Optional, Set, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+ClientKey = Tuple[str, str, str]
+
+
+def hash_api_key(api_key: Optional[str]) -> str:
+    """Short, non-reversible fingerprint of an API key (safe for logs and keys)"""
+    if not api_key:
+        return "none"
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+@lru_cache(maxsize=1)
+def load_openai() -> Any:
+    """The AsyncOpenAI class, importing the openai SDK on first call"""
+    from openai import AsyncOpenAI
+    return AsyncOpenAI
+
+
+def sdk_loaded() -> bool:
+    """Whether the provider SDK has been imported yet"""
+    return load_openai.cache_info().currsize > 0
+
+
+@dataclass
+class PoolSettings:
+    """Connection pool tuning (see env.example for the matching variables)"""
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    idle_ttl: float = 300.0
+    max_user_clients: int = 256
+    http2: bool = True
+    sweep_interval: float = 60.0
+
+    @classmethod
+    def from_env(cls) -> "PoolSettings":
+        return cls(
+            max_connections=int(os.getenv("HTTP_POOL_SIZE", 100)),
+            max_keepalive_connections=int(os.getenv("HTTP_POOL_KEEPALIVE", 20)),
+            keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30)),
+            idle_ttl=float(os.getenv("CLIENT_IDLE_TTL", 300)),
+            max_user_clients=int(os.getenv("CLIENT_MAX_USER_KEYS", 256)),
+            http2=os.getenv("HTTP2_ENABLED", "true").lower() in ("1", "true", "yes"),
+        )
+
+
+@dataclass
+class _Entry:
+    client: Any
+    closer: Callable[[], Any]
+    pinned: bool
+    # The connection pool underneath (the client itself for 'searchcans')
+    http: Optional[httpx.AsyncClient] = None
+    last_used: float = field(default_factory=time.monotonic)
+    in_use: int = 0
+    evicted: bool = False
+
+
+class ClientRegistry:
+    """Registry of pooled, reusable upstream clients"""
+
+    def __init__(self, settings: Optional[PoolSettings] = None):
+        self.settings = settings or PoolSettings()
+        # HTTP/2 needs the optional 'h2' package; fall back to HTTP/1.1 keep-alive
+        self.http2 = self.settings.http2 and importlib.util.find_spec("h2") is not None
+        self._entries: "OrderedDict[ClientKey, _Entry]" = OrderedDict()
+        self._sweeper: Optional[asyncio.Task] = None
+        # Closes of evicted clients still running (referenced so they are not garbage-collected)
+        self._closing: Set[asyncio.Task] = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions_lru = 0
+        self.evictions_idle = 0
+        self.warmup: Dict[str, Any] = {"state": "not_started"}
+
+    # ------------------------------------------------------------------
+    # Client construction
+    # ------------------------------------------------------------------
+
+    def _build_http_client(self, headers: Optional[Dict[str, str]] = None, timeout: float = 15) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=self.settings.max_connections,
+            max_keepalive_connections=self.settings.max_keepalive_connections,
+            keepalive_expiry=self.settings.keepalive_expiry,
+        )
+        return httpx.AsyncClient(limits=limits, http2=self.http2, headers=headers, timeout=timeout)
+
+    def _create(self, provider: str, base_url: str, api_key: str) -> _Entry:
+        if provider == "searchcans":
+            client = self._build_http_client(headers={"Authorization": f"Bearer {api_key}"})
+            return _Entry(client=client, closer=client.aclose, pinned=False, http=client)
+
+        http = self._build_http_client(timeout=600)
+        client = load_openai()(api_key=api_key, base_url=base_url, http_client=http)
+        return _Entry(client=client, closer=client.close, pinned=False, http=http)
+
+    # ------------------------------------------------------------------
+    # Leasing
+    # ------------------------------------------------------------------
+
+    @asynccontextmanager
+    async def lease(self, provider: str, base_url: str, api_key: str, pinned: bool = False) -> AsyncIterator[Any]:
+        """
+        Borrow the pooled client for (provider, base_url, api_key)
+
+        Args:
+            provider: 'searchcans' for the search API, otherwise an LLM provider name
+            base_url: Upstream base URL
+            api_key: API key the client authenticates with
+            pinned: True for server default keys (never LRU-evicted)
+
+        Yields:
+            httpx.AsyncClient for 'searchcans', AsyncOpenAI for LLM providers
+        """
+        if provider != "searchcans" and not sdk_loaded():
+            # First LLM client without warm-up: import the SDK off the event loop
+            await asyncio.to_thread(load_openai)
+        key = (provider, base_url, hash_api_key(api_key))
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            entry = self._create(provider, base_url, api_key)
+            entry.pinned = pinned
+            self._entries[key] = entry
+            self._enforce_lru()
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+
+        entry.in_use += 1
+        entry.last_used = time.monotonic()
+        try:
+            yield entry.client
+        finally:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+            if entry.evicted and entry.in_use == 0:
+                await self._close(entry)
+
+    def _enforce_lru(self):
+        user_keys = [k for k, e in self._entries.items() if not e.pinned]
+        overflow = len(user_keys) - self.settings.max_user_clients
+        for key in user_keys[:max(overflow, 0)]:
+            self.evictions_lru += 1
+            self._evict(key)
+
+    def _evict(self, key: ClientKey):
+        entry = self._entries.pop(key)
+        entry.evicted = True
+        if entry.in_use == 0:
+            task = asyncio.ensure_future(self._close(entry))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    async def _close(self, entry: _Entry):
+        try:
+            await entry.closer()
+        except Exception as e:
+            logger.warning("Error while closing pooled client: %s", e)
+
+    # ------------------------------------------------------------------
+    # Lifecycle (driven by the FastAPI lifespan handler)
+    # ------------------------------------------------------------------
+
+    def evict_idle(self) -> int:
+        """Close user-key clients that have not been used within the idle TTL (pinned ones stay open)"""
+        now = time.monotonic()
+        stale = [
+            k for k, e in self._entries.items()
+            if not e.pinned and e.in_use == 0 and now - e.last_used > self.settings.idle_ttl
+        ]
+        for key in stale:
+            self.evictions_idle += 1
+            self._evict(key)
+        return len(stale)
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(self.settings.sweep_interval)
+            evicted = self.evict_idle()
+            if evicted:
+                logger.info("Closed %d idle pooled clients", evicted)
+
+    def start(self):
+        """Start the idle-eviction sweeper"""
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_forever())
+
+    async def warm_up(self, upstreams: Iterable[Tuple[str, str, str]], connect: bool = False, timeout: float = 5.0):
+        """
+        Get the server's pinned clients ready before the first request needs them
+
+        Imports the provider SDK off the event loop, creates a pinned client
+        per upstream and, with connect, opens a keep-alive connection to each
+        (TCP, TLS and HTTP/2 negotiation) with a HEAD request whose status is
+        ignored. Failures are logged and left to the first real request.
+
+        Args:
+            upstreams: (provider, base_url, api_key) of every server default upstream
+            connect: Also open a connection per upstream
+            timeout: Seconds each connection attempt may take
+        """
+        started = time.perf_counter()
+        self.warmup = {"state": "running"}
+        upstreams = list(dict.fromkeys(upstreams))
+        if any(provider != "searchcans" for provider, _, _ in upstreams):
+            await asyncio.to_thread(load_openai)
+        sdk_ms = (time.perf_counter() - started) * 1000
+
+        entries = []
+        for provider, base_url, api_key in upstreams:
+            key = (provider, base_url, hash_api_key(api_key))
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = self._create(provider, base_url, api_key)
+            entry.pinned = True
+            entries.append((base_url, entry))
+
+        connected = 0
+        if connect:
+            async def open_connection(base_url: str, entry: _Entry) -> bool:
+                try:
+                    await entry.http.head(base_url, timeout=timeout)
+                    return True
+                except Exception as e:
+                    logger.warning("Warm-up connection to %s failed: %s", base_url, e)
+                    return False
+
+            results = await asyncio.gather(*(open_connection(url, entry) for url, entry in entries))
+            connected = sum(results)
+
+        self.warmup = {
+            "state": "done",
+            "clients": len(entries),
+            "connected": connected,
+            "sdk_ms": round(sdk_ms, 1),
+            "total_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+        logger.info(
+            "Warm-up done: %d clients, %d connections, SDK import %.0f ms, total %.0f ms",
+            len(entries), connected, sdk_ms, self.warmup["total_ms"]
+        )
+
+    async def aclose(self):
+        """Stop the sweeper and close every pooled client"""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        entries = list(self._entries.values())
+        self._entries.clear()
+        for entry in entries:
+            await self._close(entry)
+        if self._closing:
+            await asyncio.gather(*self._closing)
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool counters for /health"""
+        return {
+            "clients": len(self._entries),
+            "user_clients": sum(1 for e in self._entries.values() if not e.pinned),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions_lru": self.evictions_lru,
+            "evictions_idle": self.evictions_idle,
+            "http2": self.http2,
+            "max_connections": self.settings.max_connections,
+            "sdk_loaded": sdk_loaded(),
+            "warmup": self.warmup,
+        }
@@ -0,0 +1,114 @@
+"""
+Response compression negotiated from Accept-Encoding
+
+Brotli (when the 'brotli' package is installed) or gzip, for complete
+responses of at least `minimum_size` bytes. Streaming responses (SSE,
+NDJSON - anything sent in more than one body chunk) pass through
+untouched, since buffering them in a compressor would delay every event.
+"""
+
+import gzip
+from typing import Dict, List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+UNCOMPRESSIBLE_TYPES = ("image/", "video/", "audio/", "application/zip", "application/gzip")
+
+
+def parse_accept_encoding(value: str) -> Dict[str, float]:
+    """{'gzip': 1.0, 'br': 0.5, ...} from an Accept-Encoding header"""
+    encodings = {}
+    for part in value.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            encodings[name.strip().lower()] = quality
+    return encodings
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Preferred supported encoding, brotli winning ties"""
+    accepted = parse_accept_encoding(accept_encoding)
+    wildcard = accepted.get("*", 0.0)
+    candidates: List[tuple] = []
+    if brotli is not None:
+        candidates.append((accepted.get("br", wildcard), 1, "br"))
+    candidates.append((accepted.get("gzip", wildcard), 0, "gzip"))
+    quality, _, encoding = max(candidates)
+    return encoding if quality > 0 else None
+
+
+class CompressionMiddleware:
+    """Compress complete, large-enough responses with br or gzip"""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        passthrough = False
+
+        async def send_wrapper(message: Message):
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                # Hold the headers until the first body chunk shows whether this is a stream
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            if start is not None:
+                headers = MutableHeaders(raw=start["headers"])
+                pending, start = start, None
+                body = message.get("body", b"")
+                content_type = headers.get("content-type", "")
+                if (
+                    message.get("more_body", False)
+                    or len(body) < self.minimum_size
+                    or "content-encoding" in headers
+                    or content_type.startswith(UNCOMPRESSIBLE_TYPES)
+                ):
+                    passthrough = True
+                    await send(pending)
+                    await send(message)
+                    return
+
+                compressed = self.compress(body, encoding)
+                headers["content-encoding"] = encoding
+                headers["content-length"] = str(len(compressed))
+                headers.add_vary_header("Accept-Encoding")
+                await send(pending)
+                await send({"type": "http.response.body", "body": compressed})
+                return
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    def compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level)
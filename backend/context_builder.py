@@ -0,0 +1,204 @@
+"""
+Token-budgeted context assembly
+
+Turns raw search results into the prompt context:
+
+1. Score every passage against the query with BM25 (vectorized with NumPy)
+2. Drop near-duplicate passages (cosine similarity of hashed n-gram vectors)
+3. Greedily pack the best passages into the model's token budget,
+   truncating the last one at a word boundary if it does not fit whole
+4. Lay the packed passages out in canonical-URL order, so the same sources
+   always produce the same prompt text (provider prompt caches match on an
+   exact prefix, and relevance order changes with every query wording)
+
+Token counts come from a fast local estimator, not a real tokenizer, so
+budgets should keep some headroom below the model's actual limit.
+"""
+
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from answer_cache import embed_query
+from retrieval import normalize_url
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+# CJK, Hangul, Kana etc. are roughly one token per character
+WIDE_CHAR_RE = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+
+DEFAULT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 3000))
+# 'url': canonical URL order (prompt-cache friendly); 'relevance': best passage first
+SOURCE_ORDER = os.getenv("PROMPT_SOURCE_ORDER", "url").lower()
+
+# Context budget per model (prompt context only, not the whole window)
+MODEL_TOKEN_BUDGETS = {
+    "gpt-4o-mini": 6000,
+    "gpt-4o": 6000,
+    "gpt-3.5-turbo": 2500,
+    "qwen-plus": 6000,
+    "qwen-turbo": 4000,
+    "qwen-max": 4000,
+}
+
+MIN_TRUNCATED_TOKENS = 48
+DUPLICATE_SIMILARITY = 0.9
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate token count: ~4 characters per token, 1 per CJK character"""
+    if not text:
+        return 0
+    wide = len(WIDE_CHAR_RE.findall(text))
+    return wide + (len(text) - wide + 3) // 4
+
+
+def token_budget_for(model: Optional[str]) -> int:
+    return MODEL_TOKEN_BUDGETS.get(model or "", DEFAULT_TOKEN_BUDGET)
+
+
+def tokenize(text: str) -> List[str]:
+    return WORD_RE.findall(text.casefold())
+
+
+def bm25_scores(query: str, passages: List[str], k1: float = 1.5, b: float = 0.75) -> np.ndarray:
+    """
+    BM25 score of each passage for the query
+
+    Args:
+        query: Query text
+        passages: Passage texts
+
+    Returns:
+        float array of shape (len(passages),)
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not passages or not terms:
+        return np.zeros(len(passages))
+
+    term_index = {term: i for i, term in enumerate(terms)}
+    tf = np.zeros((len(passages), len(terms)), dtype=np.float32)
+    lengths = np.empty(len(passages), dtype=np.float32)
+    for row, passage in enumerate(passages):
+        tokens = tokenize(passage)
+        lengths[row] = len(tokens)
+        for token in tokens:
+            col = term_index.get(token)
+            if col is not None:
+                tf[row, col] += 1
+
+    df = (tf > 0).sum(axis=0)
+    idf = np.log(1 + (len(passages) - df + 0.5) / (df + 0.5))
+    norm = k1 * (1 - b + b * lengths / max(lengths.mean(), 1.0))
+    return ((tf * (k1 + 1)) / (tf + norm[:, None]) * idf).sum(axis=1)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to roughly max_tokens at a word boundary"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # Binary search on character length (the estimator is monotonic),
+    # keeping one token for the trailing ellipsis
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens - 1:
+            lo = mid
+        else:
+            hi = mid - 1
+    cut = text[:lo]
+    space = cut.rfind(" ")
+    if space > lo * 0.8:
+        cut = cut[:space]
+    return cut.rstrip() + " ..."
+
+
+def build_context(
+    results: List[Dict[str, Any]],
+    query: str,
+    token_budget: int,
+    order: Optional[str] = None
+) -> Tuple[str, List[str], Dict[str, Any]]:
+    """
+    Rank, deduplicate and pack search results into a token budget
+
+    Args:
+        results: SearchCans result dicts (title, url, content)
+        query: User query the passages are scored against
+        token_budget: Max estimated tokens of context
+        order: 'url' or 'relevance' layout of the packed passages (default: PROMPT_SOURCE_ORDER)
+
+    Returns:
+        (context_text, source_links, report)
+    """
+    passages = [
+        r for r in results
+        if r.get("content") and r.get("url")
+    ]
+    report = {
+        "token_budget": token_budget,
+        "passages_total": len(passages),
+        "duplicates_removed": 0,
+        "passages_used": 0,
+        "passages_dropped": 0,
+        "passages_truncated": 0,
+        "context_tokens": 0,
+        "source_order": order or SOURCE_ORDER,
+    }
+    if not passages:
+        return "", [], report
+
+    texts = [f"{p.get('title', '')} {p['content']}" for p in passages]
+    scores = bm25_scores(query, texts)
+    # Stable sort keeps upstream order for equal scores
+    ranked = np.argsort(-scores, kind="stable")
+
+    vectors = np.stack([embed_query(text) for text in texts])
+    kept: List[int] = []
+    for idx in ranked:
+        if kept and float((vectors[kept] @ vectors[idx]).max()) >= DUPLICATE_SIMILARITY:
+            report["duplicates_removed"] += 1
+            continue
+        kept.append(int(idx))
+
+    packed: List[Tuple[int, str, str, str]] = []
+    used_tokens = 0
+    for idx in kept:
+        passage = passages[idx]
+        title = passage.get("title", "No title")
+        url = passage["url"]
+        content = passage["content"]
+        header = f"[Source {len(packed) + 1}] {title}\n"
+        footer = f"\nURL: {url}"
+        overhead = estimate_tokens(header) + estimate_tokens(footer) + 1
+        remaining = token_budget - used_tokens - overhead
+        content_tokens = estimate_tokens(content)
+
+        if content_tokens > remaining:
+            if remaining < MIN_TRUNCATED_TOKENS:
+                report["passages_dropped"] += 1
+                continue
+            content = truncate_to_tokens(content, remaining)
+            content_tokens = estimate_tokens(content)
+            report["passages_truncated"] += 1
+
+        packed.append((idx, title, url, content))
+        used_tokens += overhead + content_tokens
+
+    if report["source_order"] == "url":
+        # Upstream position breaks ties between passages of the same page
+        packed.sort(key=lambda item: (normalize_url(item[2]), item[0]))
+
+    context_parts = []
+    source_links = []
+    seen_urls = set()
+    for number, (_, title, url, content) in enumerate(packed, 1):
+        context_parts.append(f"[Source {number}] {title}\n{content}\nURL: {url}")
+        if url not in seen_urls:
+            seen_urls.add(url)
+            source_links.append(url)
+
+    report["passages_used"] = len(context_parts)
+    report["context_tokens"] = used_tokens
+    return "\n\n".join(context_parts), source_links, report
@@ -0,0 +1,170 @@
+"""
+Per-request deadlines
+
+Every search request gets one end-to-end budget: the X-Request-Deadline-Ms
+header or the request's deadline_ms field, else REQUEST_DEADLINE_MS. It is
+kept as an absolute monotonic deadline in a contextvar (like the request
+ID in logging_config), so it follows the request into every task it
+spawns, and each stage asks how much of it is left:
+
+- upstream calls get the remaining budget as their timeout (and SearchCans
+  as its server-side wait), instead of fixed timeouts of their own
+- optional stages (deep retrieval) only get what is left after the reserve
+  kept for the LLM, and are skipped when there is none
+- when too little is left for the LLM, or the answer does not finish in
+  time, the response degrades to the sources (plus any partial answer)
+
+Work stops as soon as the deadline passes, and a request whose client has
+disconnected is cancelled, so nothing keeps running for an answer nobody
+will read.
+"""
+
+import asyncio
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Optional, TypeVar
+
+T = TypeVar("T")
+
+DEADLINE_HEADER = "x-request-deadline-ms"
+
+# Server default and upper bound for a request's budget
+DEFAULT_DEADLINE_MS = int(os.getenv("REQUEST_DEADLINE_MS", 30000))
+MAX_DEADLINE_MS = int(os.getenv("REQUEST_DEADLINE_MAX_MS", 120000))
+# Budget kept back for the LLM when deciding whether optional stages may run
+LLM_RESERVE_MS = int(os.getenv("DEADLINE_LLM_RESERVE_MS", 3000))
+# Below this, the LLM is not called at all and only the sources are returned
+LLM_MIN_MS = int(os.getenv("DEADLINE_LLM_MIN_MS", 500))
+
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed before a stage could finish"""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Request deadline exceeded during {stage}")
+        self.stage = stage
+
+
+class ClientDisconnected(Exception):
+    """The client went away before its response was ready"""
+
+
+def resolve_budget_ms(field_ms: Optional[int] = None, header: Optional[str] = None) -> int:
+    """
+    The request's budget: the body field, else the header, else the default
+
+    Invalid header values (including inf / nan) are ignored; everything is capped at MAX_DEADLINE_MS.
+    """
+    budget_ms = field_ms
+    if budget_ms is None and header:
+        try:
+            budget_ms = int(float(header))
+        except (ValueError, OverflowError):
+            budget_ms = None
+    if budget_ms is None or budget_ms <= 0:
+        budget_ms = DEFAULT_DEADLINE_MS
+    return min(budget_ms, MAX_DEADLINE_MS)
+
+
+def bind_deadline(budget_ms: int) -> float:
+    """Start the current request's budget; returns the absolute monotonic deadline"""
+    deadline = time.monotonic() + budget_ms / 1000
+    _deadline.set(deadline)
+    return deadline
+
+
+def clear_deadline():
+    """Drop the deadline for the rest of the current task (work shared by requests with different budgets)"""
+    _deadline.set(None)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left until the deadline (None when no deadline is set)"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+def budget(default: float, reserve: float = 0.0) -> float:
+    """
+    Timeout for a step: its own default, cut to what is left of the deadline
+
+    Args:
+        default: The step's usual timeout in seconds
+        reserve: Seconds to keep back for later stages
+    """
+    left = remaining()
+    if left is None:
+        return default
+    return max(0.0, min(default, left - reserve))
+
+
+async def within(awaitable: Awaitable[T], stage: str) -> T:
+    """Await with the remaining budget as timeout"""
+    left = remaining()
+    if left is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, left)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(stage) from None
+
+
+async def iterate_within(iterator: AsyncIterator[T], stage: str) -> AsyncIterator[T]:
+    """
+    Re-yield an async iterator, giving up when the deadline passes
+
+    Each item is awaited with the remaining budget as timeout, so a stream
+    that stalls is abandoned (and closed) at the deadline.
+    """
+    iterator = iterator.__aiter__()
+    try:
+        while True:
+            left = remaining()
+            try:
+                if left is None:
+                    item = await iterator.__anext__()
+                else:
+                    item = await asyncio.wait_for(iterator.__anext__(), left)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded(stage) from None
+            yield item
+    finally:
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+async def cancel_on_disconnect(receive: Any, awaitable: Awaitable[T]) -> T:
+    """
+    Await a request's work, cancelling it when the client disconnects
+
+    Args:
+        receive: The request's ASGI receive channel (its body already read)
+        awaitable: The work producing the response
+
+    Raises:
+        ClientDisconnected: When the client went away first (the work is cancelled)
+    """
+    work = asyncio.ensure_future(awaitable)
+
+    async def disconnected():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    watcher = asyncio.ensure_future(disconnected())
+    try:
+        done, _ = await asyncio.wait({work, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        if not work.done():
+            work.cancel()
+    if work not in done:
+        raise ClientDisconnected()
+    return work.result()
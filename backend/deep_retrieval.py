@@ -0,0 +1,594 @@
+"""
+Deep retrieval: full-page fetching and main-text extraction
+
+Search APIs only return a short snippet per result. When enabled, the top
+results' pages are fetched and their main text replaces the snippet as a
+set of passages, which the context builder then ranks and packs like any
+other result.
+
+- Pages are fetched concurrently under one deadline, with a per-host
+  connection limit, streaming reads and a byte cap per page
+- HTML is parsed in a process pool, so extraction never blocks the event loop
+- Extracted text is cached by URL; stale entries are revalidated with
+  If-None-Match / If-Modified-Since, so unchanged pages (304) are not re-parsed
+- Only public addresses are fetched: redirects are followed by hand and
+  every hop is checked, and hostnames are resolved and checked at connect
+  time, so neither a redirect nor a DNS answer can reach an internal service
+"""
+
+import asyncio
+import ipaddress
+import logging
+import os
+import re
+import socket
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = "Mozilla/5.0 (compatible; IntelliSearchBot/1.0)"
+HTML_TYPES = ("text/html", "application/xhtml+xml", "text/plain")
+
+# Never part of the main text
+SKIP_TAGS = {
+    "script", "style", "noscript", "template", "svg", "canvas", "iframe", "title",
+    "nav", "header", "footer", "aside", "form", "button", "select", "textarea",
+}
+BLOCK_TAGS = {
+    "p", "div", "li", "ul", "ol", "h1", "h2", "h3", "h4", "h5", "h6", "br", "hr",
+    "article", "section", "main", "blockquote", "pre", "tr", "td", "th", "dd", "dt",
+    "figcaption", "table",
+}
+MAIN_TAGS = {"article", "main"}
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+# class / id fragments of page chrome (menus, cookie banners, share bars, ...)
+BOILERPLATE_RE = re.compile(
+    r"(^|[\s_-])(nav|navbar|menu|footer|header|sidebar|cookie|consent|banner|advert|ads|share|social|comments?|related|breadcrumbs?|newsletter|popup|modal)([\s_-]|$)",
+    re.IGNORECASE,
+)
+WHITESPACE_RE = re.compile(r"\s+")
+MIN_BLOCK_WORDS = 5
+# CJK text has no spaces between words, so long enough blocks are kept regardless
+MIN_BLOCK_CHARS = 25
+MIN_MAIN_CHARS = 200
+MAX_REDIRECTS = 3
+
+
+class _MainTextParser(HTMLParser):
+    """Collect text blocks, skipping page chrome, and note which are inside <article>/<main>"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks: List[Tuple[str, bool, bool]] = []
+        self._buffer: List[str] = []
+        self._skip_stack: List[str] = []
+        self._main_depth = 0
+        self._heading = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in VOID_TAGS:
+            if tag in BLOCK_TAGS and not self._skip_stack:
+                self._flush()
+            return
+        if self._skip_stack:
+            self._skip_stack.append(tag)
+            return
+        attrs = dict(attrs)
+        marker = f"{attrs.get('class') or ''} {attrs.get('id') or ''} {attrs.get('role') or ''}"
+        if tag in SKIP_TAGS or (tag not in MAIN_TAGS and BOILERPLATE_RE.search(marker)):
+            self._flush()
+            self._skip_stack.append(tag)
+            return
+        if tag in BLOCK_TAGS:
+            self._flush()
+            self._heading = tag in ("h1", "h2", "h3", "h4", "h5", "h6")
+        if tag in MAIN_TAGS:
+            self._main_depth += 1
+
+    def handle_endtag(self, tag):
+        if self._skip_stack:
+            # Pop up to the matching start tag (tolerates unclosed inner tags)
+            if tag in self._skip_stack:
+                while self._skip_stack.pop() != tag:
+                    pass
+            return
+        if tag in BLOCK_TAGS:
+            self._flush()
+        if tag in MAIN_TAGS and self._main_depth:
+            self._main_depth -= 1
+
+    def handle_data(self, data):
+        if not self._skip_stack:
+            self._buffer.append(data)
+
+    def _flush(self):
+        text = WHITESPACE_RE.sub(" ", "".join(self._buffer)).strip()
+        self._buffer = []
+        if text:
+            self.blocks.append((text, self._main_depth > 0, self._heading))
+        self._heading = False
+
+    def close(self):
+        super().close()
+        self._flush()
+
+
+def extract_main_text(html: str, max_chars: int = 8000) -> str:
+    """
+    Main text of an HTML page, one block per line
+
+    Scripts, styles and page chrome (nav, header, footer, sidebars, cookie
+    banners) are dropped, as are short blocks (menus, bylines, buttons)
+    other than headings. When the page has an <article> or <main> with
+    enough text, only that is kept.
+
+    Runs in a worker process, so it must stay a picklable module-level function.
+    """
+    parser = _MainTextParser()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception:
+        # html.parser is lenient, but keep whatever was collected before a failure
+        parser._flush()
+
+    blocks = [
+        (text, in_main) for text, in_main, heading in parser.blocks
+        if heading or len(text) >= MIN_BLOCK_CHARS or len(text.split()) >= MIN_BLOCK_WORDS
+    ]
+    main_blocks = [text for text, in_main in blocks if in_main]
+    if sum(len(text) for text in main_blocks) >= MIN_MAIN_CHARS:
+        texts = main_blocks
+    else:
+        texts = [text for text, _ in blocks]
+
+    lines = []
+    used = 0
+    for text in texts:
+        if used + len(text) > max_chars:
+            remaining = max_chars - used
+            if remaining > 80:
+                lines.append(text[:remaining].rsplit(" ", 1)[0] + " ...")
+            break
+        lines.append(text)
+        used += len(text) + 1
+    return "\n".join(lines)
+
+
+def split_passages(text: str, passage_chars: int = 1200) -> List[str]:
+    """Group extracted lines into passages of about passage_chars characters"""
+    passages = []
+    current: List[str] = []
+    size = 0
+    for line in text.split("\n"):
+        if current and size + len(line) > passage_chars:
+            passages.append(" ".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        passages.append(" ".join(current))
+    return passages
+
+
+def is_public_address(host: str) -> bool:
+    """Whether an IP address literal is globally routable (IPv4-mapped IPv6 included)"""
+    try:
+        address = ipaddress.ip_address(host.split("%", 1)[0])
+    except ValueError:
+        return False
+    if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped is not None:
+        address = address.ipv4_mapped
+    return address.is_global
+
+
+def is_fetchable_url(url: str, allow_private: bool = False) -> bool:
+    """http(s) URLs only, and no loopback / private addresses unless allowed"""
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return False
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return False
+    if allow_private:
+        return True
+    host = parts.hostname.lower()
+    if host == "localhost" or host.endswith(".localhost") or host.endswith(".local"):
+        return False
+    try:
+        ipaddress.ip_address(host.split("%", 1)[0])
+    except ValueError:
+        # A name: its addresses are checked when connecting
+        return True
+    return is_public_address(host)
+
+
+class _PublicOnlyBackend:
+    """
+    httpcore network backend that resolves hostnames itself and only connects to public addresses
+
+    Checking the address actually connected to (rather than a lookup made
+    before the request) leaves no window for a DNS answer to change in between.
+    httpcore is imported here, not at module level, as httpx itself does:
+    it costs more import time than the rest of this module.
+    """
+
+    def __init__(self):
+        import httpcore
+        self._backend = httpcore.AnyIOBackend()
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        import httpcore
+        loop = asyncio.get_running_loop()
+        try:
+            infos = await asyncio.wait_for(loop.getaddrinfo(host, port, type=socket.SOCK_STREAM), timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise httpcore.ConnectError(f"cannot resolve {host}: {e}") from e
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        if not addresses or not all(is_public_address(address) for address in addresses):
+            raise PageFetchError("blocked", f"{host} resolves to a non-public address")
+
+        error: Optional[Exception] = None
+        for address in addresses:
+            try:
+                return await self._backend.connect_tcp(address, port, timeout, local_address, socket_options)
+            except httpcore.ConnectError as e:
+                error = e
+        raise error
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        raise PageFetchError("blocked", "unix sockets are not fetched")
+
+    async def sleep(self, seconds):
+        await self._backend.sleep(seconds)
+
+
+class _PublicOnlyTransport(httpx.AsyncHTTPTransport):
+    """httpx transport whose connections go through _PublicOnlyBackend (no proxies)"""
+
+    def __init__(self, limits: httpx.Limits):
+        import httpcore
+        super().__init__(limits=limits, trust_env=False)
+        # httpx has no option for the network backend, so replace the pool it built
+        self._pool = httpcore.AsyncConnectionPool(
+            ssl_context=httpx.create_ssl_context(trust_env=False),
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=limits.keepalive_expiry,
+            network_backend=_PublicOnlyBackend(),
+        )
+
+
+@dataclass
+class DeepRetrievalSettings:
+    """Deep retrieval tuning (see env.example for the matching variables)"""
+    top_k: int = 5
+    per_host_limit: int = 2
+    max_bytes: int = 1_000_000
+    deadline: float = 3.0
+    max_chars: int = 8000
+    passage_chars: int = 1200
+    extract_workers: int = 2
+    cache_size: int = 512
+    cache_ttl: float = 3600.0
+    allow_private: bool = False
+
+    @classmethod
+    def from_env(cls) -> "DeepRetrievalSettings":
+        return cls(
+            top_k=int(os.getenv("DEEP_RETRIEVAL_TOP_K", 5)),
+            per_host_limit=int(os.getenv("DEEP_RETRIEVAL_PER_HOST", 2)),
+            max_bytes=int(os.getenv("DEEP_RETRIEVAL_MAX_BYTES", 1_000_000)),
+            deadline=int(os.getenv("DEEP_RETRIEVAL_DEADLINE_MS", 3000)) / 1000,
+            max_chars=int(os.getenv("DEEP_RETRIEVAL_MAX_CHARS", 8000)),
+            extract_workers=int(os.getenv("DEEP_RETRIEVAL_EXTRACT_WORKERS", min(2, os.cpu_count() or 1))),
+            cache_size=int(os.getenv("DEEP_RETRIEVAL_CACHE_SIZE", 512)),
+            cache_ttl=float(os.getenv("DEEP_RETRIEVAL_CACHE_TTL", 3600)),
+            allow_private=os.getenv("DEEP_RETRIEVAL_ALLOW_PRIVATE", "false").lower() in ("1", "true", "yes"),
+        )
+
+
+@dataclass
+class _Page:
+    text: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+
+
+class PageFetchError(Exception):
+    """A page could not be used (HTTP error, wrong content type, ...)"""
+
+    def __init__(self, status: str, detail: str):
+        super().__init__(detail)
+        self.status = status
+
+
+class PageFetcher:
+    """Fetch, extract and cache the main text of result pages"""
+
+    def __init__(self, settings: Optional[DeepRetrievalSettings] = None):
+        self.settings = settings or DeepRetrievalSettings()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+        self._cache: "OrderedDict[str, _Page]" = OrderedDict()
+        self.pages_fetched = 0
+        self.cache_hits = 0
+        self.not_modified = 0
+        self.errors = 0
+        self.late = 0
+        self.truncated = 0
+        self.bytes_read = 0
+        self.extract_seconds = 0.0
+
+    @classmethod
+    def from_env(cls) -> Optional["PageFetcher"]:
+        """Fetcher configured from the environment, or None if deep retrieval is disabled"""
+        if os.getenv("DEEP_RETRIEVAL_ENABLED", "false").lower() not in ("1", "true", "yes"):
+            return None
+        return cls(DeepRetrievalSettings.from_env())
+
+    # ------------------------------------------------------------------
+    # Fetching
+    # ------------------------------------------------------------------
+
+    def _http_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            limits = httpx.Limits(max_connections=max(self.settings.top_k * self.settings.per_host_limit, 10))
+            # Redirects are followed in _open, so every hop is checked
+            self._client = httpx.AsyncClient(
+                follow_redirects=False,
+                timeout=httpx.Timeout(self.settings.deadline, connect=min(self.settings.deadline, 2.0)),
+                limits=limits,
+                transport=None if self.settings.allow_private else _PublicOnlyTransport(limits),
+                headers={"User-Agent": USER_AGENT, "Accept": "text/html,application/xhtml+xml;q=0.9,text/plain;q=0.5"},
+            )
+        return self._client
+
+    def _host_slot(self, url: str) -> asyncio.Semaphore:
+        host = (urlsplit(url).hostname or "").lower()
+        slot = self._host_slots.get(host)
+        if slot is None:
+            if len(self._host_slots) >= 1024:
+                # Forget idle hosts so the table stays bounded
+                for name in [h for h, s in self._host_slots.items() if not s.locked()]:
+                    del self._host_slots[name]
+            slot = self._host_slots[host] = asyncio.Semaphore(self.settings.per_host_limit)
+        return slot
+
+    async def _open(self, url: str, headers: Dict[str, str]) -> httpx.Response:
+        """
+        Send a streaming GET, following up to MAX_REDIRECTS redirects
+
+        Every hop must pass is_fetchable_url; the caller closes the response.
+        """
+        client = self._http_client()
+        for _ in range(MAX_REDIRECTS + 1):
+            if not is_fetchable_url(url, self.settings.allow_private):
+                raise PageFetchError("blocked", f"not fetchable: {url}")
+            response = await client.send(client.build_request("GET", url, headers=headers), stream=True)
+            if not response.has_redirect_location:
+                return response
+            await response.aclose()
+            url = urljoin(url, response.headers["location"])
+        raise PageFetchError("error", f"more than {MAX_REDIRECTS} redirects")
+
+    async def _download(self, url: str, cached: Optional[_Page]) -> Tuple[Optional[str], Dict[str, Any]]:
+        """
+        Stream the page body up to max_bytes
+
+        Returns:
+            (html, info): html is None when a cached copy was revalidated (304)
+        """
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+
+        async with self._host_slot(url):
+            response = await self._open(url, headers)
+            try:
+                info = {"etag": response.headers.get("etag"), "last_modified": response.headers.get("last-modified")}
+                if response.status_code == 304 and cached is not None:
+                    return None, info
+                if response.status_code >= 400:
+                    raise PageFetchError("error", f"HTTP {response.status_code}")
+                content_type = response.headers.get("content-type", "text/html").split(";")[0].strip().lower()
+                if content_type not in HTML_TYPES:
+                    raise PageFetchError("skipped", f"unsupported content type {content_type}")
+                declared = response.headers.get("content-length")
+                if declared and declared.isdigit() and int(declared) > self.settings.max_bytes * 4:
+                    raise PageFetchError("skipped", f"page too large ({declared} bytes)")
+
+                chunks = []
+                size = 0
+                truncated = False
+                async for chunk in response.aiter_bytes():
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size >= self.settings.max_bytes:
+                        truncated = True
+                        break
+                body = b"".join(chunks)[:self.settings.max_bytes]
+                encoding = response.charset_encoding or "utf-8"
+            finally:
+                await response.aclose()
+
+        self.bytes_read += len(body)
+        if truncated:
+            self.truncated += 1
+        info.update(bytes=len(body), truncated=truncated)
+        try:
+            return body.decode(encoding, errors="replace"), info
+        except LookupError:
+            return body.decode("utf-8", errors="replace"), info
+
+    async def _extract(self, html: str) -> str:
+        started = time.perf_counter()
+        try:
+            if self.settings.extract_workers <= 0:
+                return await asyncio.to_thread(extract_main_text, html, self.settings.max_chars)
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.settings.extract_workers)
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(self._pool, extract_main_text, html, self.settings.max_chars)
+            except BrokenProcessPool:
+                logger.warning("Extraction process pool broke, restarting it")
+                self._pool = None
+                return await asyncio.to_thread(extract_main_text, html, self.settings.max_chars)
+        finally:
+            self.extract_seconds += time.perf_counter() - started
+
+    async def fetch_text(self, url: str) -> Tuple[str, Dict[str, Any]]:
+        """
+        Main text of one page, from the cache when it is fresh
+
+        Returns:
+            (text, info): info has the status (ok / cached / not_modified) and sizes
+
+        Raises:
+            PageFetchError, httpx.HTTPError
+        """
+        cached = self._cache.get(url)
+        now = time.time()
+        if cached is not None:
+            self._cache.move_to_end(url)
+            if now - cached.fetched_at < self.settings.cache_ttl:
+                self.cache_hits += 1
+                return cached.text, {"status": "cached"}
+
+        html, info = await self._download(url, cached)
+        if html is None:
+            self.not_modified += 1
+            cached.fetched_at = now
+            return cached.text, {"status": "not_modified"}
+
+        self.pages_fetched += 1
+        text = await self._extract(html)
+        self._cache[url] = _Page(text, info["etag"], info["last_modified"], now)
+        self._cache.move_to_end(url)
+        while len(self._cache) > self.settings.cache_size:
+            self._cache.popitem(last=False)
+        return text, {"status": "ok", "bytes": info["bytes"], "truncated": info["truncated"]}
+
+    async def enrich(self, results: List[Dict[str, Any]], deadline: Optional[float] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Replace the top results' snippets with passages of their full pages
+
+        Pages that fail, are not HTML or miss the deadline keep their snippet.
+
+        Args:
+            results: SearchCans result dicts (title, url, content), in rank order
+            deadline: Seconds left for this step, if less than the configured deadline
+
+        Returns:
+            (results, report): new result list and per-page outcomes
+        """
+        started = time.perf_counter()
+        deadline = self.settings.deadline if deadline is None else max(0.0, min(deadline, self.settings.deadline))
+        targets = []
+        for index, result in enumerate(results):
+            url = result.get("url")
+            if url and is_fetchable_url(url, self.settings.allow_private):
+                targets.append(index)
+            if len(targets) >= self.settings.top_k:
+                break
+
+        finished_at: Dict[int, float] = {}
+
+        async def timed(index: int):
+            try:
+                return await self.fetch_text(results[index]["url"])
+            finally:
+                finished_at[index] = time.perf_counter()
+
+        tasks = {asyncio.ensure_future(timed(index)): index for index in targets}
+        pending = set()
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=deadline)
+        for task in pending:
+            task.cancel()
+
+        passages_by_index: Dict[int, List[str]] = {}
+        pages = []
+        for task, index in tasks.items():
+            entry: Dict[str, Any] = {"url": results[index]["url"]}
+            if task in pending:
+                self.late += 1
+                entry.update(status="late", elapsed_ms=int(deadline * 1000))
+            else:
+                entry["elapsed_ms"] = int((finished_at[index] - started) * 1000)
+                error = task.exception()
+                if error is not None:
+                    self.errors += 1
+                    entry.update(status=getattr(error, "status", "error"), error=str(error) or type(error).__name__)
+                else:
+                    text, info = task.result()
+                    entry.update(info)
+                    entry["chars"] = len(text)
+                    passages = split_passages(text, self.settings.passage_chars) if text else []
+                    if passages:
+                        passages_by_index[index] = passages
+            pages.append(entry)
+
+        enriched = []
+        for index, result in enumerate(results):
+            passages = passages_by_index.get(index)
+            if not passages:
+                enriched.append(result)
+                continue
+            for passage in passages:
+                enriched.append({**result, "content": passage, "snippet": result.get("content", "")})
+
+        report = {
+            "mode": "deep",
+            "deadline_ms": int(deadline * 1000),
+            "elapsed_ms": int((time.perf_counter() - started) * 1000),
+            "pages": pages,
+            "pages_used": len(passages_by_index),
+            "passages_added": sum(len(p) for p in passages_by_index.values()),
+        }
+        return enriched, report
+
+    # ------------------------------------------------------------------
+    # Lifecycle (driven by the FastAPI lifespan handler)
+    # ------------------------------------------------------------------
+
+    async def aclose(self):
+        """Close the HTTP client and stop the extraction workers"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Fetch / cache counters for /health"""
+        return {
+            "top_k": self.settings.top_k,
+            "deadline_ms": int(self.settings.deadline * 1000),
+            "extract_workers": self.settings.extract_workers,
+            "cached_pages": len(self._cache),
+            "pages_fetched": self.pages_fetched,
+            "cache_hits": self.cache_hits,
+            "not_modified": self.not_modified,
+            "errors": self.errors,
+            "late": self.late,
+            "truncated": self.truncated,
+            "bytes_read": self.bytes_read,
+            "extract_ms": int(self.extract_seconds * 1000),
+        }
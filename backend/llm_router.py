@@ -0,0 +1,354 @@
+"""
+Hedged LLM requests with provider failover and circuit breakers
+
+Each request has an ordered list of targets (primary first, then backups).
+The router streams from the primary; if no first token has arrived within
+the hedge delay (a percentile of recently observed first-token latency),
+it starts the next target as well. Whichever produces a first token first
+wins and the other attempt is cancelled.
+
+A target that fails before its first token fails over to the next one
+immediately. Provider failures (5xx, 429, timeouts, connection errors)
+feed a per-provider circuit breaker; providers whose breaker is open are
+skipped until the reset timeout allows a trial request. Client errors
+(other 4xx, e.g. a bad user API key) are returned as-is and never trip a
+breaker or trigger failover; local load shedding (admission.Overloaded),
+keys known to be out of quota (ratelimit.QuotaExhausted) and the request's
+own deadline running out (deadlines.DeadlineExceeded) fail over without
+counting against the provider.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional
+
+from admission import Overloaded
+from deadlines import DeadlineExceeded
+from ratelimit import QuotaExhausted
+
+logger = logging.getLogger(__name__)
+
+
+class NoAvailableProvider(Exception):
+    """Every candidate provider has an open circuit breaker"""
+
+
+@dataclass
+class LLMTarget:
+    """One provider/model/key combination a request may be sent to"""
+    provider: str
+    model: str
+    api_key: str
+    base_url: str
+    pinned: bool = True
+
+    @property
+    def name(self) -> str:
+        return f"{self.provider}:{self.model}"
+
+
+def is_client_error(exc: BaseException) -> bool:
+    """4xx other than 429 means the request itself is bad, not the provider"""
+    status_code = getattr(exc, "status_code", None)
+    return status_code is not None and 400 <= status_code < 500 and status_code != 429
+
+
+def is_provider_failure(exc: BaseException) -> bool:
+    """Failures that count against a provider's circuit breaker"""
+    # Local load shedding, local quota checks and the request's own deadline
+    # say nothing about the provider's health
+    return not is_client_error(exc) and not isinstance(exc, (Overloaded, QuotaExhausted, DeadlineExceeded))
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker (closed -> open -> half-open)"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_in_flight:
+            # Let exactly one trial request through
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def release_trial(self):
+        """The trial request ended without telling us anything (cancelled, client error)"""
+        self.trial_in_flight = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                self.times_opened += 1
+            self.opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """Sliding window of recent first-token latencies (seconds)"""
+
+    def __init__(self, window: int = 200):
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def add(self, seconds: float):
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+
+class LLMRouter:
+    """Routes completions across targets with hedging and circuit breakers"""
+
+    def __init__(
+        self,
+        hedging_enabled: bool = True,
+        hedge_percentile: float = 95,
+        default_delay: float = 2.0,
+        min_delay: float = 0.25,
+        max_delay: float = 10.0,
+        min_samples: int = 20,
+        breaker_failures: int = 5,
+        breaker_reset: float = 30.0
+    ):
+        self.hedging_enabled = hedging_enabled
+        self.hedge_percentile = hedge_percentile
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._latency: Dict[str, LatencyTracker] = {}
+        self.hedges_started = 0
+        self.hedges_won = 0
+        self.failovers = 0
+        self.skipped_open = 0
+
+    @classmethod
+    def from_env(cls) -> "LLMRouter":
+        return cls(
+            hedging_enabled=os.getenv("LLM_HEDGING_ENABLED", "true").lower() in ("1", "true", "yes"),
+            hedge_percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", 95)),
+            default_delay=float(os.getenv("LLM_HEDGE_DELAY_MS", 2000)) / 1000,
+            min_delay=float(os.getenv("LLM_HEDGE_MIN_DELAY_MS", 250)) / 1000,
+            max_delay=float(os.getenv("LLM_HEDGE_MAX_DELAY_MS", 10000)) / 1000,
+            breaker_failures=int(os.getenv("LLM_BREAKER_FAILURES", 5)),
+            breaker_reset=float(os.getenv("LLM_BREAKER_RESET_SECONDS", 30)),
+        )
+
+    def breaker(self, provider: str) -> CircuitBreaker:
+        breaker = self._breakers.get(provider)
+        if breaker is None:
+            breaker = self._breakers[provider] = CircuitBreaker(self.breaker_failures, self.breaker_reset)
+        return breaker
+
+    def hedge_delay(self, target: LLMTarget) -> float:
+        """Seconds to wait for the first token before starting a backup"""
+        tracker = self._latency.get(target.name)
+        if tracker is None or len(tracker) < self.min_samples:
+            return self.default_delay
+        return min(self.max_delay, max(self.min_delay, tracker.percentile(self.hedge_percentile)))
+
+    def record_first_token(self, target: LLMTarget, seconds: float):
+        tracker = self._latency.get(target.name)
+        if tracker is None:
+            tracker = self._latency[target.name] = LatencyTracker()
+        tracker.add(seconds)
+
+    def stream(self, targets: List[LLMTarget], open_stream: Callable[[LLMTarget], AsyncIterator[str]]) -> "HedgedStream":
+        """
+        Stream an answer from the best available target
+
+        Args:
+            targets: Primary first, then backups in preference order
+            open_stream: Starts a streaming completion against one target
+
+        Returns:
+            HedgedStream; iterate it for text deltas, read .route for the outcome
+        """
+        return HedgedStream(self, targets, open_stream)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hedging_enabled": self.hedging_enabled,
+            "hedges_started": self.hedges_started,
+            "hedges_won": self.hedges_won,
+            "failovers": self.failovers,
+            "skipped_open_breaker": self.skipped_open,
+            "breakers": {
+                provider: {"state": b.state, "consecutive_failures": b.failures, "times_opened": b.times_opened}
+                for provider, b in self._breakers.items()
+            },
+            "hedge_delay_ms": {
+                name: int(self.hedge_delay(LLMTarget(*name.split(":", 1), api_key="", base_url="")) * 1000)
+                for name in self._latency
+            },
+        }
+
+
+class HedgedStream:
+    """Async iterator of answer deltas produced by the winning target"""
+
+    def __init__(self, router: LLMRouter, targets: List[LLMTarget], open_stream: Callable[[LLMTarget], AsyncIterator[str]]):
+        self.router = router
+        self.targets = targets
+        self.open_stream = open_stream
+        self.route: Dict[str, Any] = {
+            "provider": None,
+            "model": None,
+            "hedged": False,
+            "failover": False,
+            "attempts": [],
+        }
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self._run()
+
+    async def _run(self) -> AsyncIterator[str]:
+        router = self.router
+        queue: List[LLMTarget] = list(self.targets)
+        running: Dict[asyncio.Future, tuple] = {}
+        last_error: Optional[BaseException] = None
+        hedged = False
+
+        def launch() -> bool:
+            # Breakers are checked at launch so a half-open trial is only
+            # claimed by a target that is actually called
+            while queue:
+                target = queue.pop(0)
+                if not router.breaker(target.provider).allow():
+                    router.skipped_open += 1
+                    self.route["attempts"].append({"target": target.name, "outcome": "skipped_open_breaker"})
+                    continue
+                iterator = self.open_stream(target).__aiter__()
+                running[asyncio.ensure_future(iterator.__anext__())] = (target, iterator, time.monotonic())
+                return True
+            return False
+
+        winner = None
+        if not launch():
+            raise NoAvailableProvider("All LLM providers are temporarily unavailable, please try again shortly")
+        if next(iter(running.values()))[0] is not self.targets[0]:
+            self.route["failover"] = True
+        try:
+            while winner is None:
+                if not running:
+                    router.failovers += 1
+                    self.route["failover"] = True
+                    if not launch():
+                        raise last_error
+                    continue
+
+                timeout = None
+                if router.hedging_enabled and queue and not hedged:
+                    target, _, started = next(iter(running.values()))
+                    timeout = max(0.0, router.hedge_delay(target) - (time.monotonic() - started))
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    slow = next(iter(running.values()))[0]
+                    if launch():
+                        self.route["hedged"] = True
+                        router.hedges_started += 1
+                        logger.info("No first token from %s yet, hedged with %s", slow.name, next(reversed(running.values()))[0].name)
+                    continue
+
+                for task in done:
+                    target, iterator, started = running.pop(task)
+                    error = task.exception()
+                    if error is None or isinstance(error, StopAsyncIteration):
+                        first = None if error is not None else task.result()
+                        if winner is None:
+                            winner = (target, iterator, first)
+                            elapsed = time.monotonic() - started
+                            router.record_first_token(target, elapsed)
+                            router.breaker(target.provider).record_success()
+                            self.route["attempts"].append({"target": target.name, "outcome": "won", "first_token_ms": int(elapsed * 1000)})
+                        else:
+                            await self._close(None, iterator)
+                        continue
+
+                    await self._close(None, iterator)
+                    self.route["attempts"].append({"target": target.name, "outcome": "error", "error": str(error)[:200]})
+                    if is_provider_failure(error):
+                        router.breaker(target.provider).record_failure()
+                    else:
+                        router.breaker(target.provider).release_trial()
+                    if is_client_error(error):
+                        raise error
+                    logger.warning("LLM target %s failed before first token: %s", target.name, error)
+                    last_error = error
+        finally:
+            for task, (target, iterator, _) in list(running.items()):
+                if winner is not None:
+                    self.route["attempts"].append({"target": target.name, "outcome": "cancelled"})
+                router.breaker(target.provider).release_trial()
+                await self._close(task, iterator)
+            running.clear()
+
+        target, iterator, first = winner
+        if hedged and target is not self.targets[0]:
+            router.hedges_won += 1
+        self.route["provider"] = target.provider
+        self.route["model"] = target.model
+
+        try:
+            if first is None:
+                return
+            yield first
+            async for delta in iterator:
+                yield delta
+        except (Exception, asyncio.CancelledError) as e:
+            if isinstance(e, Exception) and is_provider_failure(e):
+                router.breaker(target.provider).record_failure()
+            raise
+        finally:
+            await self._close(None, iterator)
+
+    @staticmethod
+    async def _close(task: Optional[asyncio.Future], iterator: AsyncIterator[str]):
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            try:
+                await aclose()
+            except Exception:
+                pass
@@ -0,0 +1,291 @@
+"""
+Structured, non-blocking logging
+
+- Records are put on a bounded in-memory queue by a QueueHandler; a
+  background listener thread formats them and writes them to stderr, so
+  formatting and stream I/O never run on the event loop. When the queue is
+  full, records are dropped (and counted) instead of blocking.
+- Every record carries the request ID of the request that produced it
+  (a contextvar set by RequestIdMiddleware, inherited by the tasks the
+  request spawns), so one request's pipeline stages can be correlated.
+- Sampling is per request: LOG_SAMPLE_RATE of the requests keep their
+  INFO/DEBUG records; warnings and errors are always kept.
+- Output is one JSON object per line (LOG_FORMAT=json, the default) or the
+  classic text format; either way API keys and bearer tokens are redacted.
+
+Log calls on the hot path should pass arguments lazily
+(logger.info("... %s", value)) so that dropped records cost no formatting.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Iterable, List, Optional
+
+from serialization import dumps_str
+
+# Request correlation: the ID, and whether this request's INFO records are kept
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+_request_sampled: ContextVar[bool] = ContextVar("request_sampled", default=True)
+
+REQUEST_ID_HEADER = "x-request-id"
+# Client-supplied IDs are only accepted when they look like IDs
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+
+# API keys and credentials that must never reach the logs
+_SECRET_PATTERNS = [
+    (re.compile(r"\bsk-[A-Za-z0-9_\-]{8,}"), "sk-[REDACTED]"),
+    (re.compile(r"(?i)\b(bearer\s+)[A-Za-z0-9._~+/=\-]{8,}"), r"\1[REDACTED]"),
+    (re.compile(r"""(?i)((?:api[_-]?key|authorization|token)["']?\s*[:=]\s*["']?)[^"'\s,&}]{6,}"""), r"\1[REDACTED]"),
+]
+
+# LogRecord attributes that are not structured extras
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def get_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def bind_request(request_id: Optional[str] = None, sample_rate: Optional[float] = None) -> str:
+    """
+    Start log correlation (and the sampling decision) for the current context
+
+    Args:
+        request_id: Client-supplied ID; replaced by a fresh one unless it looks valid
+        sample_rate: Fraction of requests whose INFO records are kept (default: LOG_SAMPLE_RATE)
+
+    Returns:
+        The request ID in effect
+    """
+    if not request_id or not _REQUEST_ID_RE.match(request_id):
+        request_id = new_request_id()
+    rate = SAMPLE_RATE if sample_rate is None else sample_rate
+    _request_id.set(request_id)
+    _request_sampled.set(rate >= 1.0 or random.random() < rate)
+    return request_id
+
+
+class Redactor:
+    """Masks API keys: known secret values plus key-shaped patterns"""
+
+    def __init__(self, secrets: Iterable[Optional[str]] = ()):
+        self.secrets: List[str] = []
+        for secret in secrets:
+            self.add(secret)
+
+    def add(self, secret: Optional[str]):
+        # Very short values would mask ordinary words
+        if secret and len(secret) >= 8 and secret not in self.secrets:
+            self.secrets.append(secret)
+
+    def __call__(self, text: str) -> str:
+        for secret in self.secrets:
+            if secret in text:
+                text = text.replace(secret, "[REDACTED]")
+        for pattern, replacement in _SECRET_PATTERNS:
+            text = pattern.sub(replacement, text)
+        return text
+
+
+redactor = Redactor()
+
+
+class RequestContextFilter(logging.Filter):
+    """Tags records with the request ID; drops INFO/DEBUG of unsampled requests"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        return record.levelno >= logging.WARNING or _request_sampled.get()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: ts, level, logger, message, request_id and any extras"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": redactor(record.getMessage()),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+        if record.exc_info:
+            entry["exc"] = redactor(self.formatException(record.exc_info))
+        return dumps_str(entry)
+
+
+class TextFormatter(logging.Formatter):
+    """The classic text format, with the request ID and redaction"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        if getattr(record, "request_id", None) is None:
+            record.request_id = "-"
+        return redactor(super().format(record))
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler with a per-process listener and a bounded, non-blocking queue
+
+    The listener thread is started on first use in each process, so a handler
+    configured before the server forks its workers keeps working in them.
+    """
+
+    def __init__(self, target: logging.Handler, maxsize: int = 10000):
+        super().__init__(queue.Queue(maxsize))
+        self.target = target
+        self.maxsize = maxsize
+        self.listener: Optional[logging.handlers.QueueListener] = None
+        self._pid: Optional[int] = None
+        self.dropped = 0
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        # A listener inherited across fork() has no thread in this process
+        self.queue = queue.Queue(self.maxsize)
+        self.listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=True)
+        self.listener.start()
+        self._pid = os.getpid()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only merge the arguments here; formatting happens on the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+        self._pid = None
+
+
+# Fraction of requests whose INFO/DEBUG records are kept (set by configure_logging)
+SAMPLE_RATE = 1.0
+queue_handler: Optional[AsyncQueueHandler] = None
+
+
+def configure_logging(
+    level: Optional[str] = None,
+    fmt: Optional[str] = None,
+    use_queue: Optional[bool] = None,
+    sample_rate: Optional[float] = None,
+    secrets: Iterable[Optional[str]] = (),
+    stream: Any = None
+) -> logging.Handler:
+    """
+    Install the structured handler on the root logger (replacing existing handlers)
+
+    Args:
+        level: Root level (default: LOG_LEVEL, INFO)
+        fmt: 'json' or 'text' (default: LOG_FORMAT, json)
+        use_queue: Write from a background thread (default: LOG_ASYNC, true)
+        sample_rate: Fraction of requests that keep INFO records (default: LOG_SAMPLE_RATE, 1.0)
+        secrets: Values to mask wherever they appear (e.g. server API keys)
+        stream: Output stream (default: stderr)
+
+    Returns:
+        The handler installed on the root logger
+    """
+    global queue_handler, SAMPLE_RATE
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    fmt = (fmt or os.getenv("LOG_FORMAT", "json")).lower()
+    if use_queue is None:
+        use_queue = os.getenv("LOG_ASYNC", "true").lower() in ("1", "true", "yes")
+    SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 1.0)) if sample_rate is None else sample_rate
+    for secret in secrets:
+        redactor.add(secret)
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    if queue_handler is not None:
+        queue_handler.stop()
+        queue_handler = None
+    handler: logging.Handler = output
+    if use_queue:
+        handler = queue_handler = AsyncQueueHandler(output, maxsize=int(os.getenv("LOG_QUEUE_SIZE", 10000)))
+    handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    return handler
+
+
+def logging_stats() -> dict:
+    """Logging settings and queue counters for /health"""
+    return {
+        "sample_rate": SAMPLE_RATE,
+        "async": queue_handler is not None,
+        "queued": queue_handler.queue.qsize() if queue_handler is not None else 0,
+        "dropped": queue_handler.dropped if queue_handler is not None else 0,
+    }
+
+
+def flush_logging():
+    """Write out everything queued so far (shutdown)"""
+    if queue_handler is not None:
+        queue_handler.stop()
+
+
+atexit.register(flush_logging)
+
+
+class RequestIdMiddleware:
+    """
+    ASGI middleware binding a request ID (X-Request-ID, or a fresh one) for
+    the request's logs and echoing it in the response headers
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        supplied = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-request-id":
+                supplied = value.decode("latin-1")
+                break
+        request_id = bind_request(supplied)
+        header = (REQUEST_ID_HEADER.encode("latin-1"), request_id.encode("latin-1"))
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), header]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_id)
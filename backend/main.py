@@ -9,37 +9,95 @@ License: MIT
 """
 
 import os
+import time
+import asyncio
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator
 from datetime import datetime
+from functools import lru_cache
 
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from contextlib import asynccontextmanager
+from fastapi.responses import Response, StreamingResponse, PlainTextResponse
+from contextlib import asynccontextmanager, nullcontext
 from pydantic import BaseModel, Field, field_validator
 from dotenv import load_dotenv
-import requests
-from openai import OpenAI
+import httpx
+
+from clients import ClientRegistry, PoolSettings, hash_api_key
+from search_cache import SearchCache, make_cache_key, normalize_query
+from answer_cache import AnswerCache, CachedAnswer, hash_context
+from singleflight import SingleFlight, CoalescingLimitExceeded
+from retrieval import fetch_fanout
+from context_builder import build_context, estimate_tokens, token_budget_for
+from ratelimit import RateLimiterGroup, KeyQuotas, QuotaExhausted, use_limits, pace
+from metrics import registry as metrics_registry, span, start_trace, record_stage, register_models, model_label, SEARCHCANS_ERRORS, LLM_ERRORS, LLM_TOKENS, DEADLINE_EXCEEDED, CLIENT_DISCONNECTS
+from llm_router import LLMRouter, LLMTarget, NoAvailableProvider
+from admission import AdmissionController, Overloaded
+from shared_store import store_from_env, purge_forever
+from serialization import FastJSONResponse, JSON_BACKEND, dumps_str
+from compression import CompressionMiddleware
+from deep_retrieval import PageFetcher
+from passage_index import PassageIndex
+from prefetch import Prefetcher
+from sessions import SessionStore, Session, TurnPlan
+from deadlines import DeadlineExceeded, ClientDisconnected, DEADLINE_HEADER, LLM_RESERVE_MS, LLM_MIN_MS, resolve_budget_ms, bind_deadline, clear_deadline, remaining, budget as deadline_budget, within, iterate_within, cancel_on_disconnect
+from logging_config import configure_logging, redactor, RequestIdMiddleware, logging_stats, flush_logging
 
 # ============================================================================
 # Logging Configuration
 # ============================================================================
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# .env may set LOG_LEVEL / LOG_FORMAT / LOG_SAMPLE_RATE too, so load it first.
+# JSON records with request IDs, written by a background thread (see logging_config)
+load_dotenv()
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # ============================================================================
 # Environment Variables
 # ============================================================================
-load_dotenv()
 
 # Optional default API Keys (users can provide their own in frontend)
 DEFAULT_OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 DEFAULT_QWEN_API_KEY = os.getenv("DASHSCOPE_API_KEY")
 SEARCHCANS_API_KEY = os.getenv("SEARCHCANS_API_KEY")
 SEARCHCANS_API_ENDPOINT = os.getenv("SEARCHCANS_API_ENDPOINT", "https://global.searchcans.com/api/search")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+QWEN_BASE_URL = os.getenv("QWEN_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1")
+
+# Server keys are masked wherever they would appear in a log record
+for secret in (DEFAULT_OPENAI_API_KEY, DEFAULT_QWEN_API_KEY, SEARCHCANS_API_KEY):
+    redactor.add(secret)
+
+# Global deadline for multi-engine / multi-page fan-out retrieval
+FANOUT_DEADLINE_MS = int(os.getenv("FANOUT_DEADLINE_MS", 8000))
+
+# Longest a single SearchCans call may take (our timeout, and the server-side
+# wait "d" we ask for); both shrink to what is left of the request deadline
+SEARCHCANS_TIMEOUT = float(os.getenv("SEARCHCANS_TIMEOUT", 15))
+SEARCHCANS_WAIT_MS = int(os.getenv("SEARCHCANS_WAIT_MS", 10000))
+# Longest a single LLM completion may take, likewise cut to the deadline
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 120))
+
+# Batch endpoint: parallel pipelines per batch, and max queries per batch
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 8))
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", 1000))
+
+# Model used when the request does not name one
+DEFAULT_LLM_MODELS = {
+    "openai": "gpt-4o-mini",
+    "qwen": "qwen-plus"
+}
+
+# Backup LLM targets ("provider:model", comma-separated) for hedging and
+# failover; unset means the other providers' default models, empty disables
+LLM_FALLBACKS = os.getenv("LLM_FALLBACKS")
+# Also back up requests that bring their own LLM key with the server keys
+# (off by default: their prompts would go to a provider, and onto a quota,
+# the user did not choose)
+LLM_FALLBACKS_FOR_USER_KEYS = os.getenv("LLM_FALLBACKS_FOR_USER_KEYS", "false").lower() in ("1", "true", "yes")
+# Ask streaming completions for a final usage chunk (prompt / cached / completion tokens)
+LLM_STREAM_USAGE = os.getenv("LLM_STREAM_USAGE", "true").lower() in ("1", "true", "yes")
 
 # SearchCans API Key is now optional (users can provide their own)
 if not SEARCHCANS_API_KEY:
@@ -51,9 +109,187 @@ if DEFAULT_OPENAI_API_KEY:
 if DEFAULT_QWEN_API_KEY:
     logger.info("Default Qwen API Key detected")
 
+# ============================================================================
+# Shared Upstream Clients
+# ============================================================================
+# One pooled keep-alive client per (provider, base_url, api_key hash),
+# started and closed by the lifespan handler below
+client_registry = ClientRegistry(PoolSettings.from_env())
+# Startup warm-up of the server's pinned clients (provider SDK import, and a
+# connection per upstream with WARMUP_CONNECT): "background" runs it once
+# the server accepts requests, "blocking" before, "off" leaves it all to
+# the first request that needs each client
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "background").lower()
+WARMUP_CONNECT = os.getenv("WARMUP_CONNECT", "false").lower() in ("1", "true", "yes")
+
+# ============================================================================
+# Shared State
+# ============================================================================
+# Worker processes in this server (set by the production launcher)
+APP_WORKERS = int(os.getenv("APP_WORKERS", 1))
+# Cross-worker store for caches and rate-limit buckets (memory or file)
+shared_store = store_from_env()
+# Seconds between purges of expired keys and full token buckets
+SHARED_STORE_PURGE_INTERVAL = float(os.getenv("SHARED_STORE_PURGE_INTERVAL", 60))
+
+# ============================================================================
+# Search Result Cache
+# ============================================================================
+# Memory LRU (+ optional SQLite tier) in front of SearchCans; None if disabled.
+# With a shared file store the SQLite tier defaults to that file.
+search_cache = SearchCache.from_env(default_db_path=shared_store.path if shared_store.shared else None)
+search_flight = SingleFlight()
+
+# ============================================================================
+# Answer Cache
+# ============================================================================
+# Complete answers keyed on (query, provider, model, context hash), with
+# optional near-duplicate query matching; None if disabled
+answer_cache = AnswerCache.from_env(store=shared_store)
+
+# ============================================================================
+# Request Coalescing
+# ============================================================================
+# Identical in-flight smart_search calls share one pipeline run (or stream)
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "true").lower() in ("1", "true", "yes")
+COALESCE_MAX_WAITERS = int(os.getenv("COALESCE_MAX_WAITERS", 1000))
+pipeline_flight = SingleFlight(max_waiters=COALESCE_MAX_WAITERS) if COALESCE_ENABLED else None
+# Sources found so far by each in-flight shared run, by pipeline_key
+pipeline_progress: Dict[tuple, Dict[str, Any]] = {}
+
+# Per-upstream pacing applied to batch jobs (BATCH_RATE_LIMIT_* requests/second)
+batch_limits = RateLimiterGroup.from_env(store=shared_store)
+
+# ============================================================================
+# Upstream Key Quotas
+# ============================================================================
+# Per-provider and per-key pacing of every upstream call, quota accounting
+# per key hash, and fail-fast for keys known to be exhausted; None if disabled
+key_quotas = KeyQuotas.from_env(store=shared_store)
+
+# ============================================================================
+# Local Passage Index
+# ============================================================================
+# Passages of earlier search results (memory-mapped vectors + SQLite); in
+# local_first mode well-covered queries are answered without SearchCans.
+# None if disabled.
+passage_index = PassageIndex.from_env()
+# Background index writes, kept referenced until they finish
+index_tasks: set = set()
+
+# ============================================================================
+# Conversation Sessions
+# ============================================================================
+# Earlier turns and their search results per session_id (LRU + TTL), so
+# follow-up questions reuse context and only search for what is new.
+# None if disabled.
+session_store = SessionStore.from_env(store=shared_store)
+
+# ============================================================================
+# Deep Retrieval
+# ============================================================================
+# Full-page fetch + main-text extraction for the top results; None if disabled
+page_fetcher = PageFetcher.from_env()
+
+# ============================================================================
+# LLM Routing
+# ============================================================================
+# Hedged first-token requests, failover to backup targets and per-provider
+# circuit breakers
+llm_router = LLMRouter.from_env()
+
+# ============================================================================
+# Admission Control
+# ============================================================================
+# Fixed cap on concurrent pipelines plus adaptive per-upstream concurrency
+# limits, each with a bounded wait queue; None if disabled
+admission = AdmissionController.from_env()
+
+
+def admission_slot(name: str):
+    """Slot of the named admission limiter, or a no-op when admission control is off"""
+    if admission is None:
+        return nullcontext()
+    # The limiter itself never queues past the request's deadline
+    return admission.slot(name)
+
+# ============================================================================
+# Speculative Prefetch
+# ============================================================================
+# Debounced partial queries from the UI warm the search cache in the
+# background, backing off while SearchCans is busy with real requests.
+# None if disabled, or when there is no search cache to warm.
+prefetcher = Prefetcher.from_env(
+    fetch=lambda query, engine, api_key: fetch_searchcans_results(query, engine, 1, api_key),
+    is_cached=lambda query, engine: is_search_cached(query, engine),
+    load=lambda: admission.limiter("searchcans").load() if admission else 0.0,
+    store=shared_store
+) if search_cache is not None else None
+
+
+def overload_error(error: Overloaded) -> HTTPException:
+    """429 when the server is full of pipelines, 503 when one upstream is saturated"""
+    logger.warning("Load shed: %s", error)
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS if error.name == "pipeline" else status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=f"Server is busy, please retry in {error.retry_after}s",
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+
+def deadline_error(error: DeadlineExceeded) -> HTTPException:
+    """504 for a request whose deadline ran out before there was anything to return"""
+    DEADLINE_EXCEEDED.inc(stage=error.stage)
+    logger.warning("%s", error)
+    return HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(error))
+
+
+# Stands in for the answer when the deadline leaves no time to finish one
+DEADLINE_ANSWER = "The answer could not be completed within the request's time budget. The sources found for your question are listed below."
+
+
+def degraded_metadata(error: DeadlineExceeded) -> Dict[str, Any]:
+    """Metadata marking a response that was cut short by the request deadline"""
+    DEADLINE_EXCEEDED.inc(stage=error.stage)
+    logger.warning("%s, returning the sources without a full answer", error)
+    return {"reason": "deadline_exceeded", "stage": error.stage}
+
+
+def quota_error(error: QuotaExhausted) -> HTTPException:
+    """Fail fast for a key known to be exhausted: 400 if its quota is gone, 429 if it is only paced out"""
+    logger.warning("Upstream call skipped: %s", error)
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS if error.reason in ("rate_limited", "budget_exceeded") else status.HTTP_400_BAD_REQUEST,
+        detail=f"{str(error)} (no request was sent)",
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
 # ============================================================================
 # Application Lifecycle Management
 # ============================================================================
+def default_upstreams() -> List[tuple[str, str, str]]:
+    """(provider, base_url, api_key) of every upstream the server's own keys can reach"""
+    upstreams = []
+    if SEARCHCANS_API_KEY:
+        upstreams.append(("searchcans", SEARCHCANS_API_ENDPOINT, SEARCHCANS_API_KEY))
+    for provider in DEFAULT_LLM_MODELS:
+        try:
+            config = resolve_llm_config(provider)
+        except HTTPException:
+            continue
+        upstreams.append((provider, config["base_url"], config["api_key"]))
+    upstreams.extend((t.provider, t.base_url, t.api_key) for t in fallback_targets())
+    return upstreams
+
+
+async def warm_up_clients():
+    """Import the provider SDK and open the pinned clients ahead of the first request"""
+    try:
+        await client_registry.warm_up(default_upstreams(), connect=WARMUP_CONNECT)
+    except Exception as e:
+        logger.warning("Startup warm-up failed, clients will be created on first use: %s", e)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Manage application lifecycle events"""
@@ -61,17 +297,52 @@ async def lifespan(app: FastAPI):
     logger.info("=" * 60)
     logger.info("AI Search Engine Backend - Starting Up")
     logger.info("=" * 60)
-    logger.info(f"SearchCans API: {'Configured' if SEARCHCANS_API_KEY else 'Not Configured'}")
-    logger.info(f"Supported Search Engines: Google, Bing")
+    logger.info("SearchCans API: %s", 'Configured' if SEARCHCANS_API_KEY else 'Not Configured')
+    logger.info("Supported Search Engines: Google, Bing")
     logger.info("Supported LLM Providers:")
-    logger.info(f"  - OpenAI (Default Key: {'Yes' if DEFAULT_OPENAI_API_KEY else 'No'}, Custom Key: Supported)")
-    logger.info(f"  - Qwen (Default Key: {'Yes' if DEFAULT_QWEN_API_KEY else 'No'}, Custom Key: Supported)")
+    logger.info("  - OpenAI (Default Key: %s, Custom Key: Supported)", 'Yes' if DEFAULT_OPENAI_API_KEY else 'No')
+    logger.info("  - Qwen (Default Key: %s, Custom Key: Supported)", 'Yes' if DEFAULT_QWEN_API_KEY else 'No')
+    logger.info("HTTP Pool: %d connections, HTTP/2: %s", client_registry.settings.max_connections, 'Yes' if client_registry.http2 else 'No')
+    logger.info("Workers: %s, Shared Store: %s, JSON Encoder: %s", APP_WORKERS, shared_store.backend, JSON_BACKEND)
+    logger.info("Search Cache: %s, Prefetch: %s", 'Enabled' if search_cache else 'Disabled', 'Enabled' if prefetcher else 'Disabled')
+    logger.info("Answer Cache: %s", 'Disabled' if not answer_cache else 'Semantic' if answer_cache.semantic else 'Exact')
+    logger.info("Admission Control: %s", 'Enabled' if admission else 'Disabled')
+    logger.info("Local Passage Index: %s", f'Enabled ({passage_index.default_mode})' if passage_index else 'Disabled')
+    logger.info("Deep Retrieval: %s", f'Top {page_fetcher.settings.top_k} pages' if page_fetcher else 'Disabled')
+    logger.info("Conversation Sessions: %s", 'Enabled' if session_store else 'Disabled')
+    logger.info("LLM Hedging: %s, Fallbacks: %s", 'Enabled' if llm_router.hedging_enabled else 'Disabled', ', '.join(t.name for t in fallback_targets()) or 'None')
+    logger.info("Startup Warm-up: %s, Connect: %s", STARTUP_WARMUP.capitalize(), 'Yes' if WARMUP_CONNECT else 'No')
     logger.info("=" * 60)
+    # Metrics label only these models; anything a request names is "other"
+    register_models([*DEFAULT_LLM_MODELS.values(), *(t.model for t in fallback_targets())])
+    client_registry.start()
+    purge_task = asyncio.create_task(purge_forever(shared_store, SHARED_STORE_PURGE_INTERVAL))
+    warmup_task = None
+    if STARTUP_WARMUP == "blocking":
+        await warm_up_clients()
+    elif STARTUP_WARMUP == "background":
+        warmup_task = asyncio.create_task(warm_up_clients())
     
     yield
     
     # Shutdown
     logger.info("AI Search Engine Backend - Shutting Down...")
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+    purge_task.cancel()
+    if prefetcher:
+        await prefetcher.close()
+    await client_registry.aclose()
+    if page_fetcher:
+        await page_fetcher.aclose()
+    if passage_index:
+        if index_tasks:
+            await asyncio.wait(index_tasks, timeout=5)
+        passage_index.close()
+    if search_cache:
+        search_cache.close()
+    shared_store.close()
+    flush_logging()
 
 # ============================================================================
 # FastAPI Application
@@ -82,6 +353,7 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    default_response_class=FastJSONResponse,
     lifespan=lifespan
 )
 
@@ -100,8 +372,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
 
+# ============================================================================
+# Response Compression
+# ============================================================================
+# br (if installed) or gzip for complete responses above the size threshold;
+# SSE and NDJSON streams are never buffered
+if os.getenv("RESPONSE_COMPRESSION", "true").lower() in ("1", "true", "yes"):
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", 1024))
+    )
+
+# ============================================================================
+# Request IDs
+# ============================================================================
+# Outermost: binds X-Request-ID (or a fresh ID) for every log record of the
+# request, including background tasks it starts, and echoes it back
+app.add_middleware(RequestIdMiddleware)
+
 # ============================================================================
 # Pydantic Models
 # ============================================================================
@@ -114,6 +405,32 @@ class SearchQuery(BaseModel):
     llm_api_key: Optional[str] = Field(default=None, description="User's custom LLM API key")
     llm_model: Optional[str] = Field(default=None, description="Specific LLM model to use")
     searchcans_api_key: Optional[str] = Field(default=None, description="User's custom SearchCans API key")
+    search_engines: Optional[List[str]] = Field(
+        default=None,
+        description="Fan-out: query several engines in parallel (overrides search_engine)"
+    )
+    pages: int = Field(default=1, ge=1, le=5, description="Fan-out: number of result pages per engine")
+    fanout_deadline_ms: Optional[int] = Field(
+        default=None, ge=100, le=30000,
+        description="Fan-out: return whatever has arrived after this many milliseconds"
+    )
+    retrieval_mode: Optional[str] = Field(
+        default=None,
+        description="live: always search; local_first: answer from the local passage index when it covers the query (default: server setting)"
+    )
+    deep_retrieval: Optional[bool] = Field(
+        default=None,
+        description="Fetch and read the top result pages instead of only their snippets (default: on when the server enables it)"
+    )
+    session_id: Optional[str] = Field(
+        default=None, max_length=128,
+        description="Conversation: follow-ups in the same session reuse earlier context and history"
+    )
+    deadline_ms: Optional[int] = Field(
+        default=None, ge=100,
+        description="End-to-end time budget; when it runs out the sources are returned without an answer (default: X-Request-Deadline-Ms header, else server setting)"
+    )
+    debug: bool = Field(default=False, description="Include per-stage timings in response metadata")
     
     @field_validator('query')
     @classmethod
@@ -133,6 +450,34 @@ class SearchQuery(BaseModel):
             raise ValueError('Search engine must be google or bing')
         return v
     
+    @field_validator('search_engines')
+    @classmethod
+    def validate_search_engines(cls, v):
+        """Validate and deduplicate fan-out search engines"""
+        if v is None:
+            return v
+        engines = []
+        for engine in v:
+            engine = engine.lower().strip()
+            if engine not in ['google', 'bing']:
+                raise ValueError('Search engine must be google or bing')
+            if engine not in engines:
+                engines.append(engine)
+        if not engines:
+            raise ValueError('search_engines cannot be empty')
+        return engines
+    
+    @field_validator('retrieval_mode')
+    @classmethod
+    def validate_retrieval_mode(cls, v):
+        """Validate retrieval mode"""
+        if v is None:
+            return v
+        v = v.lower().strip()
+        if v not in ['live', 'local_first']:
+            raise ValueError('Retrieval mode must be live or local_first')
+        return v
+    
     @field_validator('llm_provider')
     @classmethod
     def validate_llm_provider(cls, v):
@@ -156,6 +501,38 @@ class SearchResponse(BaseModel):
     )
 
 
+class BatchSearchRequest(BaseModel):
+    """Request model for batch searches"""
+    queries: List[SearchQuery] = Field(
+        ..., min_length=1, max_length=BATCH_MAX_QUERIES,
+        description="Queries to run; duplicates are executed once"
+    )
+    max_concurrency: Optional[int] = Field(
+        default=None, ge=1,
+        description="Max queries processed in parallel (capped by server setting)"
+    )
+
+
+class PrefetchRequest(BaseModel):
+    """Request model for speculative prefetch (partial queries while typing)"""
+    query: str = Field(..., min_length=1, max_length=500, description="Query typed so far")
+    search_engine: str = Field(default="google", description="Search engine: google or bing")
+    searchcans_api_key: Optional[str] = Field(default=None, description="User's custom SearchCans API key")
+    session_id: Optional[str] = Field(
+        default=None, max_length=128,
+        description="Client session; a newer prefetch cancels the session's previous one (default: client address)"
+    )
+    
+    @field_validator('search_engine')
+    @classmethod
+    def validate_search_engine(cls, v):
+        """Validate search engine type"""
+        v = v.lower().strip()
+        if v not in ['google', 'bing']:
+            raise ValueError('Search engine must be google or bing')
+        return v
+
+
 class ErrorResponse(BaseModel):
     """Error response model"""
     error: str = Field(..., description="Error message")
@@ -167,9 +544,12 @@ class ErrorResponse(BaseModel):
 # Core Business Logic
 # ============================================================================
 
-def fetch_searchcans_results(query: str, search_engine: str = "google", page: int = 1, api_key: Optional[str] = None) -> Dict[str, Any]:
+async def fetch_searchcans_results(query: str, search_engine: str = "google", page: int = 1, api_key: Optional[str] = None) -> Dict[str, Any]:
     """
-    Fetch search results from SearchCans API
+    Fetch search results, served from the local search cache when possible
+    
+    Cache misses go to the SearchCans API; concurrent identical misses
+    share a single upstream call.
     
     Args:
         query: Search query string
@@ -183,41 +563,144 @@ def fetch_searchcans_results(query: str, search_engine: str = "google", page: in
     Raises:
         HTTPException: When API call fails
     """
+    # Use custom key if provided, otherwise use server default
+    search_api_key = api_key if api_key else SEARCHCANS_API_KEY
+    
+    if not search_api_key:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="SearchCans API key is required. Please provide your API key or configure server default."
+        )
+    
+    if search_cache is None:
+        data = await call_searchcans_api(query, search_engine, page, search_api_key, custom_key=bool(api_key))
+        index_search_results(query, data)
+        return data
+    
+    cache_key = make_cache_key(query, search_engine, page)
+    cached = await search_cache.get(cache_key)
+    if cached is not None:
+        logger.info("Search cache hit - Query: '%s', Engine: %s, Page: %s", query, search_engine, page)
+        return cached
+    
+    async def load() -> Dict[str, Any]:
+        # Shared by every caller with this key, so bound by none of their
+        # deadlines (each caller bounds its own wait below)
+        clear_deadline()
+        data = await call_searchcans_api(query, search_engine, page, search_api_key, custom_key=bool(api_key))
+        await search_cache.put(cache_key, data)
+        index_search_results(query, data)
+        return data
+    
+    # Upstream errors are key-specific, so only callers sharing a key are coalesced
     try:
-        # Use custom key if provided, otherwise use server default
-        search_api_key = api_key if api_key else SEARCHCANS_API_KEY
-        
-        if not search_api_key:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="SearchCans API key is required. Please provide your API key or configure server default."
-            )
-        
-        logger.info(f"Calling SearchCans API - Query: '{query}', Engine: {search_engine}, Key: {'Custom' if api_key else 'Server Default'}")
-        
-        headers = {
-            "Authorization": f"Bearer {search_api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "s": query,
-            "t": search_engine,  # google or bing
-            "d": 10000,  # Maximum API wait time (milliseconds) - increased for Google
-            "p": page,
-            "maxCache": 7200  # Maximum cache hit time (seconds)
-        }
+        data, _ = await within(search_flight.do((cache_key, hash_api_key(search_api_key)), load), "search")
+    except DeadlineExceeded as e:
+        raise deadline_error(e)
+    return data
+
+
+async def is_search_cached(query: str, search_engine: str) -> bool:
+    """Whether the first result page for the query is in the search cache"""
+    return search_cache is not None and await search_cache.get(make_cache_key(query, search_engine, 1)) is not None
+
+
+def index_search_results(query: str, search_data: Dict[str, Any]):
+    """Add fresh SearchCans results to the local passage index without delaying the response"""
+    if passage_index is None or not search_data.get("data"):
+        return
+    
+    async def add():
+        try:
+            await asyncio.to_thread(passage_index.add, query, search_data["data"])
+        except Exception as e:
+            logger.warning("Passage index write failed: %s", e)
+    
+    task = asyncio.create_task(add())
+    index_tasks.add(task)
+    task.add_done_callback(index_tasks.discard)
+
+
+async def search_local_index(query: str) -> Optional[tuple[Dict[str, Any], Dict[str, Any]]]:
+    """
+    Answer retrieval from the local passage index
+    
+    Returns:
+        (search_data, retrieval_report) when enough relevant fresh passages
+        were found, else None (the caller falls back to live search)
+    """
+    passages = await asyncio.to_thread(passage_index.search, query)
+    if not passage_index.covers(passages):
+        logger.info("Local index miss for '%s' (%d relevant passages), searching live", query, len(passages))
+        return None
+    
+    passage_index.local_hits += 1
+    logger.info("Local index hit for '%s' - %d passages, top similarity %s", query, len(passages), passages[0]["similarity"])
+    search_data = {
+        "code": 0,
+        "msg": "success",
+        "data": [{"title": p["title"], "url": p["url"], "content": p["content"]} for p in passages]
+    }
+    report = {
+        "mode": "local",
+        "passages": len(passages),
+        "top_similarity": passages[0]["similarity"],
+        "oldest_age_seconds": max(p["age_seconds"] for p in passages),
+    }
+    return search_data, report
+
+
+async def call_searchcans_api(query: str, search_engine: str, page: int, search_api_key: str, custom_key: bool = False) -> Dict[str, Any]:
+    """
+    Call the SearchCans API (non-blocking, no caching)
+    
+    Args:
+        query: Search query string
+        search_engine: Search engine type (google or bing)
+        page: Page number
+        search_api_key: API key to authenticate with
+        custom_key: True when the key was supplied by the user
+    
+    Returns:
+        JSON response from SearchCans API
         
-        response = requests.post(
-            SEARCHCANS_API_ENDPOINT,
-            headers=headers,
-            json=payload,
-            timeout=15
+    Raises:
+        HTTPException: When API call fails
+    """
+    try:
+        logger.info(
+            "Calling SearchCans API - Query: '%s', Engine: %s, Key: %s",
+            query, search_engine, "Custom" if custom_key else "Server Default",
+            extra={"event": "searchcans_call", "engine": search_engine, "page": page}
         )
         
+        async with client_registry.lease(
+            "searchcans", SEARCHCANS_API_ENDPOINT, search_api_key, pinned=not custom_key
+        ) as client:
+            if key_quotas:
+                await within(key_quotas.acquire("searchcans", search_api_key), "search")
+            await within(pace("searchcans"), "search")
+            async with admission_slot("searchcans") as permit:
+                # Both SearchCans' own wait and ours end with the request's deadline
+                timeout = deadline_budget(SEARCHCANS_TIMEOUT)
+                if timeout <= 0:
+                    raise DeadlineExceeded("search")
+                payload = {
+                    "s": query,
+                    "t": search_engine,  # google or bing
+                    "d": max(1000, int(min(SEARCHCANS_WAIT_MS / 1000, timeout - 0.5) * 1000)),  # Maximum API wait time (milliseconds)
+                    "p": page,
+                    "maxCache": 7200  # Maximum cache hit time (seconds)
+                }
+                with span("searchcans_request", engine=search_engine):
+                    response = await client.post(SEARCHCANS_API_ENDPOINT, json=payload, timeout=timeout)
+                if permit and (response.status_code >= 500 or response.status_code == 429):
+                    permit.drop()
+        
         # Check HTTP status code
         if response.status_code != 200:
-            logger.error(f"SearchCans API returned error status: {response.status_code}")
+            SEARCHCANS_ERRORS.inc(code=f"http_{response.status_code}")
+            logger.error("SearchCans API returned error status: %s", response.status_code)
             error_msg = response.text[:200] if response.text else "Unknown error"
             raise HTTPException(
                 status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
@@ -228,7 +711,7 @@ def fetch_searchcans_results(query: str, search_engine: str = "google", page: in
         
         # Validate response structure
         if not isinstance(data, dict):
-            logger.error(f"SearchCans API returned unexpected data format")
+            logger.error("SearchCans API returned unexpected data format")
             raise HTTPException(
                 status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
                 detail="Search service returned invalid data format"
@@ -240,15 +723,20 @@ def fetch_searchcans_results(query: str, search_engine: str = "google", page: in
         
         if api_code != 0:
             # SearchCans API returned an error
-            logger.error(f"SearchCans API error: code={api_code}, msg={api_msg}")
+            SEARCHCANS_ERRORS.inc(code=str(api_code))
+            logger.error("SearchCans API error: code=%s, msg=%s", api_code, api_msg)
             
             # Provide user-friendly error messages
             if api_code == -2010:
                 error_detail = "Invalid SearchCans API key. Please check your API key at https://global.searchcans.com/"
             elif api_code == -2011:
                 error_detail = "SearchCans API key quota exceeded. Please check your account balance."
+                if key_quotas:
+                    await key_quotas.mark("searchcans", search_api_key, "quota_exceeded")
             elif api_code == -2012:
                 error_detail = "SearchCans API key expired. Please renew your subscription."
+                if key_quotas:
+                    await key_quotas.mark("searchcans", search_api_key, "expired")
             else:
                 error_detail = f"SearchCans API error: {api_msg} (code: {api_code})"
             
@@ -262,90 +750,205 @@ def fetch_searchcans_results(query: str, search_engine: str = "google", page: in
         if search_results is None:
             search_results = []
         results_count = len(search_results)
-        logger.info(f"SearchCans API call successful - Retrieved {results_count} results")
+        logger.info("SearchCans API call successful - Retrieved %d results", results_count)
+        if key_quotas:
+            await key_quotas.record("searchcans", search_api_key)
         return data
         
-    except requests.exceptions.Timeout:
+    except Overloaded as e:
+        raise overload_error(e)
+    except QuotaExhausted as e:
+        raise quota_error(e)
+    except DeadlineExceeded as e:
+        raise deadline_error(e)
+    except httpx.TimeoutException:
+        if remaining() == 0.0:
+            raise deadline_error(DeadlineExceeded("search"))
+        SEARCHCANS_ERRORS.inc(code="timeout")
         logger.error("SearchCans API request timeout")
         raise HTTPException(
             status_code=status.HTTP_504_GATEWAY_TIMEOUT,
             detail="Search service timeout, please try again"
         )
-    except requests.exceptions.RequestException as e:
-        logger.error(f"SearchCans API request exception: {str(e)}")
+    except httpx.HTTPError as e:
+        SEARCHCANS_ERRORS.inc(code="transport")
+        logger.error("SearchCans API request exception: %s", e)
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail=f"Search service connection failed: {str(e)}"
         )
 
 
-def extract_search_context(search_data: Dict[str, Any]) -> tuple[str, List[str]]:
+async def retrieve_search_results(search_query: SearchQuery) -> tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    """
+    Fetch search results for a request, fanning out when it asks for it
+    
+    In local_first mode the local passage index is tried first.
+    
+    Args:
+        search_query: SearchQuery model containing query and options
+    
+    Returns:
+        (search_data, retrieval_report): report is None for a single live fetch
+    """
+    mode = search_query.retrieval_mode or (passage_index.default_mode if passage_index else "live")
+    if passage_index is not None and mode == "local_first":
+        local = await search_local_index(search_query.query)
+        if local is not None:
+            return local
+    
+    engines = search_query.search_engines or [search_query.search_engine]
+    if len(engines) == 1 and search_query.pages == 1:
+        search_data = await fetch_searchcans_results(
+            query=search_query.query,
+            search_engine=engines[0],
+            api_key=search_query.searchcans_api_key
+        )
+        return search_data, None
+    
+    logger.info("Fan-out retrieval - Engines: %s, Pages: %d", engines, search_query.pages)
+    return await fetch_fanout(
+        fetch_searchcans_results,
+        query=search_query.query,
+        engines=engines,
+        pages=search_query.pages,
+        api_key=search_query.searchcans_api_key,
+        deadline_s=deadline_budget((search_query.fanout_deadline_ms or FANOUT_DEADLINE_MS) / 1000)
+    )
+
+
+async def deepen_search_results(search_data: Dict[str, Any], search_query: SearchQuery) -> tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
     """
-    Extract context and source links from SearchCans results
+    Swap the top results' snippets for passages of their full pages
     
     Args:
         search_data: JSON data from SearchCans API
+        search_query: SearchQuery model (deep_retrieval can opt out per request)
     
     Returns:
-        (context_text, source_links): Formatted context and list of source URLs
+        (search_data, deep_report): report is None when deep retrieval did not run
     """
-    # SearchCans uses 'data' field for search results
-    search_results = search_data.get("data", [])
+    if page_fetcher is None or search_query.deep_retrieval is False:
+        return search_data, None
     
-    # Handle None case
-    if search_results is None:
-        search_results = []
+    # Optional: only runs on what the deadline leaves after the LLM's reserve
+    step_deadline = deadline_budget(page_fetcher.settings.deadline, reserve=LLM_RESERVE_MS / 1000)
+    if step_deadline <= 0:
+        logger.info("Deep retrieval skipped, not enough of the request deadline left")
+        return search_data, {"mode": "deep", "skipped": "deadline"}
     
-    if not search_results:
-        logger.warning("No valid search results found")
-        return "", []
-    
-    context_parts = []
-    source_links = []
-    
-    for idx, result in enumerate(search_results, 1):
-        # SearchCans result format: title, url, content
-        title = result.get("title", "No title")
-        content = result.get("content", "")  # SearchCans uses 'content' field
-        url = result.get("url", "")
-        
-        # Only process results with valid content
-        if content and url:
-            # Build formatted context entry
-            context_entry = f"[Source {idx}] {title}\n{content}\nURL: {url}"
-            context_parts.append(context_entry)
-            source_links.append(url)
-            
-            logger.debug(f"Extracted result {idx}: {title[:50]}...")
+    results, report = await page_fetcher.enrich(search_data.get("data") or [], deadline=step_deadline)
+    logger.info(
+        "Deep retrieval: %d/%d pages read, %d passages in %dms",
+        report["pages_used"], len(report["pages"]), report["passages_added"], report["elapsed_ms"]
+    )
+    return {**search_data, "data": results}, report
+
+
+async def open_session_turn(search_query: SearchQuery) -> tuple[Optional[Session], Optional[TurnPlan]]:
+    """
+    Load the request's conversation and plan the turn's retrieval
     
-    # Deduplicate source links (maintain order)
-    unique_sources = []
-    seen = set()
-    for link in source_links:
-        if link not in seen:
-            unique_sources.append(link)
-            seen.add(link)
+    Returns:
+        (session, plan), or (None, None) for a stateless request
+    """
+    if session_store is None or not search_query.session_id:
+        return None, None
+    session = await session_store.get(search_query.session_id)
+    plan = session_store.plan(session, search_query.query)
+    if plan.followup:
+        logger.info(
+            "Follow-up in session %s - Search: %s, Query: '%s', New terms: %s",
+            session.session_id, plan.mode, plan.search_query, plan.new_terms
+        )
+    return session, plan
+
+
+async def gather_search_data(
+    search_query: SearchQuery,
+    session: Optional[Session],
+    plan: Optional[TurnPlan]
+) -> tuple[Dict[str, Any], Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Search results for one turn
     
-    # Combine all context
-    context_text = "\n\n".join(context_parts)
+    A stateless request or a new topic is searched in full. A follow-up
+    searches only its incremental query (or nothing, when the session's
+    pooled results already cover it) and adds the pooled results.
     
-    logger.info(f"Successfully extracted {len(context_parts)} context entries, {len(unique_sources)} unique sources")
+    Returns:
+        (search_data, retrieval_report, deep_report)
+    """
+    search_data: Dict[str, Any] = {"data": []}
+    retrieval_report = deep_report = None
+    if plan is None or plan.search:
+        turn_query = search_query
+        if plan is not None and plan.search_query != search_query.query:
+            turn_query = search_query.model_copy(update={"query": plan.search_query})
+        with span("search", engine=",".join(search_query.search_engines or [search_query.search_engine])):
+            search_data, retrieval_report = await retrieve_search_results(turn_query)
+        with span("deep_retrieval"):
+            search_data, deep_report = await deepen_search_results(search_data, turn_query)
+    if plan is not None and plan.reuse_results:
+        search_data = {**search_data, "data": session_store.merge_results(search_data.get("data") or [], session.results)}
+    return search_data, retrieval_report, deep_report
+
+
+def session_history(session: Optional[Session], plan: Optional[TurnPlan]) -> tuple[List[Dict[str, str]], Optional[Dict[str, Any]]]:
+    """
+    Chat history for the prompt and the session part of the response metadata
     
-    return context_text, unique_sources
+    Returns:
+        (history messages, metadata), or ([], None) for a stateless request
+    """
+    if session is None:
+        return [], None
+    history, history_report = session_store.history_messages(session)
+    return history, {
+        "id": session.session_id,
+        "turn": len(session.turns) + 1,
+        "followup": plan.followup,
+        "search": plan.mode,
+        "search_query": plan.search_query,
+        "pooled_results": len(session.results) if plan.reuse_results else 0,
+        **history_report
+    }
 
 
-def build_enhanced_prompt(user_query: str, context: str) -> List[Dict[str, str]]:
+def assemble_context(search_data: Dict[str, Any], user_query: str, model: str) -> tuple[str, List[str], Dict[str, Any]]:
     """
-    Build enhanced prompt with search context (Prompt Engineering)
+    Build a token-budgeted, relevance-ranked context from search results
+    
+    Passages are scored against the query, near-duplicates removed and the
+    best ones packed into the model's context budget (see context_builder).
     
     Args:
+        search_data: JSON data from SearchCans API
         user_query: User's original query
-        context: Context extracted from search results
+        model: LLM model name (selects the token budget)
     
     Returns:
-        List of message dictionaries for LLM API
+        (context_text, source_links, report): report counts tokens and passages
     """
-    system_prompt = """You are an intelligent search assistant. Your task is to provide accurate, comprehensive, and well-structured answers based on real-time web search results.
+    search_results = search_data.get("data") or []
+    
+    if not search_results:
+        logger.warning("No valid search results found")
+    
+    context_text, source_links, report = build_context(search_results, user_query, token_budget_for(model))
+    
+    logger.info(
+        "Assembled context: %d/%d passages, %d/%d tokens, %d duplicates removed",
+        report["passages_used"], report["passages_total"],
+        report["context_tokens"], report["token_budget"],
+        report["duplicates_removed"]
+    )
+    
+    return context_text, source_links, report
+
+
+# Static, so it always forms the start of the cacheable prompt prefix
+SYSTEM_PROMPT = """You are an intelligent search assistant. Your task is to provide accurate, comprehensive, and well-structured answers based on real-time web search results.
 
 Guidelines:
 1. Base your answer strictly on the provided search results
@@ -359,107 +962,342 @@ Response Format:
 - Start with a direct answer to the question
 - Provide detailed explanation if needed
 - Use bullet points for clarity when appropriate
-- Keep the tone professional yet accessible"""
+- Keep the tone professional yet accessible
+
+The user message contains the search results followed by the question. Based on the search results, provide a comprehensive and accurate answer to the question. Structure your response clearly and cite the relevant information from the sources."""
 
-    user_prompt = f"""Question: {user_query}
 
-Search Results:
+def build_enhanced_prompt(user_query: str, context: str, history: Optional[List[Dict[str, str]]] = None) -> List[Dict[str, str]]:
+    """
+    Build enhanced prompt with search context (Prompt Engineering)
+    
+    Laid out from most to least stable, so provider-side prompt caches
+    (which match on an exact prefix) can reuse as much as possible: static
+    instructions, then earlier turns of the conversation (which only grow),
+    then the search results (identical for the same sources, see
+    context_builder), then the question, which changes every time.
+    
+    Args:
+        user_query: User's original query
+        context: Context extracted from search results
+        history: Earlier turns as user / assistant messages (see sessions)
+    
+    Returns:
+        List of message dictionaries for LLM API
+    """
+    user_prompt = f"""Search Results:
 {context}
 
-Based on the search results above, please provide a comprehensive and accurate answer to the question. Structure your response clearly and cite the relevant information from the sources."""
+Question: {user_query}"""
 
     messages = [
-        {"role": "system", "content": system_prompt},
+        {"role": "system", "content": SYSTEM_PROMPT},
+        *(history or []),
         {"role": "user", "content": user_prompt}
     ]
     
     return messages
 
 
-def generate_ai_answer(
-    messages: List[Dict[str, str]], 
+def turn_context_hash(context: str, history: List[Dict[str, str]]) -> str:
+    """Answer cache fingerprint of what the LLM sees besides the question"""
+    if not history:
+        return hash_context(context)
+    return hash_context(dumps_str(history) + context)
+
+
+def prompt_prefix_hash(messages: List[Dict[str, str]]) -> str:
+    """Fingerprint of everything before the question (equal hashes can share a provider cache entry)"""
+    prefix = messages[-1]["content"].rsplit("\n\nQuestion: ", 1)[0]
+    return hash_context("\n".join([m["content"] for m in messages[:-1]] + [prefix]))[:16]
+
+
+def resolve_llm_config(
     llm_provider: str = "openai",
     llm_api_key: Optional[str] = None,
     llm_model: Optional[str] = None
-) -> str:
+) -> Dict[str, Any]:
     """
-    Generate AI answer using specified LLM provider
+    Resolve API key, base URL and model for an LLM provider
     
     Args:
-        messages: List of message dictionaries
         llm_provider: LLM provider (openai or qwen)
         llm_api_key: Optional custom API key from user
         llm_model: Optional specific model name
     
     Returns:
-        AI-generated answer text
+        Dict with api_key, base_url, model and pinned (True for server default keys)
         
     Raises:
-        HTTPException: When LLM API call fails
+        HTTPException: When no API key is available for the provider
+        ValueError: When the provider is not supported
     """
-    try:
-        # Determine which API key to use
-        if llm_api_key:
-            # User provided their own key
-            api_key = llm_api_key
-            logger.info(f"Using user-provided API key for {llm_provider}")
-        else:
-            # Use default key from server
-            if llm_provider == "openai":
-                api_key = DEFAULT_OPENAI_API_KEY
-            elif llm_provider == "qwen":
-                api_key = DEFAULT_QWEN_API_KEY
-            else:
-                raise ValueError(f"Unsupported LLM provider: {llm_provider}")
-            
-            if not api_key:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"No API key available for {llm_provider}. Please provide your own API key."
-                )
-            
-            logger.info(f"Using default server API key for {llm_provider}")
-        
-        # Configure client based on provider
+    # Determine which API key to use
+    if llm_api_key:
+        # User provided their own key
+        api_key = llm_api_key
+        logger.info("Using user-provided API key for %s", llm_provider)
+    else:
+        # Use default key from server
         if llm_provider == "openai":
-            client = OpenAI(api_key=api_key)
-            model = llm_model or "gpt-4o-mini"
+            api_key = DEFAULT_OPENAI_API_KEY
         elif llm_provider == "qwen":
-            client = OpenAI(
-                api_key=api_key,
-                base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
-            )
-            model = llm_model or "qwen-plus"
+            api_key = DEFAULT_QWEN_API_KEY
         else:
             raise ValueError(f"Unsupported LLM provider: {llm_provider}")
         
-        logger.info(f"Calling {llm_provider} API with model: {model}")
-        
-        # Call LLM API
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=0.7,
-            max_tokens=2000
-        )
-        
-        answer = response.choices[0].message.content.strip()
-        
-        logger.info(f"{llm_provider} API call successful - Generated answer length: {len(answer)} characters")
-        
-        return answer
+        if not api_key:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"No API key available for {llm_provider}. Please provide your own API key."
+            )
         
-    except Exception as e:
-        logger.error(f"LLM API call failed: {str(e)}")
-        raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail=f"AI service error: {str(e)}"
-        )
+        logger.info("Using default server API key for %s", llm_provider)
+    
+    # Configure client based on provider
+    if llm_provider == "openai":
+        base_url = OPENAI_BASE_URL
+    elif llm_provider == "qwen":
+        base_url = QWEN_BASE_URL
+    else:
+        raise ValueError(f"Unsupported LLM provider: {llm_provider}")
+    
+    return {
+        "api_key": api_key,
+        "base_url": base_url,
+        "model": llm_model or DEFAULT_LLM_MODELS[llm_provider],
+        "pinned": not llm_api_key
+    }
 
 
-# ============================================================================
-# API Endpoints
-# ============================================================================
+@lru_cache(maxsize=1)
+def fallback_targets() -> tuple[LLMTarget, ...]:
+    """
+    Backup LLM targets served with the server's default keys
+    
+    Read from LLM_FALLBACKS; when unset, every other provider with a default
+    key is a backup using its default model.
+    """
+    if LLM_FALLBACKS is None:
+        entries = [(provider, model) for provider, model in DEFAULT_LLM_MODELS.items()]
+    else:
+        entries = []
+        for entry in LLM_FALLBACKS.split(","):
+            provider, _, model = entry.strip().partition(":")
+            if provider in DEFAULT_LLM_MODELS:
+                entries.append((provider, model or DEFAULT_LLM_MODELS[provider]))
+    
+    targets = []
+    for provider, model in entries:
+        try:
+            config = resolve_llm_config(provider, None, model)
+        except HTTPException:
+            # No default key for this provider
+            continue
+        targets.append(LLMTarget(provider, config["model"], config["api_key"], config["base_url"], config["pinned"]))
+    return tuple(targets)
+
+
+def resolve_llm_targets(
+    llm_provider: str = "openai",
+    llm_api_key: Optional[str] = None,
+    llm_model: Optional[str] = None
+) -> List[LLMTarget]:
+    """
+    Primary LLM target for the request followed by the configured backups
+    
+    Requests with their own LLM key get no backups unless
+    LLM_FALLBACKS_FOR_USER_KEYS is set, since backups use the server keys.
+    
+    Raises:
+        HTTPException: When no API key is available for the primary provider
+        ValueError: When the provider is not supported
+    """
+    config = resolve_llm_config(llm_provider, llm_api_key, llm_model)
+    primary = LLMTarget(llm_provider, config["model"], config["api_key"], config["base_url"], config["pinned"])
+    if not config["pinned"] and not LLM_FALLBACKS_FOR_USER_KEYS:
+        return [primary]
+    return [primary] + [t for t in fallback_targets() if t.name != primary.name]
+
+
+def summarize_usage(usage: Any) -> Dict[str, int]:
+    """Token counts from an OpenAI-style usage object, including prompt-cache hits"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "cached_tokens": getattr(details, "cached_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+    }
+
+
+async def note_llm_quota_error(target: LLMTarget, error: Exception):
+    """Block a key the provider reported as out of quota (or rate limited with a Retry-After)"""
+    if key_quotas is None or getattr(error, "status_code", None) != 429:
+        return
+    upstream = f"llm:{target.provider}"
+    if getattr(error, "code", None) == "insufficient_quota":
+        await key_quotas.mark(upstream, target.api_key, "quota_exceeded")
+        return
+    response = getattr(error, "response", None)
+    try:
+        retry_after = float(response.headers.get("retry-after", ""))
+    except (AttributeError, ValueError):
+        return
+    if retry_after > 0:
+        await key_quotas.mark(upstream, target.api_key, "rate_limited", ttl=retry_after)
+
+
+async def stream_ai_answer(target: LLMTarget, messages: List[Dict[str, str]], usage: Optional[Dict[str, int]] = None) -> AsyncIterator[str]:
+    """
+    Stream AI answer deltas from one LLM target as they are generated
+    
+    Args:
+        target: Provider, model and key to call
+        messages: List of message dictionaries
+        usage: Filled with the token counts the provider reports after the last delta
+    
+    Yields:
+        Answer text fragments, in order
+    """
+    logger.info("Streaming from %s API with model: %s", target.provider, target.model)
+    
+    try:
+        async with client_registry.lease(
+            target.provider, target.base_url, target.api_key, pinned=target.pinned
+        ) as client:
+            if key_quotas:
+                await within(key_quotas.acquire(f"llm:{target.provider}", target.api_key), "llm")
+            await within(pace(f"llm:{target.provider}"), "llm")
+            async with admission_slot(f"llm:{target.provider}") as permit:
+                stream = await client.chat.completions.create(
+                    model=target.model,
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=2000,
+                    stream=True,
+                    # The caller stops reading at the deadline; the slack keeps that
+                    # from looking like a provider timeout
+                    timeout=deadline_budget(LLM_TIMEOUT) + 1.0,
+                    # Final chunk carries usage, including prompt-cache hits
+                    **({"stream_options": {"include_usage": True}} if LLM_STREAM_USAGE else {})
+                )
+                counts = None
+                async for chunk in stream:
+                    if getattr(chunk, "usage", None):
+                        counts = summarize_usage(chunk.usage)
+                        LLM_TOKENS.inc(counts["cached_tokens"], provider=target.provider, model=model_label(target.model), kind="cached_prompt")
+                        LLM_TOKENS.inc(counts["prompt_tokens"], provider=target.provider, model=model_label(target.model), kind="prompt")
+                        LLM_TOKENS.inc(counts["completion_tokens"], provider=target.provider, model=model_label(target.model), kind="completion")
+                        if usage is not None:
+                            usage.update(counts)
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if permit:
+                            # Adapt on time to first token, not answer length
+                            permit.mark()
+                        yield delta
+                if key_quotas:
+                    # Without reported usage only the call itself is counted
+                    tokens = counts["prompt_tokens"] + counts["completion_tokens"] if counts else 0
+                    await key_quotas.record(f"llm:{target.provider}", target.api_key, tokens)
+    except (Overloaded, QuotaExhausted, DeadlineExceeded):
+        raise
+    except Exception as e:
+        LLM_ERRORS.inc(provider=target.provider)
+        await note_llm_quota_error(target, e)
+        raise
+
+
+def route_llm_answer(targets: List[LLMTarget], messages: List[Dict[str, str]], usage: Optional[Dict[str, Dict[str, int]]] = None):
+    """
+    Hedged / failover answer stream across targets; read .route after the first delta
+    
+    usage, if given, collects each target's reported token counts by target name.
+    """
+    if usage is None:
+        return llm_router.stream(targets, lambda target: stream_ai_answer(target, messages))
+    return llm_router.stream(targets, lambda target: stream_ai_answer(target, messages, usage.setdefault(target.name, {})))
+
+
+def answer_usage(route: Dict[str, Any], usage: Dict[str, Dict[str, int]]) -> Optional[Dict[str, int]]:
+    """Token counts of the target that produced the answer (None if it reported none)"""
+    return usage.get(f"{route['provider']}:{route['model']}") or None
+
+
+async def generate_ai_answer(
+    messages: List[Dict[str, str]], 
+    llm_provider: str = "openai",
+    llm_api_key: Optional[str] = None,
+    llm_model: Optional[str] = None
+) -> tuple[str, Dict[str, Any]]:
+    """
+    Generate AI answer using specified LLM provider (non-blocking)
+    
+    The completion is streamed internally so a slow first token can be
+    hedged with a backup target (see llm_router).
+    
+    Args:
+        messages: List of message dictionaries
+        llm_provider: LLM provider (openai or qwen)
+        llm_api_key: Optional custom API key from user
+        llm_model: Optional specific model name
+    
+    Returns:
+        (AI-generated answer text, routing info: provider/model that answered, hedged, failover, token usage)
+        
+    Raises:
+        HTTPException: When LLM API call fails
+        DeadlineExceeded: When the request's deadline passes first
+    """
+    try:
+        targets = resolve_llm_targets(llm_provider, llm_api_key, llm_model)
+        
+        logger.info(
+            "Calling %s API with model: %s", llm_provider, targets[0].model,
+            extra={"event": "llm_call", "provider": llm_provider, "model": targets[0].model}
+        )
+        
+        llm_started = time.perf_counter()
+        usage: Dict[str, Dict[str, int]] = {}
+        answer_stream = route_llm_answer(targets, messages, usage)
+        
+        async def collect() -> str:
+            return "".join([delta async for delta in answer_stream]).strip()
+        
+        answer = await within(collect(), "llm")
+        route = answer_stream.route
+        route["usage"] = answer_usage(route, usage)
+        record_stage("llm", time.perf_counter() - llm_started, provider=route["provider"] or llm_provider, model=route["model"] or targets[0].model)
+        
+        logger.info("%s API call successful - Generated answer length: %d characters", route["provider"], len(answer))
+        
+        return answer, route
+        
+    except (HTTPException, DeadlineExceeded):
+        raise
+    except Overloaded as e:
+        raise overload_error(e)
+    except QuotaExhausted as e:
+        raise quota_error(e)
+    except NoAvailableProvider as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": str(int(llm_router.breaker_reset))}
+        )
+    except Exception as e:
+        logger.error("LLM API call failed: %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"AI service error: {str(e)}"
+        )
+
+
+# ============================================================================
+# API Endpoints
+# ============================================================================
 
 @app.get("/", tags=["Root"])
 async def root():
@@ -469,7 +1307,8 @@ async def root():
         "version": "1.0.0",
         "description": "RAG-based intelligent search powered by SearchCans API",
         "docs": "/docs",
-        "health": "/health"
+        "health": "/health",
+        "metrics": "/metrics"
     }
 
 
@@ -491,23 +1330,173 @@ async def health_check():
                 "supports_custom_key": True
             }
         },
-        "supported_search_engines": ["google", "bing"]
+        "supported_search_engines": ["google", "bing"],
+        "workers": {
+            "configured": APP_WORKERS,
+            "pid": os.getpid()
+        },
+        "shared_store": await asyncio.to_thread(shared_store.stats),
+        "logging": logging_stats(),
+        "client_pool": client_registry.stats(),
+        "search_cache": {
+            "enabled": search_cache is not None,
+            **(search_cache.stats() if search_cache else {}),
+            "coalescing": search_flight.stats()
+        },
+        "answer_cache": {
+            "enabled": answer_cache is not None,
+            **(answer_cache.stats() if answer_cache else {})
+        },
+        "local_index": {
+            "enabled": passage_index is not None,
+            **(passage_index.stats() if passage_index else {})
+        },
+        "deep_retrieval": {
+            "enabled": page_fetcher is not None,
+            **(page_fetcher.stats() if page_fetcher else {})
+        },
+        "llm_routing": llm_router.stats(),
+        "admission": {
+            "enabled": admission is not None,
+            "limiters": admission.stats() if admission else {}
+        },
+        "prefetch": {
+            "enabled": prefetcher is not None,
+            **(prefetcher.stats() if prefetcher else {})
+        },
+        "sessions": {
+            "enabled": session_store is not None,
+            **(session_store.stats() if session_store else {})
+        },
+        "key_quotas": {
+            "enabled": key_quotas is not None,
+            **(key_quotas.stats() if key_quotas else {})
+        },
+        "batch": {
+            "max_concurrency": BATCH_MAX_CONCURRENCY,
+            "max_queries": BATCH_MAX_QUERIES,
+            "rate_limits": batch_limits.stats()
+        },
+        "request_coalescing": {
+            "enabled": pipeline_flight is not None,
+            **(pipeline_flight.stats() if pipeline_flight else {}),
+            # Every coalesced request skipped its own search + LLM pipeline
+            "pipelines_saved": pipeline_flight.coalesced if pipeline_flight else 0
+        }
     }
 
 
-@app.post(
-    "/api/smart_search",
-    response_model=SearchResponse,
-    responses={
-        200: {"description": "Successful response with AI-generated answer"},
-        400: {"description": "Invalid request parameters"},
-        503: {"description": "Service temporarily unavailable"}
-    },
-    tags=["Search"]
-)
-async def smart_search(search_query: SearchQuery):
+def collect_component_gauges() -> Dict[str, tuple[str, float]]:
+    """Export numeric pool / cache / coalescing stats as gauges for /metrics"""
+    components = {
+        "client_pool": client_registry.stats(),
+        "search_cache": search_cache.stats() if search_cache else {},
+        "search_coalescing": search_flight.stats(),
+        "answer_cache": answer_cache.stats() if answer_cache else {},
+        "local_index": passage_index.stats() if passage_index else {},
+        "deep_retrieval": page_fetcher.stats() if page_fetcher else {},
+        "llm_routing": llm_router.stats(),
+        "key_quotas": key_quotas.stats() if key_quotas else {},
+        "prefetch": prefetcher.stats() if prefetcher else {},
+        "sessions": session_store.stats() if session_store else {},
+        "request_coalescing": pipeline_flight.stats() if pipeline_flight else {},
+        "logging": logging_stats()
+    }
+    if admission:
+        for name, stats in admission.stats().items():
+            components[f"admission_{name.replace(':', '_')}"] = stats
+    gauges = {}
+    for component, stats in components.items():
+        for field, value in stats.items():
+            if isinstance(value, (int, float)):
+                gauges[f"intellisearch_{component}_{field}"] = (f"{component} {field}", float(value))
+    return gauges
+
+
+metrics_registry.add_gauge_collector(collect_component_gauges)
+
+
+@app.get("/metrics", tags=["Health"], response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics (text exposition format)"""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def retrieval_profile(search_query: SearchQuery) -> str:
+    """The request's retrieval options that shape an answer's context (engines, pages, deep retrieval)"""
+    engines = ",".join(sorted(search_query.search_engines or [search_query.search_engine]))
+    deep = page_fetcher is not None and search_query.deep_retrieval is not False
+    return f"{engines}|pages={search_query.pages}|deep={'on' if deep else 'off'}"
+
+
+def require_upstream_keys(search_query: SearchQuery):
     """
-    Intelligent search endpoint with RAG architecture
+    Fail like the pipeline would when the request has no usable SearchCans or LLM key
+    
+    Raises:
+        HTTPException: 400 when a key is missing
+    """
+    if not (search_query.searchcans_api_key or SEARCHCANS_API_KEY):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="SearchCans API key is required. Please provide your API key or configure server default."
+        )
+    resolve_llm_config(search_query.llm_provider, search_query.llm_api_key, search_query.llm_model)
+
+
+def lookup_similar_answer(search_query: SearchQuery, model_name: str) -> Optional[tuple[CachedAnswer, float]]:
+    """Near-duplicate answer cache lookup; None when disabled or no match clears the threshold"""
+    # A conversation turn's answer depends on the turns before it
+    if answer_cache is None or (session_store is not None and search_query.session_id):
+        return None
+    # A hit skips the upstream calls, not the key checks they would have made
+    require_upstream_keys(search_query)
+    match = answer_cache.get_similar(search_query.query, search_query.llm_provider, model_name, retrieval_profile(search_query))
+    if match is not None:
+        logger.info(
+            "Answer cache semantic hit for '%s' (similarity %.3f, cached query: '%s')",
+            search_query.query, match[1], match[0].query
+        )
+    return match
+
+
+def with_debug_timings(response: SearchResponse, search_query: SearchQuery, trace: Dict[str, float]) -> SearchResponse:
+    """Attach the per-stage breakdown to the metadata when the request asked for it"""
+    if search_query.debug:
+        response.metadata["timings_ms"] = dict(trace)
+    return response
+
+
+def cached_answer_metadata(search_query: SearchQuery, cached: CachedAnswer, similarity: float, start_time: float, mode: str) -> Dict[str, Any]:
+    """Response metadata for an answer served from the answer cache"""
+    return {
+        "query": search_query.query,
+        "search_engine": search_query.search_engine,
+        "llm_provider": search_query.llm_provider,
+        "llm_model": search_query.llm_model,
+        "results_found": len(cached.sources),
+        "processing_time_ms": int((time.perf_counter() - start_time) * 1000),
+        "answer_cache": {
+            "hit": True,
+            "mode": mode,
+            "similarity": round(similarity, 4),
+            "cached_query": cached.query
+        }
+    }
+
+
+def cached_search_response(search_query: SearchQuery, cached: CachedAnswer, similarity: float, start_time: float, mode: str = "semantic") -> SearchResponse:
+    """Build a SearchResponse from an answer cache entry"""
+    return SearchResponse.model_construct(
+        answer=cached.answer,
+        sources=cached.sources,
+        metadata=cached_answer_metadata(search_query, cached, similarity, start_time, mode)
+    )
+
+
+async def run_search_pipeline(search_query: SearchQuery, progress: Optional[Dict[str, Any]] = None) -> SearchResponse:
+    """
+    Run the RAG pipeline for one query
     
     Process:
     1. Call SearchCans API for real-time web search
@@ -518,28 +1507,45 @@ async def smart_search(search_query: SearchQuery):
     
     Args:
         search_query: SearchQuery model containing query and options
+        progress: Receives the sources as soon as they are known (so callers
+            sharing this run can degrade to them on their own deadline)
     
     Returns:
         SearchResponse with AI answer, sources, and metadata
     """
-    start_time = datetime.now()
+    start_time = time.perf_counter()
+    trace = start_trace()
     
     try:
-        logger.info(f"Received search request: '{search_query.query}' (Engine: {search_query.search_engine}, LLM: {search_query.llm_provider})")
-        
-        # Step 1: Fetch search results from SearchCans API
-        search_data = fetch_searchcans_results(
-            query=search_query.query,
-            search_engine=search_query.search_engine,
-            api_key=search_query.searchcans_api_key
+        logger.info(
+            "Received search request: '%s' (Engine: %s, LLM: %s)",
+            search_query.query, search_query.search_engine, search_query.llm_provider,
+            extra={"event": "search_received", "engine": search_query.search_engine, "provider": search_query.llm_provider}
         )
         
-        # Step 2: Extract context and sources
-        context, sources = extract_search_context(search_data)
+        model_name = search_query.llm_model or DEFAULT_LLM_MODELS[search_query.llm_provider]
+        
+        # Step 0: Near-duplicate answer cache (skips search and LLM entirely)
+        with span("answer_cache_lookup"):
+            match = lookup_similar_answer(search_query, model_name)
+        if match is not None:
+            return with_debug_timings(cached_search_response(search_query, *match, start_time), search_query, trace)
+        
+        # Step 1: Fetch search results from SearchCans API (optionally reading
+        # the top pages in full); follow-ups reuse the session's results
+        session, plan = await open_session_turn(search_query)
+        search_data, retrieval_report, deep_report = await gather_search_data(search_query, session, plan)
+        
+        # Step 2: Rank and pack context into the model's token budget
+        with span("context"):
+            context, sources, context_report = assemble_context(search_data, plan.search_query if plan else search_query.query, model_name)
+        history, session_meta = session_history(session, plan)
+        if progress is not None:
+            progress["sources"] = sources
         
         if not context:
-            logger.warning(f"No valid context extracted for query: {search_query.query}")
-            return SearchResponse(
+            logger.warning("No valid context extracted for query: %s", search_query.query)
+            return with_debug_timings(SearchResponse.model_construct(
                 answer="Sorry, no relevant search results found. Please try different keywords.",
                 sources=[],
                 metadata={
@@ -547,27 +1553,74 @@ async def smart_search(search_query: SearchQuery):
                     "search_engine": search_query.search_engine,
                     "llm_provider": search_query.llm_provider,
                     "results_found": 0,
-                    "processing_time_ms": int((datetime.now() - start_time).total_seconds() * 1000)
+                    "processing_time_ms": int((time.perf_counter() - start_time) * 1000),
+                    **({"retrieval": retrieval_report} if retrieval_report else {}),
+                    **({"deep_retrieval": deep_report} if deep_report else {}),
+                    **({"session": session_meta} if session_meta else {})
                 }
-            )
+            ), search_query, trace)
+        
+        # Exact answer cache: same query, model, search context and history
+        answer_key = None
+        if answer_cache is not None:
+            answer_key = AnswerCache.make_key(search_query.query, search_query.llm_provider, model_name, turn_context_hash(context, history))
+            cached = await answer_cache.get_exact(answer_key)
+            if cached is not None:
+                response = cached_search_response(search_query, cached, 1.0, start_time, mode="exact")
+                if session is not None:
+                    await session_store.record(session, plan, search_query.query, cached.answer, cached.sources, search_data.get("data") or [])
+                    response.metadata["session"] = session_meta
+                return with_debug_timings(response, search_query, trace)
         
         # Step 3: Build enhanced prompt
-        messages = build_enhanced_prompt(search_query.query, context)
-        
-        # Step 4: Generate AI answer
-        answer = generate_ai_answer(
-            messages=messages,
-            llm_provider=search_query.llm_provider,
-            llm_api_key=search_query.llm_api_key,
-            llm_model=search_query.llm_model
-        )
+        with span("prompt"):
+            messages = build_enhanced_prompt(search_query.query, context, history)
+            context_report["prompt_tokens"] = sum(estimate_tokens(m["content"]) for m in messages)
+            context_report["prompt_prefix_hash"] = prompt_prefix_hash(messages)
+        
+        # Step 4: Generate AI answer (sources only when the deadline leaves no time for it)
+        try:
+            if deadline_budget(LLM_TIMEOUT) < LLM_MIN_MS / 1000:
+                raise DeadlineExceeded("llm")
+            answer, llm_route = await generate_ai_answer(
+                messages=messages,
+                llm_provider=search_query.llm_provider,
+                llm_api_key=search_query.llm_api_key,
+                llm_model=search_query.llm_model
+            )
+        except DeadlineExceeded as e:
+            return with_debug_timings(SearchResponse.model_construct(
+                answer=DEADLINE_ANSWER,
+                sources=sources,
+                metadata={
+                    "query": search_query.query,
+                    "search_engine": search_query.search_engine,
+                    "llm_provider": search_query.llm_provider,
+                    "llm_model": search_query.llm_model,
+                    "results_found": len(sources),
+                    "processing_time_ms": int((time.perf_counter() - start_time) * 1000),
+                    "degraded": degraded_metadata(e),
+                    "context": context_report,
+                    **({"retrieval": retrieval_report} if retrieval_report else {}),
+                    **({"deep_retrieval": deep_report} if deep_report else {}),
+                    **({"session": session_meta} if session_meta else {})
+                }
+            ), search_query, trace)
+        
+        if answer_key is not None:
+            await answer_cache.put(answer_key, answer, sources, search_query.query, retrieval_profile(search_query))
+        if session is not None:
+            await session_store.record(session, plan, search_query.query, answer, sources, search_data.get("data") or [])
         
         # Step 5: Return response
-        processing_time = int((datetime.now() - start_time).total_seconds() * 1000)
+        processing_time = int((time.perf_counter() - start_time) * 1000)
         
-        logger.info(f"Search request completed successfully - Processing time: {processing_time}ms")
+        logger.info(
+            "Search request completed successfully - Processing time: %dms", processing_time,
+            extra={"event": "search_completed", "processing_ms": processing_time}
+        )
         
-        return SearchResponse(
+        return with_debug_timings(SearchResponse.model_construct(
             answer=answer,
             sources=sources,
             metadata={
@@ -576,19 +1629,554 @@ async def smart_search(search_query: SearchQuery):
                 "llm_provider": search_query.llm_provider,
                 "llm_model": search_query.llm_model,
                 "results_found": len(sources),
-                "processing_time_ms": processing_time
+                "processing_time_ms": processing_time,
+                "answer_cache": {"hit": False},
+                "context": context_report,
+                "llm": llm_route,
+                **({"retrieval": retrieval_report} if retrieval_report else {}),
+                **({"deep_retrieval": deep_report} if deep_report else {}),
+                **({"session": session_meta} if session_meta else {})
             }
-        )
+        ), search_query, trace)
         
     except HTTPException:
         # Re-raise HTTP exceptions
         raise
+    except DeadlineExceeded as e:
+        raise deadline_error(e)
     except Exception as e:
-        logger.error(f"Unexpected error in search endpoint: {str(e)}")
+        logger.error("Unexpected error in search endpoint: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Internal server error: {str(e)}"
         )
+    finally:
+        record_stage(
+            "total", time.perf_counter() - start_time,
+            provider=search_query.llm_provider,
+            model=search_query.llm_model or DEFAULT_LLM_MODELS[search_query.llm_provider]
+        )
+
+
+async def run_admitted_pipeline(search_query: SearchQuery, progress: Optional[Dict[str, Any]] = None) -> SearchResponse:
+    """run_search_pipeline behind the pipeline admission limit (fast 429 when full)"""
+    try:
+        async with admission_slot("pipeline"):
+            return await run_search_pipeline(search_query, progress)
+    except Overloaded as e:
+        raise overload_error(e)
+    except DeadlineExceeded as e:
+        # The request's deadline ran out while queued for a pipeline slot
+        raise deadline_error(e)
+
+
+def pipeline_key(search_query: SearchQuery) -> tuple:
+    """
+    Coalescing key for a smart_search request
+    
+    Includes fingerprints of user-supplied keys, since an invalid or
+    exhausted key must only fail the requests that used it, the session,
+    whose history shapes the answer, and the debug flag, which adds the
+    run's timings to the response. The deadline is not part of it: each
+    caller waits on the shared run with its own budget (coalesced_search).
+    """
+    return (
+        normalize_query(search_query.query),
+        tuple(search_query.search_engines or [search_query.search_engine]),
+        search_query.pages,
+        search_query.retrieval_mode,
+        search_query.deep_retrieval,
+        search_query.llm_provider,
+        search_query.llm_model or DEFAULT_LLM_MODELS[search_query.llm_provider],
+        search_query.session_id,
+        hash_api_key(search_query.searchcans_api_key),
+        hash_api_key(search_query.llm_api_key),
+        search_query.debug
+    )
+
+
+def coalescing_limit_error() -> HTTPException:
+    logger.warning("Too many requests waiting on the same in-flight query")
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many identical requests in progress, please retry shortly",
+        headers={"Retry-After": "1"}
+    )
+
+
+@app.post(
+    "/api/smart_search",
+    response_model=SearchResponse,
+    responses={
+        200: {"description": "Successful response with AI-generated answer"},
+        400: {"description": "Invalid request parameters"},
+        429: {"description": "Too many requests in progress, retry after Retry-After seconds"},
+        503: {"description": "Service temporarily unavailable"},
+        504: {"description": "Request deadline exceeded before any sources were found"}
+    },
+    tags=["Search"]
+)
+async def smart_search(search_query: SearchQuery, request: Request):
+    """
+    Intelligent search endpoint with RAG architecture
+    
+    Concurrent requests for the same query, engine, provider and model
+    share a single pipeline run (see run_search_pipeline).
+    
+    The request runs under a deadline (deadline_ms, the X-Request-Deadline-Ms
+    header or the server default); when it runs out after the search, the
+    sources are returned with metadata.degraded set. The pipeline is
+    cancelled if the client disconnects.
+    
+    Args:
+        search_query: SearchQuery model containing query and options
+    
+    Returns:
+        SearchResponse with AI answer, sources, and metadata
+    """
+    bind_deadline(resolve_budget_ms(search_query.deadline_ms, request.headers.get(DEADLINE_HEADER)))
+    try:
+        response = await cancel_on_disconnect(request.receive, coalesced_search(search_query))
+    except ClientDisconnected:
+        return client_gone("smart_search")
+    # The pipeline builds the response itself, so skip response_model re-validation
+    return FastJSONResponse(response)
+
+
+def client_gone(endpoint: str) -> Response:
+    """Response for a request whose client disconnected (nobody will read it)"""
+    CLIENT_DISCONNECTS.inc(endpoint=endpoint)
+    logger.info("Client disconnected, %s request cancelled", endpoint)
+    # 499: the nginx convention for "client closed request"
+    return Response(status_code=499)
+
+
+async def coalesced_search(search_query: SearchQuery) -> SearchResponse:
+    """
+    Run the pipeline for a query, sharing the run with identical in-flight queries
+    
+    The shared run keeps the deadline of the caller that started it, so every
+    caller bounds its own wait by its own budget: when that runs out first it
+    gets the sources found so far with DEADLINE_ANSWER (504 if there are
+    none yet), while the run goes on for the callers still waiting.
+    """
+    if pipeline_flight is None:
+        return await run_admitted_pipeline(search_query)
+    
+    key = pipeline_key(search_query)
+    
+    async def lead() -> SearchResponse:
+        progress = pipeline_progress[key] = {}
+        try:
+            return await run_admitted_pipeline(search_query, progress)
+        finally:
+            if pipeline_progress.get(key) is progress:
+                del pipeline_progress[key]
+    
+    start_time = time.perf_counter()
+    try:
+        response, shared = await within(pipeline_flight.do(key, lead), "coalesced_wait")
+    except CoalescingLimitExceeded:
+        raise coalescing_limit_error()
+    except DeadlineExceeded as e:
+        sources = pipeline_progress.get(key, {}).get("sources")
+        if not sources:
+            raise deadline_error(e)
+        return SearchResponse.model_construct(
+            answer=DEADLINE_ANSWER,
+            sources=sources,
+            metadata={
+                "query": search_query.query,
+                "search_engine": search_query.search_engine,
+                "llm_provider": search_query.llm_provider,
+                "llm_model": search_query.llm_model,
+                "results_found": len(sources),
+                "processing_time_ms": int((time.perf_counter() - start_time) * 1000),
+                "degraded": degraded_metadata(e),
+                "coalesced": True
+            }
+        )
+    
+    if shared:
+        # Followers get their own copy, marked as coalesced
+        response = SearchResponse.model_construct(
+            answer=response.answer,
+            sources=response.sources,
+            metadata={**response.metadata, "coalesced": True}
+        )
+    return response
+
+
+async def run_batch(
+    unique_queries: List[tuple[List[int], SearchQuery]],
+    concurrency: int,
+    deadline_header: Optional[str] = None
+) -> AsyncIterator[str]:
+    """
+    Run deduplicated batch queries with bounded concurrency
+    
+    Args:
+        unique_queries: (indices, query) pairs; every index receives the query's result
+        concurrency: Number of worker tasks
+        deadline_header: X-Request-Deadline-Ms of the batch request; the
+            deadline applies to each query from when it starts
+    
+    Yields:
+        One NDJSON line per original query index, in completion order
+    """
+    results: asyncio.Queue = asyncio.Queue()
+    pending = iter(unique_queries)
+    total = sum(len(indices) for indices, _ in unique_queries)
+    
+    async def worker():
+        # Pace upstream calls made on behalf of this batch
+        use_limits(batch_limits)
+        for indices, search_query in pending:
+            try:
+                bind_deadline(resolve_budget_ms(search_query.deadline_ms, deadline_header))
+                response = await coalesced_search(search_query)
+                payload = {"status": 200, "result": response.model_dump()}
+            except HTTPException as e:
+                payload = {"status": e.status_code, "error": e.detail}
+            except Exception as e:
+                logger.error("Unexpected error in batch query: %s", e)
+                payload = {"status": 500, "error": f"Internal server error: {str(e)}"}
+            for position, index in enumerate(indices):
+                line = {"index": index, **payload}
+                if position > 0:
+                    line["deduplicated"] = True
+                await results.put(line)
+    
+    workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(unique_queries)))]
+    try:
+        for _ in range(total):
+            line = await results.get()
+            yield dumps_str(line) + "\n"
+    finally:
+        # Client went away (or we are done): stop the remaining work
+        for task in workers:
+            task.cancel()
+
+
+@app.post(
+    "/api/smart_search/batch",
+    responses={
+        200: {"description": "NDJSON stream: one {index, status, result | error} line per query"},
+        422: {"description": "Invalid request parameters"}
+    },
+    tags=["Search"]
+)
+async def smart_search_batch(batch: BatchSearchRequest, request: Request):
+    """
+    Run many searches in one call
+    
+    Queries run with bounded concurrency and per-upstream rate limits, and
+    results are streamed back as NDJSON in completion order, tagged with
+    the query's index in the request. Duplicate queries in a batch are
+    executed once and their result is sent for every index (marked
+    `deduplicated`).
+    
+    Args:
+        batch: BatchSearchRequest with the list of queries
+    
+    Returns:
+        StreamingResponse with media type application/x-ndjson
+    """
+    groups: Dict[tuple, List[int]] = {}
+    for index, search_query in enumerate(batch.queries):
+        groups.setdefault(pipeline_key(search_query), []).append(index)
+    unique_queries = [(indices, batch.queries[indices[0]]) for indices in groups.values()]
+    
+    concurrency = min(batch.max_concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY)
+    logger.info(
+        "Received batch request: %d queries (%d unique), concurrency %d",
+        len(batch.queries), len(unique_queries), concurrency
+    )
+    
+    return StreamingResponse(
+        run_batch(unique_queries, concurrency, request.headers.get(DEADLINE_HEADER)),
+        media_type="application/x-ndjson"
+    )
+
+
+# Disable proxy buffering so Server-Sent Events reach the client immediately
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no"
+}
+
+
+def format_sse(event: str, data: Any) -> str:
+    """Encode one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {dumps_str(data)}\n\n"
+
+
+async def complete_answer_events(answer: str, sources: List[str], metadata: Dict[str, Any]) -> AsyncIterator[str]:
+    """Event stream for an answer that is already complete (cache hit, no results)"""
+    yield format_sse("sources", sources)
+    yield format_sse("delta", answer)
+    yield format_sse("metadata", metadata)
+
+
+async def open_search_stream(search_query: SearchQuery) -> AsyncIterator[str]:
+    """
+    Run search and context extraction, then return the answer event stream
+    
+    Search and context extraction run before the response starts, so their
+    errors are still returned as normal HTTP errors. The stream then emits:
+    
+    1. `sources` - source URLs, as soon as the search results are parsed
+    2. `delta` - answer text fragments as the LLM produces them
+    3. `metadata` - query info and timing, once the answer is complete
+    
+    A failure while the LLM is streaming is reported as an `error` event.
+    
+    Args:
+        search_query: SearchQuery model containing query and options
+    
+    Returns:
+        Async iterator of encoded SSE events
+    """
+    start_time = time.perf_counter()
+    trace = start_trace()
+    
+    logger.info(
+        "Received streaming search request: '%s' (Engine: %s, LLM: %s)",
+        search_query.query, search_query.search_engine, search_query.llm_provider,
+        extra={"event": "search_received", "engine": search_query.search_engine, "provider": search_query.llm_provider}
+    )
+    
+    model_name = search_query.llm_model or DEFAULT_LLM_MODELS[search_query.llm_provider]
+    with span("answer_cache_lookup"):
+        match = lookup_similar_answer(search_query, model_name)
+    if match is not None:
+        cached, similarity = match
+        metadata = cached_answer_metadata(search_query, cached, similarity, start_time, "semantic")
+        return complete_answer_events(cached.answer, cached.sources, metadata)
+    
+    # Step 1 & 2: Search and extract context (errors surface as HTTP status codes)
+    session, plan = await open_session_turn(search_query)
+    search_data, retrieval_report, deep_report = await gather_search_data(search_query, session, plan)
+    with span("context"):
+        context, sources, context_report = assemble_context(search_data, plan.search_query if plan else search_query.query, model_name)
+    history, session_meta = session_history(session, plan)
+    
+    metadata = {
+        "query": search_query.query,
+        "search_engine": search_query.search_engine,
+        "llm_provider": search_query.llm_provider,
+        "llm_model": search_query.llm_model,
+        "results_found": len(sources)
+    }
+    if retrieval_report:
+        metadata["retrieval"] = retrieval_report
+    if deep_report:
+        metadata["deep_retrieval"] = deep_report
+    if session_meta:
+        metadata["session"] = session_meta
+    
+    if not context:
+        logger.warning("No valid context extracted for query: %s", search_query.query)
+        metadata["results_found"] = 0
+        metadata["processing_time_ms"] = int((time.perf_counter() - start_time) * 1000)
+        return complete_answer_events("Sorry, no relevant search results found. Please try different keywords.", [], metadata)
+    
+    answer_key = None
+    if answer_cache is not None:
+        answer_key = AnswerCache.make_key(search_query.query, search_query.llm_provider, model_name, turn_context_hash(context, history))
+        cached = await answer_cache.get_exact(answer_key)
+        if cached is not None:
+            cached_metadata = cached_answer_metadata(search_query, cached, 1.0, start_time, "exact")
+            if session is not None:
+                await session_store.record(session, plan, search_query.query, cached.answer, cached.sources, search_data.get("data") or [])
+                cached_metadata["session"] = session_meta
+            return complete_answer_events(cached.answer, cached.sources, cached_metadata)
+    
+    # Step 3: Build enhanced prompt and resolve the LLM before streaming starts
+    with span("prompt"):
+        messages = build_enhanced_prompt(search_query.query, context, history)
+        context_report["prompt_tokens"] = sum(estimate_tokens(m["content"]) for m in messages)
+        context_report["prompt_prefix_hash"] = prompt_prefix_hash(messages)
+    metadata["context"] = context_report
+    try:
+        llm_targets = resolve_llm_targets(search_query.llm_provider, search_query.llm_api_key, search_query.llm_model)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if deadline_budget(LLM_TIMEOUT) < LLM_MIN_MS / 1000:
+        metadata["degraded"] = degraded_metadata(DeadlineExceeded("llm"))
+        metadata["processing_time_ms"] = int((time.perf_counter() - start_time) * 1000)
+        return complete_answer_events(DEADLINE_ANSWER, sources, metadata)
+    
+    async def events() -> AsyncIterator[str]:
+        yield format_sse("sources", sources)
+        
+        # Step 4: Forward LLM deltas as they arrive
+        first_token_ms = None
+        llm_started = time.perf_counter()
+        answer_chars = 0
+        # Deltas are only retained when the finished answer will be cached or recorded
+        answer_parts: Optional[List[str]] = [] if answer_key is not None or session is not None else None
+        usage: Dict[str, Dict[str, int]] = {}
+        answer_stream = route_llm_answer(llm_targets, messages, usage)
+        try:
+            async for delta in iterate_within(answer_stream, "llm"):
+                if first_token_ms is None:
+                    first_token_ms = int((time.perf_counter() - start_time) * 1000)
+                    record_stage("llm_first_token", time.perf_counter() - llm_started, provider=answer_stream.route["provider"], model=answer_stream.route["model"])
+                answer_chars += len(delta)
+                if answer_parts is not None:
+                    answer_parts.append(delta)
+                yield format_sse("delta", delta)
+        except DeadlineExceeded as e:
+            # Whatever was streamed stays; the metadata says the answer is incomplete
+            metadata["degraded"] = {**degraded_metadata(e), "answer_chars": answer_chars}
+            metadata["processing_time_ms"] = int((time.perf_counter() - start_time) * 1000)
+            yield format_sse("metadata", metadata)
+            return
+        except Exception as e:
+            logger.error("LLM streaming failed: %s", e)
+            yield format_sse("error", {"detail": f"AI service error: {str(e)}"})
+            return
+        
+        # Step 5: Finish with metadata
+        record_stage("llm", time.perf_counter() - llm_started, provider=answer_stream.route["provider"], model=answer_stream.route["model"])
+        record_stage("total", time.perf_counter() - start_time, provider=search_query.llm_provider, model=model_name)
+        processing_time = int((time.perf_counter() - start_time) * 1000)
+        logger.info(
+            "Streaming search completed - %d characters, Processing time: %dms", answer_chars, processing_time,
+            extra={"event": "search_completed", "processing_ms": processing_time}
+        )
+        if answer_parts is not None:
+            answer = "".join(answer_parts).strip()
+            if answer_key is not None:
+                await answer_cache.put(answer_key, answer, sources, search_query.query, retrieval_profile(search_query))
+            if session is not None:
+                await session_store.record(session, plan, search_query.query, answer, sources, search_data.get("data") or [])
+        metadata["time_to_first_token_ms"] = first_token_ms
+        metadata["processing_time_ms"] = processing_time
+        metadata["answer_cache"] = {"hit": False}
+        metadata["llm"] = {**answer_stream.route, "usage": answer_usage(answer_stream.route, usage)}
+        if search_query.debug:
+            metadata["timings_ms"] = dict(trace)
+        yield format_sse("metadata", metadata)
+    
+    return events()
+
+
+async def open_admitted_stream(search_query: SearchQuery) -> AsyncIterator[str]:
+    """open_search_stream holding a pipeline admission slot until the stream ends"""
+    if admission is None:
+        return await open_search_stream(search_query)
+    try:
+        permit = await admission.limiter("pipeline").acquire()
+    except Overloaded as e:
+        raise overload_error(e)
+    try:
+        events = await open_search_stream(search_query)
+    except BaseException:
+        permit.release()
+        raise
+    
+    async def admitted_events() -> AsyncIterator[str]:
+        try:
+            async for event in events:
+                yield event
+        finally:
+            permit.release()
+    
+    return admitted_events()
+
+
+@app.post(
+    "/api/smart_search/stream",
+    responses={
+        200: {"description": "Server-Sent Events: sources, delta (repeated), metadata"},
+        400: {"description": "Invalid request parameters"},
+        429: {"description": "Too many requests in progress, retry after Retry-After seconds"},
+        503: {"description": "Service temporarily unavailable"},
+        504: {"description": "Request deadline exceeded before any sources were found"}
+    },
+    tags=["Search"]
+)
+async def smart_search_stream(search_query: SearchQuery, request: Request):
+    """
+    Streaming variant of /api/smart_search (Server-Sent Events)
+    
+    Events, in order: `sources`, `delta` (repeated), `metadata`; an `error`
+    event reports a failure while the LLM is streaming. Concurrent requests
+    for the same query share one upstream stream; late joiners replay it
+    from the start.
+    
+    When the request deadline runs out mid-answer the stream ends with a
+    `metadata` event whose `degraded` field says so. A client that
+    disconnects before streaming starts cancels the search.
+    
+    Args:
+        search_query: SearchQuery model containing query and options
+    
+    Returns:
+        StreamingResponse with media type text/event-stream
+    """
+    bind_deadline(resolve_budget_ms(search_query.deadline_ms, request.headers.get(DEADLINE_HEADER)))
+    try:
+        if pipeline_flight is None:
+            events = await cancel_on_disconnect(request.receive, open_admitted_stream(search_query))
+        else:
+            events = await cancel_on_disconnect(request.receive, pipeline_flight.stream(
+                pipeline_key(search_query),
+                lambda: open_admitted_stream(search_query)
+            ))
+    except CoalescingLimitExceeded:
+        raise coalescing_limit_error()
+    except DeadlineExceeded as e:
+        raise deadline_error(e)
+    except ClientDisconnected:
+        return client_gone("smart_search_stream")
+    
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@app.post(
+    "/api/prefetch",
+    status_code=status.HTTP_202_ACCEPTED,
+    responses={
+        202: {"description": "Prefetch status: scheduled, in_flight, cached or skipped (with a reason)"},
+        400: {"description": "Invalid request parameters"}
+    },
+    tags=["Search"]
+)
+async def prefetch(prefetch_request: PrefetchRequest, request: Request):
+    """
+    Warm the search cache for a partial query while the user is typing
+    
+    Returns immediately; the SearchCans call (if any) runs in the background
+    at low priority. A newer prefetch from the same session cancels the
+    previous one. Prefetches are skipped, never queued, when the server is
+    busy or the session has used up its budget.
+    
+    Args:
+        prefetch_request: PrefetchRequest with the partial query
+        request: Incoming request (client address is the default session)
+    
+    Returns:
+        Prefetch status
+    """
+    if prefetcher is None:
+        return {"status": "skipped", "reason": "disabled"}
+    if not (prefetch_request.searchcans_api_key or SEARCHCANS_API_KEY):
+        return {"status": "skipped", "reason": "no_api_key"}
+    client = request.client.host if request.client else "anonymous"
+    session_id = prefetch_request.session_id or client
+    # Session ids are chosen by the client, so calls on the server key are
+    # charged to the client address (a fresh id per call must not reset it)
+    budget_id = f"{client}:{session_id}" if prefetch_request.searchcans_api_key else client
+    return await prefetcher.submit(
+        session_id,
+        prefetch_request.query,
+        prefetch_request.search_engine,
+        prefetch_request.searchcans_api_key,
+        budget_id=budget_id
+    )
 
 
 # ============================================================================
@@ -596,11 +2184,27 @@ async def smart_search(search_query: SearchQuery):
 # ============================================================================
 
 if __name__ == "__main__":
+    import argparse
     import uvicorn
     
+    parser = argparse.ArgumentParser(description="AI Search Engine Backend")
+    parser.add_argument(
+        "--production",
+        action="store_true",
+        default=os.getenv("APP_ENV", "").lower() == "production",
+        help="Multi-worker mode without reload (also enabled by APP_ENV=production)"
+    )
+    parser.add_argument("--workers", type=int, default=0, help="Worker processes in production mode (default: one per core)")
+    args = parser.parse_args()
+    
     port = int(os.getenv("PORT", 8000))
     
-    logger.info(f"Starting server on port {port}")
+    if args.production:
+        from server import run_production
+        run_production("main:app", host="0.0.0.0", port=port, workers=args.workers)
+        raise SystemExit(0)
+    
+    logger.info("Starting server on port %s", port)
     
     uvicorn.run(
         "main:app",
@@ -0,0 +1,209 @@
+"""
+Lightweight Prometheus-style metrics
+
+Counters and histograms with labels, rendered in the Prometheus text
+exposition format by /metrics. No client library is needed; everything
+lives in process memory.
+
+span() times a pipeline stage with the monotonic clock, records it in the
+stage histogram and, when a request trace is active, in that request's
+per-stage breakdown (returned in metadata when debug is set).
+"""
+
+import contextvars
+import math
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonically increasing counter"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(tuple(str(labels.get(n, "")) for n in self.labelnames), 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            # [bucket counts..., sum, count]
+            series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._series.items()):
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(cumulative)}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {_format_value(series[-1])}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds metrics plus callbacks that export gauges from other components"""
+
+    def __init__(self):
+        self._metrics: List = []
+        self._gauge_collectors: List[Callable[[], Dict[str, Tuple[str, float]]]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_gauge_collector(self, collector: Callable[[], Dict[str, Tuple[str, float]]]):
+        """Register a callback returning {metric_name: (help, value)}, read at scrape time"""
+        self._gauge_collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._gauge_collectors:
+            for name, (documentation, value) in sorted(collector().items()):
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "intellisearch_stage_duration_seconds",
+    "Duration of smart_search pipeline stages",
+    ("stage", "engine", "provider", "model"),
+)
+SEARCHCANS_ERRORS = registry.counter(
+    "intellisearch_searchcans_errors_total",
+    "SearchCans upstream errors by API code (or HTTP status / transport error)",
+    ("code",),
+)
+LLM_ERRORS = registry.counter(
+    "intellisearch_llm_errors_total",
+    "LLM upstream errors by provider",
+    ("provider",),
+)
+LLM_TOKENS = registry.counter(
+    "intellisearch_llm_tokens_total",
+    "LLM tokens reported in provider usage, by kind (prompt, cached_prompt, completion)",
+    ("provider", "model", "kind"),
+)
+DEADLINE_EXCEEDED = registry.counter(
+    "intellisearch_deadline_exceeded_total",
+    "Requests whose deadline ran out, by the stage it ran out in",
+    ("stage",),
+)
+CLIENT_DISCONNECTS = registry.counter(
+    "intellisearch_client_disconnects_total",
+    "Requests cancelled because the client disconnected, by endpoint",
+    ("endpoint",),
+)
+
+# Models allowed as a label value; requests may name any model, and every
+# distinct label value would be a new series kept for the process lifetime
+_known_models: Set[str] = set()
+
+
+def register_models(models: Iterable[str]):
+    """Allow these models as `model` label values (the server's defaults and fallbacks)"""
+    _known_models.update(m for m in models if m)
+
+
+def model_label(model: str) -> str:
+    """The `model` label value: known models as-is, anything else as 'other'"""
+    return model if not model or model in _known_models else "other"
+
+
+# Per-request stage breakdown (milliseconds), active while a trace is started
+_trace: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("stage_trace", default=None)
+
+
+def start_trace() -> Dict[str, float]:
+    """Begin collecting a per-stage breakdown for the current request"""
+    trace: Dict[str, float] = {}
+    _trace.set(trace)
+    return trace
+
+
+def record_stage(stage: str, seconds: float, engine: str = "", provider: str = "", model: str = ""):
+    """Record an already-measured stage duration"""
+    STAGE_SECONDS.observe(seconds, stage=stage, engine=engine, provider=provider, model=model_label(model))
+    trace = _trace.get()
+    if trace is not None:
+        # Repeated stages (e.g. fan-out fetches) accumulate
+        trace[stage] = round(trace.get(stage, 0.0) + seconds * 1000, 2)
+
+
+@contextmanager
+def span(stage: str, engine: str = "", provider: str = "", model: str = "") -> Iterator[None]:
+    """Time a block with the monotonic clock and record it as a pipeline stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started, engine, provider, model)
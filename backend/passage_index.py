@@ -0,0 +1,351 @@
+"""
+Local index of previously retrieved passages
+
+Search results are chunked into passages and embedded with hashed word
+unigram + bigram features (CPU only, no model). The vectors live in a
+memory-mapped NumPy matrix next to a SQLite file holding the passage text,
+so the index survives restarts and every worker on the host shares it.
+
+The matrix is stored feature-major (dim x capacity): a query vector has
+only a handful of non-zero features, so scoring every passage reads just
+those rows of the matrix. That makes the nearest-neighbour search exact at
+a cost of nnz(query) x capacity multiply-adds - cheaper than probing an LSH
+index, whose random hyperplanes cannot separate the low (~0.3) cosines that
+short queries have with passages.
+
+Freshness: passages older than `max_age` are never returned, and when the
+index is full the least recently retrieved passages are overwritten first.
+Retrieving the same passage again refreshes it instead of adding a copy.
+
+Index calls are blocking; async code runs them with asyncio.to_thread.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from context_builder import WIDE_CHAR_RE
+from retrieval import normalize_url
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+SENTENCE_END_RE = re.compile(r"(?<=[.!?。！？])\s+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how in is it its of on or that the this to was what when where "
+    "which who why will with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Words without stopwords; runs of CJK characters become character bigrams"""
+    tokens = []
+    for word in WORD_RE.findall(text.casefold()):
+        if WIDE_CHAR_RE.search(word):
+            tokens.extend(word[i:i + 2] for i in range(max(len(word) - 1, 1)))
+        elif word not in STOPWORDS:
+            tokens.append(word)
+    return tokens
+
+
+def embed_text(text: str, dim: int = 1024) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sparse unit vector of hashed unigram + bigram features
+
+    Returns:
+        (buckets, weights): non-zero feature indices (int64) and their float32 weights
+    """
+    tokens = tokenize(text)
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    if not features:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    hashed = np.fromiter((zlib.crc32(f.encode("utf-8")) % dim for f in features), dtype=np.int64, count=len(features))
+    buckets, counts = np.unique(hashed, return_counts=True)
+    weights = (1 + np.log(counts)).astype(np.float32)
+    return buckets, weights / np.linalg.norm(weights)
+
+
+def chunk_text(text: str, chunk_chars: int = 600) -> List[str]:
+    """Split text into chunks of up to ~chunk_chars characters at sentence boundaries"""
+    text = " ".join(text.split())
+    if len(text) <= chunk_chars:
+        return [text] if text else []
+    chunks = []
+    current = ""
+    for sentence in SENTENCE_END_RE.split(text):
+        while len(sentence) > chunk_chars:
+            cut = sentence.rfind(" ", 0, chunk_chars)
+            cut = cut if cut > chunk_chars // 2 else chunk_chars
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if current and len(current) + len(sentence) + 1 > chunk_chars:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}".strip()
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class PassageIndex:
+    """Memory-mapped passage vectors + SQLite passage store"""
+
+    def __init__(
+        self,
+        path: str,
+        capacity: int = 20000,
+        dim: int = 1024,
+        max_age: float = 86400,
+        min_similarity: float = 0.3,
+        min_passages: int = 3,
+        top_k: int = 10,
+        chunk_chars: int = 600,
+        default_mode: str = "local_first",
+        busy_timeout: float = 5.0
+    ):
+        self.path = path
+        self.capacity = capacity
+        self.dim = dim
+        self.max_age = max_age
+        self.min_similarity = min_similarity
+        self.min_passages = min_passages
+        self.top_k = top_k
+        self.chunk_chars = chunk_chars
+        self.default_mode = default_mode
+        self.busy_timeout = busy_timeout
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._vectors: Optional[np.memmap] = None
+        self._pid: Optional[int] = None
+        # Per-row freshness, mirrored from SQLite (0 = free row)
+        self._fetched_at = np.zeros(capacity, dtype=np.float64)
+        self._synced_seq = 0
+        self.searches = 0
+        self.local_hits = 0
+        self.passages_added = 0
+        self.passages_refreshed = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["PassageIndex"]:
+        """Index configured from the environment, or None if disabled"""
+        if os.getenv("LOCAL_INDEX_ENABLED", "false").lower() not in ("1", "true", "yes"):
+            return None
+        return cls(
+            path=os.getenv("LOCAL_INDEX_PATH") or os.path.join(tempfile.gettempdir(), "intellisearch-passages"),
+            capacity=int(os.getenv("LOCAL_INDEX_CAPACITY", 20000)),
+            dim=int(os.getenv("LOCAL_INDEX_DIM", 1024)),
+            max_age=float(os.getenv("LOCAL_INDEX_MAX_AGE", 86400)),
+            min_similarity=float(os.getenv("LOCAL_INDEX_MIN_SIMILARITY", 0.3)),
+            min_passages=int(os.getenv("LOCAL_INDEX_MIN_PASSAGES", 3)),
+            top_k=int(os.getenv("LOCAL_INDEX_TOP_K", 10)),
+            default_mode=os.getenv("LOCAL_INDEX_MODE", "local_first").lower(),
+        )
+
+    # ------------------------------------------------------------------
+    # Storage
+    # ------------------------------------------------------------------
+
+    def _open(self):
+        # Never reuse a connection inherited across fork(); the memmap itself is shared
+        if self._conn is not None and self._pid == os.getpid():
+            return
+        conn = sqlite3.connect(f"{self.path}.sqlite3", timeout=self.busy_timeout, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS passages ("
+            "row INTEGER PRIMARY KEY, passage_key TEXT, url TEXT, title TEXT, content TEXT, query TEXT, "
+            "fetched_at REAL NOT NULL, buckets BLOB, seq INTEGER NOT NULL)"
+        )
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS passages_key ON passages (passage_key)")
+        conn.execute("CREATE INDEX IF NOT EXISTS passages_seq ON passages (seq)")
+        conn.execute("CREATE INDEX IF NOT EXISTS passages_fetched ON passages (fetched_at)")
+
+        vectors_path = f"{self.path}.vectors"
+        shape = f"{self.dim}x{self.capacity}"
+        stored = conn.execute("SELECT value FROM meta WHERE key = 'shape'").fetchone()
+        expected_size = self.dim * self.capacity * np.dtype(np.float16).itemsize
+        if stored is None or stored[0] != shape or not os.path.exists(vectors_path) or os.path.getsize(vectors_path) != expected_size:
+            # New index, or its geometry changed: start over
+            if stored is not None:
+                logger.warning("Passage index shape changed (%s -> %s), rebuilding it", stored[0], shape)
+            conn.execute("DELETE FROM passages")
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('shape', ?)", (shape,))
+            np.memmap(vectors_path, dtype=np.float16, mode="w+", shape=(self.dim, self.capacity)).flush()
+        self._vectors = np.memmap(vectors_path, dtype=np.float16, mode="r+", shape=(self.dim, self.capacity))
+        self._conn, self._pid = conn, os.getpid()
+        self._fetched_at[:] = 0
+        self._synced_seq = 0
+
+    def _sync(self):
+        """Pick up rows added, refreshed or evicted by any process since the last sync"""
+        rows = self._conn.execute(
+            "SELECT row, fetched_at, seq FROM passages WHERE seq > ? ORDER BY seq", (self._synced_seq,)
+        ).fetchall()
+        for row, fetched_at, seq in rows:
+            self._fetched_at[row] = fetched_at
+            self._synced_seq = seq
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+
+    def add(self, query: str, results: List[Dict[str, Any]]) -> int:
+        """
+        Chunk, embed and store search results
+
+        Args:
+            query: Query the results were retrieved for
+            results: SearchCans result dicts (title, url, content)
+
+        Returns:
+            Number of passages added or refreshed
+        """
+        passages = []
+        for result in results:
+            url, content = result.get("url"), result.get("content")
+            if not url or not content:
+                continue
+            title = result.get("title") or ""
+            for chunk in chunk_text(content, self.chunk_chars):
+                key = hashlib.sha1(f"{normalize_url(url)}\n{chunk}".encode("utf-8")).hexdigest()
+                passages.append((key, url, title, chunk, embed_text(f"{title} {chunk}", self.dim)))
+        if not passages:
+            return 0
+
+        with self._lock:
+            self._open()
+            conn = self._conn
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM passages").fetchone()[0]
+                for key, url, title, chunk, (buckets, weights) in passages:
+                    seq += 1
+                    existing = conn.execute("SELECT row FROM passages WHERE passage_key = ?", (key,)).fetchone()
+                    if existing is not None:
+                        conn.execute("UPDATE passages SET fetched_at = ?, query = ?, seq = ? WHERE row = ?", (now, query, seq, existing[0]))
+                        self.passages_refreshed += 1
+                        continue
+                    row = self._allocate_row(conn)
+                    self._vectors[buckets, row] = weights
+                    conn.execute(
+                        "INSERT OR REPLACE INTO passages (row, passage_key, url, title, content, query, fetched_at, buckets, seq) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (row, key, url, title, chunk, query, now, buckets.astype(np.int32).tobytes(), seq)
+                    )
+                    self.passages_added += 1
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self._sync()
+        return len(passages)
+
+    def _allocate_row(self, conn: sqlite3.Connection) -> int:
+        """The next unused row, else the least recently retrieved one (its vector is cleared)"""
+        # Rows are only ever reused, never freed, so rows 0..used-1 are all taken
+        used = conn.execute("SELECT COUNT(*) FROM passages").fetchone()[0]
+        if used < self.capacity:
+            return used
+        row, buckets = conn.execute("SELECT row, buckets FROM passages ORDER BY fetched_at LIMIT 1").fetchone()
+        self._vectors[np.frombuffer(buckets, dtype=np.int32), row] = 0
+        conn.execute("DELETE FROM passages WHERE row = ?", (row,))
+        self.evictions += 1
+        return row
+
+    # ------------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------------
+
+    def search(self, query: str, k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Most similar fresh passages for a query
+
+        Returns:
+            Passages (title, url, content, similarity, age_seconds, query), best first,
+            with similarity of at least min_similarity
+        """
+        k = k or self.top_k
+        buckets, weights = embed_text(query, self.dim)
+        if not len(buckets):
+            return []
+
+        with self._lock:
+            self._open()
+            self._sync()
+            self.searches += 1
+            # Only the query's own feature rows of the matrix are read
+            scores = weights @ self._vectors[buckets].astype(np.float32)
+            now = time.time()
+            scores[self._fetched_at < now - self.max_age] = 0
+            top = min(k, len(scores))
+            candidates = np.argpartition(-scores, top - 1)[:top]
+            candidates = candidates[np.argsort(-scores[candidates])]
+            candidates = [int(row) for row in candidates if scores[row] >= self.min_similarity]
+            if not candidates:
+                return []
+            placeholders = ",".join("?" * len(candidates))
+            rows = self._conn.execute(
+                f"SELECT row, url, title, content, query, fetched_at FROM passages WHERE row IN ({placeholders})",
+                candidates
+            ).fetchall()
+
+        by_row = {row[0]: row for row in rows}
+        passages = []
+        for row in candidates:
+            if row not in by_row:
+                continue
+            _, url, title, content, source_query, fetched_at = by_row[row]
+            passages.append({
+                "title": title,
+                "url": url,
+                "content": content,
+                "similarity": round(float(scores[row]), 4),
+                "age_seconds": int(now - fetched_at),
+                "query": source_query,
+            })
+        return passages
+
+    def covers(self, passages: List[Dict[str, Any]]) -> bool:
+        """True when a search returned enough relevant passages to skip live search"""
+        return len(passages) >= self.min_passages
+
+    def stats(self) -> Dict[str, Any]:
+        """Index counters for /health"""
+        fresh = int((self._fetched_at >= time.time() - self.max_age).sum())
+        return {
+            "path": self.path,
+            "capacity": self.capacity,
+            "dim": self.dim,
+            "default_mode": self.default_mode,
+            "fresh_passages": fresh,
+            "searches": self.searches,
+            "local_hits": self.local_hits,
+            "passages_added": self.passages_added,
+            "passages_refreshed": self.passages_refreshed,
+            "evictions": self.evictions,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+                self._vectors.flush()
+            self._conn = None
+            self._vectors = None
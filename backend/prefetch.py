@@ -0,0 +1,195 @@
+"""
+Speculative prefetch of search results while the user is still typing
+
+The UI sends debounced partial queries to /api/prefetch. Each one warms the
+search-result cache in the background, so by the time the query is
+submitted, smart_search usually finds its results cached (or joins the
+in-flight upstream call) and skips the search stage.
+
+Prefetching is best effort and strictly lower priority than real requests:
+
+- One prefetch per session: a newer query cancels the session's stale one
+- A small concurrency cap; when it is full, or the upstream is already busy
+  with real requests, a prefetch is dropped rather than queued
+- A budget of upstream calls per client and window (cache hits are free),
+  counted in the shared store so it holds across workers; the caller picks
+  who is charged, since session ids are chosen by the client
+"""
+
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from shared_store import MemoryStore
+
+logger = logging.getLogger(__name__)
+
+# (query, search_engine)
+PrefetchKey = Tuple[str, str]
+
+
+@dataclass
+class PrefetchSettings:
+    """Prefetch tuning (see env.example for the matching variables)"""
+    min_chars: int = 4
+    max_concurrency: int = 4
+    max_load: float = 0.5
+    session_budget: int = 20
+    budget_window: float = 600.0
+    max_sessions: int = 10000
+
+    @classmethod
+    def from_env(cls) -> "PrefetchSettings":
+        return cls(
+            min_chars=int(os.getenv("PREFETCH_MIN_CHARS", 4)),
+            max_concurrency=int(os.getenv("PREFETCH_MAX_CONCURRENCY", 4)),
+            max_load=float(os.getenv("PREFETCH_MAX_LOAD", 0.5)),
+            session_budget=int(os.getenv("PREFETCH_SESSION_BUDGET", 20)),
+            budget_window=float(os.getenv("PREFETCH_BUDGET_WINDOW", 600)),
+            max_sessions=int(os.getenv("PREFETCH_MAX_SESSIONS", 10000)),
+        )
+
+
+class Prefetcher:
+    """Per-session, cancellable background cache warming"""
+
+    def __init__(
+        self,
+        fetch: Callable[[str, str, Optional[str]], Awaitable[Any]],
+        is_cached: Callable[[str, str], Awaitable[bool]],
+        load: Optional[Callable[[], float]] = None,
+        settings: Optional[PrefetchSettings] = None,
+        store: Any = None
+    ):
+        """
+        Args:
+            fetch: (query, search_engine, api_key) -> fetches and caches the results
+            is_cached: (query, search_engine) -> whether the results are already cached
+            load: Current upstream occupancy (1.0 = every slot in use); none means idle
+            settings: Limits and budget
+            store: SharedStore for the per-session budget (default: process-local)
+        """
+        self.fetch = fetch
+        self.is_cached = is_cached
+        self.load = load or (lambda: 0.0)
+        self.settings = settings or PrefetchSettings()
+        self.store = store if store is not None else MemoryStore()
+        # session -> (key, task) of its latest prefetch, LRU-bounded
+        self._sessions: "OrderedDict[str, Tuple[PrefetchKey, asyncio.Task]]" = OrderedDict()
+        self._running = 0
+        self.requested = 0
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.already_cached = 0
+        self.skipped_busy = 0
+        self.skipped_budget = 0
+
+    @classmethod
+    def from_env(cls, fetch, is_cached, load=None, store: Any = None) -> Optional["Prefetcher"]:
+        """Prefetcher configured from the environment, or None if prefetch is disabled"""
+        if os.getenv("PREFETCH_ENABLED", "true").lower() not in ("1", "true", "yes"):
+            return None
+        return cls(fetch, is_cached, load=load, settings=PrefetchSettings.from_env(), store=store)
+
+    async def _spend_budget(self, budget_id: str) -> bool:
+        budget_key = f"prefetch_budget:{budget_id}"
+        window = self.settings.budget_window
+        if self.store.shared:
+            used = await asyncio.to_thread(self.store.incr, budget_key, 1.0, window)
+        else:
+            used = self.store.incr(budget_key, 1.0, window)
+        return used <= self.settings.session_budget
+
+    async def submit(
+        self,
+        session_id: str,
+        query: str,
+        search_engine: str,
+        api_key: Optional[str] = None,
+        budget_id: Optional[str] = None
+    ) -> Dict[str, str]:
+        """
+        Start prefetching `query` for a session, replacing its previous prefetch
+
+        Args:
+            session_id: Session whose previous prefetch this one replaces
+            query: Partial query typed so far
+            search_engine: Engine to search with
+            api_key: User's SearchCans key (None for the server key)
+            budget_id: Who the upstream call is charged to (default: the session)
+
+        Returns:
+            {"status": "scheduled" | "in_flight" | "cached" | "skipped", "reason": ...}
+        """
+        self.requested += 1
+        query = query.strip()
+        if len(query) < self.settings.min_chars:
+            return {"status": "skipped", "reason": "too_short"}
+        key = (query, search_engine)
+
+        previous = self._sessions.pop(session_id, None)
+        if previous is not None and not previous[1].done():
+            if previous[0] == key:
+                self._sessions[session_id] = previous
+                return {"status": "in_flight"}
+            # The user has typed on; that result is no longer wanted
+            previous[1].cancel()
+            self.cancelled += 1
+
+        if await self.is_cached(query, search_engine):
+            self.already_cached += 1
+            return {"status": "cached"}
+        if self._running >= self.settings.max_concurrency or self.load() >= self.settings.max_load:
+            self.skipped_busy += 1
+            return {"status": "skipped", "reason": "busy"}
+        if not await self._spend_budget(budget_id or session_id):
+            self.skipped_budget += 1
+            return {"status": "skipped", "reason": "budget"}
+
+        self.started += 1
+        task = asyncio.create_task(self._run(query, search_engine, api_key))
+        self._sessions[session_id] = (key, task)
+        while len(self._sessions) > self.settings.max_sessions:
+            # Forget the oldest session; its prefetch (if any) still finishes
+            self._sessions.popitem(last=False)
+        return {"status": "scheduled"}
+
+    async def _run(self, query: str, search_engine: str, api_key: Optional[str]):
+        self._running += 1
+        try:
+            await self.fetch(query, search_engine, api_key)
+            self.completed += 1
+        except Exception as e:
+            self.failed += 1
+            logger.debug("Prefetch failed - Query: '%s': %s", query, e)
+        finally:
+            self._running -= 1
+
+    async def close(self):
+        """Cancel every running prefetch (shutdown)"""
+        tasks = [task for _, task in self._sessions.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._sessions.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Prefetch counters for /health"""
+        return {
+            "session_budget": self.settings.session_budget,
+            "max_concurrency": self.settings.max_concurrency,
+            "running": self._running,
+            "requested": self.requested,
+            "started": self.started,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "already_cached": self.already_cached,
+            "skipped_busy": self.skipped_busy,
+            "skipped_budget": self.skipped_budget,
+        }
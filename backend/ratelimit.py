@@ -0,0 +1,293 @@
+"""
+Token-bucket rate limiting for upstream calls
+
+A RateLimiterGroup holds one bucket per upstream name (e.g. 'searchcans',
+'llm:openai'). Code paths that want pacing activate a group for the current
+context with use_limits(); upstream call sites then call pace(name), which
+waits for a token when a group is active and returns immediately otherwise.
+That way only real upstream calls are paced, not cache hits.
+
+KeyQuotas paces every upstream call, per provider and per API key (keys are
+only ever held as hashes), and accounts for the quota each key consumes:
+SearchCans calls, LLM tokens from the reported usage. Keys an upstream has
+reported as exhausted or expired (SearchCans -2011 / -2012, LLM
+insufficient_quota or 429 with Retry-After), and keys over a configured
+budget, fail fast with QuotaExhausted instead of spending another round-trip.
+
+With a shared store (multi-worker mode) buckets, quota counters and
+exhaustion marks live in the store, so they apply to the whole server
+rather than to each worker.
+"""
+
+import asyncio
+import contextvars
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from clients import hash_api_key
+from shared_store import MemoryStore
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, up to `burst` stored"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.waited_seconds = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0):
+        """Wait until `tokens` are available, then take them"""
+        # The lock makes waiters queue up in FIFO order
+        async with self._lock:
+            self._refill()
+            if self._tokens < tokens:
+                wait = (tokens - self._tokens) / self.rate
+                self.waited_seconds += wait
+                await asyncio.sleep(wait)
+                self._refill()
+            self._tokens -= tokens
+
+
+class SharedTokenBucket:
+    """Token bucket whose state lives in a SharedStore, shared by all workers"""
+
+    def __init__(self, store: Any, name: str, rate: float, burst: Optional[float] = None):
+        self.store = store
+        self.name = name
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self.waited_seconds = 0.0
+
+    async def acquire(self, tokens: float = 1.0):
+        """Wait until `tokens` are available, then take them"""
+        while True:
+            wait = await asyncio.to_thread(self.store.take_tokens, self.name, self.rate, self.burst, tokens)
+            if wait <= 0:
+                return
+            # Other workers may take the refill first, so re-check after sleeping
+            self.waited_seconds += wait
+            await asyncio.sleep(wait)
+
+
+class RateLimiterGroup:
+    """Named token buckets; names without a configured rate are unlimited"""
+
+    def __init__(self, rates: Dict[str, float], store: Any = None, namespace: str = "ratelimit"):
+        shared = store is not None and store.shared
+        self.buckets = {
+            name: SharedTokenBucket(store, f"{namespace}:{name}", rate) if shared else TokenBucket(rate)
+            for name, rate in rates.items() if rate > 0
+        }
+
+    @classmethod
+    def from_env(cls, prefix: str = "BATCH_RATE_LIMIT_", store: Any = None) -> "RateLimiterGroup":
+        """Read requests-per-second limits, e.g. BATCH_RATE_LIMIT_SEARCHCANS=5"""
+        return cls({
+            "searchcans": float(os.getenv(f"{prefix}SEARCHCANS", 0)),
+            "llm:openai": float(os.getenv(f"{prefix}OPENAI", 0)),
+            "llm:qwen": float(os.getenv(f"{prefix}QWEN", 0)),
+        }, store=store, namespace=prefix.rstrip("_").lower())
+
+    async def acquire(self, name: str):
+        bucket = self.buckets.get(name)
+        if bucket is not None:
+            await bucket.acquire()
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {
+            name: {"rate_per_second": bucket.rate, "waited_seconds": round(bucket.waited_seconds, 3)}
+            for name, bucket in self.buckets.items()
+        }
+
+
+_active_limits: contextvars.ContextVar[Optional[RateLimiterGroup]] = contextvars.ContextVar("active_limits", default=None)
+
+
+def use_limits(group: Optional[RateLimiterGroup]):
+    """Activate a limiter group for the current context (and tasks it spawns)"""
+    _active_limits.set(group)
+
+
+async def pace(name: str):
+    """Wait for a token from the active limiter group, if any"""
+    group = _active_limits.get()
+    if group is not None:
+        await group.acquire(name)
+
+
+class QuotaExhausted(Exception):
+    """An API key is known to be out of quota (or expired), so the call was not made"""
+
+    def __init__(self, upstream: str, reason: str, retry_after: int):
+        super().__init__(f"{upstream} API key {reason.replace('_', ' ')}, retry after {retry_after}s")
+        self.upstream = upstream
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class KeyQuotas:
+    """
+    Per-provider and per-key pacing plus quota accounting for upstream calls
+
+    Upstream names match RateLimiterGroup ('searchcans', 'llm:openai', ...).
+    Quota units are calls for SearchCans and total tokens for LLMs; budgets
+    (units per window, 0 = unlimited) apply to every key separately.
+    """
+
+    def __init__(
+        self,
+        provider_rates: Dict[str, float],
+        key_rates: Dict[str, float],
+        budgets: Optional[Dict[str, float]] = None,
+        store: Any = None,
+        window: float = 86400.0,
+        exhausted_ttl: float = 300.0,
+        expired_ttl: float = 3600.0,
+        max_keys: int = 1024
+    ):
+        self.store = store if store is not None else MemoryStore()
+        self.providers = RateLimiterGroup(provider_rates, store=self.store, namespace="upstream_rate_limit")
+        self.key_rates = {name: rate for name, rate in key_rates.items() if rate > 0}
+        self.budgets = {name: budget for name, budget in (budgets or {}).items() if budget > 0}
+        self.window = window
+        self.exhausted_ttl = exhausted_ttl
+        self.expired_ttl = expired_ttl
+        self.max_keys = max_keys
+        # (upstream, key hash) -> bucket, LRU-bounded; shared buckets keep their state in the store
+        self._key_buckets: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+        # Marks seen by this worker: (upstream, key hash) -> (expires_at, reason)
+        self._blocked: Dict[Tuple[str, str], Tuple[float, str]] = {}
+        self.calls = 0
+        self.units = 0.0
+        self.rejected = 0
+        self.marked = 0
+
+    @classmethod
+    def from_env(cls, store: Any = None) -> Optional["KeyQuotas"]:
+        """Build from UPSTREAM_RATE_LIMIT_* / KEY_RATE_LIMIT_* / KEY_QUOTA_* settings; None if disabled"""
+        if os.getenv("KEY_QUOTAS_ENABLED", "true").lower() not in ("1", "true", "yes"):
+            return None
+
+        def per_upstream(prefix: str) -> Dict[str, float]:
+            return {
+                "searchcans": float(os.getenv(f"{prefix}SEARCHCANS", 0)),
+                "llm:openai": float(os.getenv(f"{prefix}OPENAI", 0)),
+                "llm:qwen": float(os.getenv(f"{prefix}QWEN", 0)),
+            }
+
+        return cls(
+            provider_rates=per_upstream("UPSTREAM_RATE_LIMIT_"),
+            key_rates=per_upstream("KEY_RATE_LIMIT_"),
+            budgets=per_upstream("KEY_QUOTA_"),
+            store=store,
+            window=float(os.getenv("KEY_QUOTA_WINDOW", 86400)),
+            exhausted_ttl=float(os.getenv("KEY_EXHAUSTED_TTL", 300)),
+            expired_ttl=float(os.getenv("KEY_EXPIRED_TTL", 3600)),
+            max_keys=int(os.getenv("KEY_QUOTA_MAX_KEYS", 1024)),
+        )
+
+    async def _store_call(self, fn, *args):
+        # File-backed stores block on disk I/O; the memory store is just a dict
+        if self.store.shared:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    def _key_bucket(self, upstream: str, key_hash: str):
+        rate = self.key_rates.get(upstream)
+        if rate is None:
+            return None
+        slot = (upstream, key_hash)
+        bucket = self._key_buckets.get(slot)
+        if bucket is None:
+            if self.store.shared:
+                bucket = SharedTokenBucket(self.store, f"key_rate_limit:{upstream}:{key_hash}", rate)
+            else:
+                bucket = TokenBucket(rate)
+            self._key_buckets[slot] = bucket
+            while len(self._key_buckets) > self.max_keys:
+                self._key_buckets.popitem(last=False)
+        else:
+            self._key_buckets.move_to_end(slot)
+        return bucket
+
+    async def check(self, upstream: str, api_key: Optional[str]):
+        """Raise QuotaExhausted if the key is blocked or over its budget"""
+        key_hash = hash_api_key(api_key)
+        slot = (upstream, key_hash)
+        now = time.time()
+        blocked = self._blocked.get(slot)
+        if blocked is not None and blocked[0] <= now:
+            del self._blocked[slot]
+            blocked = None
+        if blocked is None and self.store.shared:
+            # Another worker may have learned it first
+            mark = await self._store_call(self.store.get, f"key_blocked:{upstream}:{key_hash}")
+            if mark is not None:
+                expires_at, reason = mark.split(":", 1)
+                blocked = (float(expires_at), reason)
+                self._blocked[slot] = blocked
+        if blocked is not None:
+            self.rejected += 1
+            raise QuotaExhausted(upstream, blocked[1], max(1, int(blocked[0] - now)))
+
+        budget = self.budgets.get(upstream)
+        if budget is not None:
+            used = await self._store_call(self.store.get, f"key_quota:{upstream}:{key_hash}")
+            if used is not None and float(used) >= budget:
+                self.rejected += 1
+                raise QuotaExhausted(upstream, "budget_exceeded", int(self.window))
+
+    async def acquire(self, upstream: str, api_key: Optional[str]):
+        """Fail fast for a known-exhausted key, else wait for the provider's and the key's tokens"""
+        await self.check(upstream, api_key)
+        await self.providers.acquire(upstream)
+        bucket = self._key_bucket(upstream, hash_api_key(api_key))
+        if bucket is not None:
+            await bucket.acquire()
+
+    async def record(self, upstream: str, api_key: Optional[str], units: float = 1.0):
+        """Account for a completed call (units: 1 per SearchCans call, total tokens for LLMs)"""
+        self.calls += 1
+        self.units += units
+        if units > 0:
+            await self._store_call(self.store.incr, f"key_quota:{upstream}:{hash_api_key(api_key)}", units, self.window)
+
+    async def mark(self, upstream: str, api_key: Optional[str], reason: str, ttl: Optional[float] = None):
+        """Block a key the upstream reported as exhausted / expired / rate limited"""
+        if ttl is None:
+            ttl = self.expired_ttl if reason == "expired" else self.exhausted_ttl
+        key_hash = hash_api_key(api_key)
+        expires_at = time.time() + ttl
+        self._blocked[(upstream, key_hash)] = (expires_at, reason)
+        self.marked += 1
+        await self._store_call(self.store.set, f"key_blocked:{upstream}:{key_hash}", f"{expires_at}:{reason}", ttl)
+
+    async def usage(self, upstream: str, api_key: Optional[str]) -> float:
+        """Quota units the key has consumed in the current window"""
+        used = await self._store_call(self.store.get, f"key_quota:{upstream}:{hash_api_key(api_key)}")
+        return float(used) if used is not None else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "calls": self.calls,
+            "quota_units": self.units,
+            "rejected_calls": self.rejected,
+            "keys_marked": self.marked,
+            "keys_blocked": sum(1 for expires_at, _ in self._blocked.values() if expires_at > now),
+            "keys_paced": len(self._key_buckets),
+            "key_rate_per_second": dict(self.key_rates),
+            "budgets": dict(self.budgets),
+            "provider_limits": self.providers.stats(),
+        }
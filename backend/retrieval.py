@@ -0,0 +1,155 @@
+"""
+Parallel fan-out retrieval across search engines and result pages
+
+All (engine, page) fetches start at once. Whatever has arrived when the
+global deadline hits is merged, deduplicated by normalized URL and
+returned; fetches still running are cancelled and reported as late.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# Query parameters that only track the click and never change the page
+TRACKING_PARAMS = ("utm_", "gclid", "fbclid", "msclkid", "ref", "spm")
+
+
+def normalize_url(url: str) -> str:
+    """
+    Canonical form of a URL for deduplication
+
+    Lower-cases scheme and host, drops 'www.', fragments, default ports,
+    tracking parameters and trailing slashes, and sorts the query string.
+    """
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return url.strip()
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith(TRACKING_PARAMS)
+    )
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit(("https" if parts.scheme in ("http", "https") else parts.scheme, host, path, urlencode(query), ""))
+
+
+def merge_results(batches: List[Tuple[int, List[Dict[str, Any]]]]) -> List[Dict[str, Any]]:
+    """
+    Merge result lists by rank, dropping duplicate URLs
+
+    Args:
+        batches: (source order, results) pairs; lower order wins rank ties
+
+    Returns:
+        Merged result list: every source's #1 first, then every #2, ...
+    """
+    ranked = []
+    for order, results in batches:
+        for rank, result in enumerate(results):
+            ranked.append((rank, order, result))
+    ranked.sort(key=lambda item: (item[0], item[1]))
+
+    merged = []
+    seen = set()
+    for _, _, result in ranked:
+        url = result.get("url")
+        if not url:
+            continue
+        key = normalize_url(url)
+        if key in seen:
+            continue
+        seen.add(key)
+        merged.append(result)
+    return merged
+
+
+async def fetch_fanout(
+    fetch: Callable[..., Awaitable[Dict[str, Any]]],
+    query: str,
+    engines: List[str],
+    pages: int,
+    api_key: Optional[str] = None,
+    deadline_s: float = 8.0
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Query every (engine, page) combination concurrently under one deadline
+
+    Args:
+        fetch: fetch_searchcans_results-compatible coroutine function
+        query: Search query string
+        engines: Search engines to query, in priority order
+        pages: Number of pages per engine (1..pages)
+        api_key: Optional custom SearchCans API key
+        deadline_s: Global deadline in seconds
+
+    Returns:
+        (search_data, report): merged SearchCans-style payload and per-source timings
+
+    Raises:
+        HTTPException: When no source returned in time (504) or all failed (first error)
+    """
+    sources = [(engine, page) for page in range(1, pages + 1) for engine in engines]
+    started = time.perf_counter()
+    finished_at: Dict[Tuple[str, int], float] = {}
+
+    async def timed(engine: str, page: int) -> Dict[str, Any]:
+        try:
+            return await fetch(query=query, search_engine=engine, page=page, api_key=api_key)
+        finally:
+            finished_at[(engine, page)] = time.perf_counter()
+
+    tasks = {asyncio.ensure_future(timed(engine, page)): (engine, page) for engine, page in sources}
+    done, pending = await asyncio.wait(tasks, timeout=deadline_s)
+    for task in pending:
+        task.cancel()
+
+    batches = []
+    report_sources = []
+    first_error = None
+    for order, task in enumerate(tasks):
+        engine, page = tasks[task]
+        entry = {"engine": engine, "page": page}
+        if task in pending:
+            entry.update(status="late", elapsed_ms=int(deadline_s * 1000))
+        else:
+            entry["elapsed_ms"] = int((finished_at[(engine, page)] - started) * 1000)
+            error = task.exception()
+            if error is not None:
+                first_error = first_error or error
+                entry.update(status="error", error=getattr(error, "detail", str(error)))
+            else:
+                results = task.result().get("data") or []
+                batches.append((order, results))
+                entry.update(status="ok", results=len(results))
+        report_sources.append(entry)
+
+    if not batches:
+        if first_error is None:
+            raise HTTPException(status_code=504, detail="Search service timeout, please try again")
+        raise first_error if isinstance(first_error, HTTPException) else HTTPException(status_code=503, detail=str(first_error))
+
+    merged = merge_results(batches)
+    dropped = [f"{s['engine']}:p{s['page']}" for s in report_sources if s["status"] == "late"]
+    if dropped:
+        logger.warning("Fan-out deadline (%.1fs) dropped late fetches: %s", deadline_s, ", ".join(dropped))
+
+    report = {
+        "mode": "fanout",
+        "deadline_ms": int(deadline_s * 1000),
+        "elapsed_ms": int((time.perf_counter() - started) * 1000),
+        "sources": report_sources,
+        "dropped_late": dropped,
+        "results_merged": len(merged),
+    }
+    return {"code": 0, "msg": "success", "data": merged}, report
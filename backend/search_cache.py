@@ -0,0 +1,212 @@
+"""
+Tiered cache for SearchCans results
+
+Tier 1: in-process LRU bounded by total (JSON-encoded) size in bytes
+Tier 2: optional SQLite file that survives restarts and is shared by all
+        workers on the host
+
+Entries are keyed on the normalized (query, search_engine, page) and expire
+after a TTL. Only successful upstream responses are cached.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, str, int]
+
+
+def normalize_query(query: str) -> str:
+    """Case-fold and collapse whitespace so trivially different queries share an entry"""
+    return " ".join(query.casefold().split())
+
+
+def make_cache_key(query: str, search_engine: str, page: int) -> CacheKey:
+    return (normalize_query(query), search_engine.lower(), int(page))
+
+
+class MemoryTier:
+    """LRU cache bounded by the total size of its values in bytes"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._data: "OrderedDict[CacheKey, Tuple[float, int, Dict[str, Any]]]" = OrderedDict()
+        self.evictions = 0
+
+    def get(self, key: CacheKey) -> Optional[Dict[str, Any]]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, size, value = item
+        if expires_at < time.time():
+            self._remove(key)
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key: CacheKey, value: Dict[str, Any], size: int, expires_at: float):
+        if size > self.max_bytes:
+            return
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = (expires_at, size, value)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: CacheKey):
+        _, size, _ = self._data.pop(key)
+        self.bytes -= size
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteTier:
+    """Persistent cache tier; calls are blocking and meant to run in a thread"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # Opened lazily per process: a connection inherited across fork() is unsafe
+        if self._connection is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS search_cache ("
+                "key TEXT PRIMARY KEY, expires_at REAL NOT NULL, value TEXT NOT NULL)"
+            )
+            conn.commit()
+            self._connection, self._pid = conn, os.getpid()
+        return self._connection
+
+    @staticmethod
+    def _encode_key(key: CacheKey) -> str:
+        return json.dumps(key, ensure_ascii=False)
+
+    def get(self, key: CacheKey) -> Optional[Tuple[float, str]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT expires_at, value FROM search_cache WHERE key = ? AND expires_at >= ?",
+                (self._encode_key(key), time.time())
+            ).fetchone()
+        return row
+
+    def put(self, key: CacheKey, encoded: str, expires_at: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO search_cache (key, expires_at, value) VALUES (?, ?, ?)",
+                (self._encode_key(key), expires_at, encoded)
+            )
+            self._conn.commit()
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM search_cache WHERE expires_at < ?", (time.time(),))
+            self._conn.commit()
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None and self._pid == os.getpid():
+                self._connection.close()
+            self._connection = None
+
+
+class SearchCache:
+    """Memory LRU in front of an optional SQLite tier"""
+
+    def __init__(self, ttl: float = 600, max_bytes: int = 64 * 1024 * 1024, db_path: Optional[str] = None):
+        self.ttl = ttl
+        self.memory = MemoryTier(max_bytes)
+        self.disk = SQLiteTier(db_path) if db_path else None
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self._puts = 0
+
+    @classmethod
+    def from_env(cls, default_db_path: Optional[str] = None) -> Optional["SearchCache"]:
+        """
+        Build the cache from environment variables (None when disabled)
+
+        Args:
+            default_db_path: SQLite tier used when SEARCH_CACHE_DB is unset
+                (the shared store's file in multi-worker mode)
+        """
+        if os.getenv("SEARCH_CACHE_ENABLED", "true").lower() not in ("1", "true", "yes"):
+            return None
+        return cls(
+            ttl=float(os.getenv("SEARCH_CACHE_TTL", 600)),
+            max_bytes=int(os.getenv("SEARCH_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+            db_path=os.getenv("SEARCH_CACHE_DB", default_db_path) or None,
+        )
+
+    async def get(self, key: CacheKey) -> Optional[Dict[str, Any]]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits_memory += 1
+            return value
+
+        if self.disk is not None:
+            row = await asyncio.to_thread(self.disk.get, key)
+            if row is not None:
+                expires_at, encoded = row
+                value = json.loads(encoded)
+                # Promote to the memory tier with the remaining TTL
+                self.memory.put(key, value, len(encoded), expires_at)
+                self.hits_disk += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: CacheKey, value: Dict[str, Any]):
+        encoded = json.dumps(value, ensure_ascii=False)
+        expires_at = time.time() + self.ttl
+        self.memory.put(key, value, len(encoded), expires_at)
+
+        if self.disk is not None:
+            self._puts += 1
+            try:
+                await asyncio.to_thread(self.disk.put, key, encoded, expires_at)
+                if self._puts % 500 == 0:
+                    await asyncio.to_thread(self.disk.purge_expired)
+            except sqlite3.Error as e:
+                logger.warning("Search cache write failed: %s", e)
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Cache counters for /health"""
+        lookups = self.hits_memory + self.hits_disk + self.misses
+        return {
+            "ttl_seconds": self.ttl,
+            "entries": len(self.memory),
+            "bytes": self.memory.bytes,
+            "max_bytes": self.memory.max_bytes,
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "evictions": self.memory.evictions,
+            "hit_rate": round((self.hits_memory + self.hits_disk) / lookups, 4) if lookups else 0.0,
+            "persistent": self.disk is not None,
+        }
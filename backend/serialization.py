@@ -0,0 +1,45 @@
+"""
+Fast JSON encoding for responses, SSE events and NDJSON lines
+
+Uses orjson when it is installed (several times faster than the stdlib
+encoder and emits UTF-8 directly) and falls back to json otherwise.
+
+FastJSONResponse renders pydantic models with their compiled serializer
+and everything else with dumps(), so an endpoint that returns one skips
+FastAPI's response_model re-validation and jsonable_encoder pass. Only
+return it with models the server built itself.
+"""
+
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from pydantic_core import to_json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+
+
+def dumps(obj: Any) -> bytes:
+    """Encode to compact UTF-8 JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_str(obj: Any) -> str:
+    return dumps(obj).decode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response without re-validation; orjson / pydantic-core encoding"""
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, BaseModel):
+            return to_json(content)
+        return dumps(content)
@@ -0,0 +1,97 @@
+"""
+Production launcher
+
+Runs the app with one worker process per available CPU core, no reload,
+and the app preloaded in the master process before forking (gunicorn with
+uvicorn workers). Without gunicorn installed (e.g. on Windows) it falls
+back to uvicorn's own multi-process mode, which imports the app in every
+worker instead of preloading it.
+
+APP_WORKERS is exported before the app is imported, so every worker knows
+it is one of several and picks the file-backed shared store (see
+shared_store.py) unless SHARED_STORE says otherwise.
+"""
+
+import importlib.util
+import logging
+import math
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def available_cpus() -> int:
+    """CPU cores this process may use (affinity mask and cgroup v2 quota aware)"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return max(1, cpus)
+
+
+def run_production(app_path: str = "main:app", host: str = "0.0.0.0", port: int = 8000, workers: int = 0):
+    """
+    Serve the app with multiple workers
+
+    Args:
+        app_path: "module:attribute" of the ASGI app
+        host: Interface to bind
+        port: Port to bind
+        workers: Worker processes; 0 = WEB_CONCURRENCY or one per available core
+    """
+    workers = workers or int(os.getenv("WEB_CONCURRENCY", 0)) or available_cpus()
+    os.environ["APP_WORKERS"] = str(workers)
+
+    if importlib.util.find_spec("gunicorn") is not None:
+        logger.info("Starting gunicorn on %s:%s with %d preloaded uvicorn workers", host, port, workers)
+        _run_gunicorn(app_path, host, port, workers)
+        return
+
+    import uvicorn
+
+    logger.warning("gunicorn not installed - starting uvicorn workers without preloading the app")
+    uvicorn.run(
+        app_path,
+        host=host,
+        port=port,
+        workers=workers,
+        reload=False,
+        proxy_headers=True,
+        log_level="info"
+    )
+
+
+def _run_gunicorn(app_path: str, host: str, port: int, workers: int):
+    from gunicorn.app.base import BaseApplication
+    from gunicorn.util import import_app
+
+    class Application(BaseApplication):
+        def load_config(self):
+            settings = {
+                "bind": f"{host}:{port}",
+                "workers": workers,
+                "worker_class": "uvicorn.workers.UvicornWorker",
+                "preload_app": True,
+                "timeout": int(os.getenv("WORKER_TIMEOUT", 120)),
+                "graceful_timeout": 30,
+                "keepalive": 5,
+            }
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            app = import_app(app_path)
+            # The app defers the provider SDK import; do it once here so every
+            # forked worker starts with it already loaded
+            from clients import load_openai
+            load_openai()
+            return app
+
+    Application().run()
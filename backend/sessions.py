@@ -0,0 +1,336 @@
+"""
+Conversation sessions for follow-up questions
+
+A request with a session_id is one turn of a conversation. The session
+keeps the earlier turns (question, search query, answer) and a pool of the
+search results they retrieved, after deep retrieval, so it holds the
+extracted page passages too. A follow-up like "what about in 2025?" then
+builds on what is already there instead of starting over:
+
+- Search: the follow-up's new terms (words not in earlier questions) are
+  appended to the last search query. When there are none ("tell me more"),
+  or the pooled passages already cover all of them, no search runs;
+  otherwise only that incremental query is searched, and its results are
+  merged into the pool.
+- Context: new and pooled results are ranked together (context_builder).
+- Prompt: earlier turns are sent as chat history, newest first until the
+  history token budget is spent.
+
+A question that shares no terms with the conversation and is long enough
+to stand on its own starts a new topic: it is searched as is, without the
+pool (the history is still sent).
+
+Sessions live in a process-local LRU with a TTL. With a shared store
+(multi-worker mode) they are also written there and read back from it, so
+any worker can continue a conversation.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from context_builder import estimate_tokens, tokenize, truncate_to_tokens
+from retrieval import normalize_url
+from serialization import dumps_str
+
+logger = logging.getLogger(__name__)
+
+# Words that say nothing about what to search for
+STOPWORDS = frozenset("""
+a about above after again all also an and any are as at be because been before being between both but by
+can could did do does doing for from further had has have having he her here hers him his how i if in into
+is it its itself just me more most my no nor not of off on once only or other our out over own same she
+should so some such than that the their them then there these they this those through to too under until
+up very was we were what when where which while who whom why will with would you your explain tell show
+give compare detail details part please thanks again else
+""".split())
+
+# Per-message overhead of the chat format, in tokens
+MESSAGE_OVERHEAD = 4
+# An answer is not worth including when less than this much of it fits
+MIN_ANSWER_TOKENS = 64
+
+
+def content_terms(text: str) -> List[str]:
+    """Distinct search-worthy terms of a question, in order"""
+    return list(dict.fromkeys(t for t in tokenize(text) if t not in STOPWORDS and len(t) > 1))
+
+
+@dataclass
+class Turn:
+    query: str
+    search_query: str
+    answer: str
+    sources: List[str]
+
+
+@dataclass
+class Session:
+    session_id: str
+    turns: List[Turn] = field(default_factory=list)
+    # Search results of earlier turns (newest first), deep-retrieved content included
+    results: List[Dict[str, Any]] = field(default_factory=list)
+    expires_at: float = 0.0
+
+
+@dataclass
+class TurnPlan:
+    """How to retrieve context for one turn"""
+    search_query: str
+    search: bool
+    reuse_results: bool
+    followup: bool
+    new_terms: List[str] = field(default_factory=list)
+
+    @property
+    def mode(self) -> str:
+        if not self.followup or not self.reuse_results:
+            return "full"
+        return "incremental" if self.search else "skipped"
+
+
+class SessionStore:
+    """LRU + TTL conversation store"""
+
+    def __init__(
+        self,
+        ttl: float = 1800,
+        max_sessions: int = 1000,
+        max_turns: int = 10,
+        max_results: int = 30,
+        history_tokens: int = 1000,
+        coverage_passages: int = 2,
+        standalone_terms: int = 4,
+        store: Any = None
+    ):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self.max_results = max_results
+        self.history_tokens = history_tokens
+        self.coverage_passages = coverage_passages
+        self.standalone_terms = standalone_terms
+        # Only a cross-process store adds anything over the local entries
+        self.store = store if store is not None and store.shared else None
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.turns = 0
+        self.followups = 0
+        self.searches_skipped = 0
+        self.searches_incremental = 0
+        self.topic_changes = 0
+        self.evictions = 0
+        self.expired = 0
+
+    @classmethod
+    def from_env(cls, store: Any = None) -> Optional["SessionStore"]:
+        """Build the store from environment variables (None when disabled)"""
+        if os.getenv("SESSIONS_ENABLED", "true").lower() not in ("1", "true", "yes"):
+            return None
+        return cls(
+            ttl=float(os.getenv("SESSION_TTL", 1800)),
+            max_sessions=int(os.getenv("SESSION_MAX_SESSIONS", 1000)),
+            max_turns=int(os.getenv("SESSION_MAX_TURNS", 10)),
+            max_results=int(os.getenv("SESSION_MAX_RESULTS", 30)),
+            history_tokens=int(os.getenv("SESSION_HISTORY_TOKENS", 1000)),
+            coverage_passages=int(os.getenv("SESSION_COVERAGE_PASSAGES", 2)),
+            standalone_terms=int(os.getenv("SESSION_STANDALONE_TERMS", 4)),
+            store=store,
+        )
+
+    @staticmethod
+    def _store_key(session_id: str) -> str:
+        return f"session:{session_id}"
+
+    async def get(self, session_id: str) -> Session:
+        """The session's state, or a new empty session"""
+        session = None
+        if self.store is not None:
+            # The shared copy is authoritative: another worker may have served the last turn
+            session = await self._get_shared(session_id)
+        if session is None:
+            session = self._sessions.get(session_id)
+            if session is not None and session.expires_at < time.time():
+                self._sessions.pop(session_id)
+                self.expired += 1
+                session = None
+        if session is None:
+            return Session(session_id)
+        self._sessions[session_id] = session
+        self._sessions.move_to_end(session_id)
+        return session
+
+    async def _get_shared(self, session_id: str) -> Optional[Session]:
+        try:
+            encoded = await asyncio.to_thread(self.store.get, self._store_key(session_id))
+        except Exception as e:
+            logger.warning("Shared session read failed: %s", e)
+            return None
+        if encoded is None:
+            return None
+        data = json.loads(encoded)
+        return Session(
+            session_id=session_id,
+            turns=[Turn(**turn) for turn in data["turns"]],
+            results=data["results"],
+            expires_at=data["expires_at"],
+        )
+
+    def plan(self, session: Session, query: str) -> TurnPlan:
+        """
+        Decide how much of the session a new question can reuse
+
+        Args:
+            session: The conversation so far
+            query: The new question
+
+        Returns:
+            TurnPlan: what to search for, and whether to search at all
+        """
+        if not session.turns:
+            return TurnPlan(search_query=query, search=True, reuse_results=False, followup=False)
+
+        terms = content_terms(query)
+        known = set()
+        for turn in session.turns:
+            known.update(tokenize(turn.query))
+            known.update(tokenize(turn.search_query))
+        new_terms = [t for t in terms if t not in known]
+
+        if len(terms) >= self.standalone_terms and len(new_terms) == len(terms):
+            return TurnPlan(search_query=query, search=True, reuse_results=False, followup=True, new_terms=new_terms)
+
+        search_query = " ".join([session.turns[-1].search_query, *new_terms])
+        search = bool(new_terms) and not self._covered(session, new_terms)
+        return TurnPlan(search_query=search_query, search=search, reuse_results=True, followup=True, new_terms=new_terms)
+
+    def _covered(self, session: Session, terms: List[str]) -> bool:
+        """Whether enough pooled passages mention every term"""
+        mentions = dict.fromkeys(terms, 0)
+        for result in session.results:
+            tokens = set(tokenize(f"{result.get('title', '')} {result.get('content', '')}"))
+            for term in terms:
+                if term in tokens:
+                    mentions[term] += 1
+        return all(count >= self.coverage_passages for count in mentions.values())
+
+    def merge_results(self, new_results: List[Dict[str, Any]], pooled: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """New results first, then pooled ones from other pages, capped at max_results"""
+        merged = []
+        seen = set()
+        for result in [*new_results, *pooled]:
+            url = result.get("url")
+            key = normalize_url(url) if url else None
+            if key in seen:
+                continue
+            if key:
+                seen.add(key)
+            merged.append(result)
+            if len(merged) >= self.max_results:
+                break
+        return merged
+
+    def history_messages(self, session: Session) -> Tuple[List[Dict[str, str]], Dict[str, int]]:
+        """
+        Earlier turns as chat messages, trimmed to the history token budget
+
+        The newest turns are kept; the oldest turn that still partly fits has
+        its answer truncated, and anything older is dropped.
+
+        Returns:
+            (messages oldest first, report with turns and tokens used)
+        """
+        picked: List[Tuple[str, str]] = []
+        used = 0
+        for turn in reversed(session.turns):
+            question_tokens = estimate_tokens(turn.query) + 2 * MESSAGE_OVERHEAD
+            answer = turn.answer
+            answer_tokens = estimate_tokens(answer)
+            remaining = self.history_tokens - used - question_tokens
+            if answer_tokens > remaining:
+                if remaining < MIN_ANSWER_TOKENS:
+                    break
+                answer = truncate_to_tokens(answer, remaining)
+                answer_tokens = estimate_tokens(answer)
+            picked.append((turn.query, answer))
+            used += question_tokens + answer_tokens
+            if answer is not turn.answer:
+                break
+
+        messages = []
+        for question, answer in reversed(picked):
+            messages.append({"role": "user", "content": question})
+            messages.append({"role": "assistant", "content": answer})
+        return messages, {"history_turns": len(picked), "history_tokens": used}
+
+    async def record(
+        self,
+        session: Session,
+        plan: TurnPlan,
+        query: str,
+        answer: str,
+        sources: List[str],
+        results: List[Dict[str, Any]]
+    ):
+        """
+        Append a completed turn and remember the results its context came from
+
+        Args:
+            session: Session returned by get()
+            plan: The turn's plan
+            query: The question as asked
+            answer: The answer given
+            sources: Source URLs of the answer
+            results: Search results the context was built from (pooled ones included)
+        """
+        self.turns += 1
+        if plan.followup:
+            self.followups += 1
+            if plan.mode == "skipped":
+                self.searches_skipped += 1
+            elif plan.mode == "incremental":
+                self.searches_incremental += 1
+            else:
+                self.topic_changes += 1
+
+        session.turns = [*session.turns, Turn(query, plan.search_query, answer, list(sources))][-self.max_turns:]
+        # A follow-up's results already include the pool; a new topic replaces it
+        session.results = self.merge_results(results, [])
+        session.expires_at = time.time() + self.ttl
+
+        self._sessions[session.session_id] = session
+        self._sessions.move_to_end(session.session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+
+        if self.store is not None:
+            encoded = dumps_str({
+                "turns": [asdict(turn) for turn in session.turns],
+                "results": session.results,
+                "expires_at": session.expires_at,
+            })
+            try:
+                await asyncio.to_thread(self.store.set, self._store_key(session.session_id), encoded, self.ttl)
+            except Exception as e:
+                logger.warning("Shared session write failed: %s", e)
+
+    def stats(self) -> Dict[str, Any]:
+        """Session counters for /health"""
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "ttl_seconds": self.ttl,
+            "history_tokens": self.history_tokens,
+            "turns": self.turns,
+            "followups": self.followups,
+            "searches_skipped": self.searches_skipped,
+            "searches_incremental": self.searches_incremental,
+            "topic_changes": self.topic_changes,
+            "evictions": self.evictions,
+            "expired": self.expired,
+        }
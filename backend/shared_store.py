@@ -0,0 +1,260 @@
+"""
+State shared between worker processes
+
+With several uvicorn/gunicorn workers, process-local caches and token
+buckets would each warm up (and rate-limit) separately. A SharedStore
+gives them one key-value space with TTLs plus atomic token buckets:
+
+- MemoryStore: process-local dictionaries (single worker, the default)
+- FileStore: one SQLite file in WAL mode on local disk; every worker on the
+  host opens the same file, so no external service is needed
+
+Store calls are blocking; async code runs them with asyncio.to_thread.
+Connections are opened lazily per process, so a store created before the
+server forks its workers (gunicorn --preload) is safe to use afterwards.
+
+Expired keys are only dropped when they are read again, and many are never
+read again (per-session prefetch budgets, per-key quota windows), so the
+server runs purge_forever() to remove them, together with token buckets
+that have refilled completely (a missing bucket starts full, the same as
+a full one).
+"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryStore:
+    """Process-local store"""
+
+    backend = "memory"
+    shared = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[str, Tuple[float, str]] = {}
+        # name -> (level, updated, full_at)
+        self._buckets: Dict[str, Tuple[float, float, float]] = {}
+        self.purged = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._values.get(key)
+            if item is None:
+                return None
+            if item[0] < time.time():
+                del self._values[key]
+                return None
+            return item[1]
+
+    def set(self, key: str, value: str, ttl: float):
+        with self._lock:
+            self._values[key] = (time.time() + ttl, value)
+
+    def incr(self, key: str, amount: float = 1.0, ttl: float = 86400) -> float:
+        with self._lock:
+            expires_at, value = self._values.get(key, (0.0, "0"))
+            current = float(value) + amount if expires_at >= time.time() else amount
+            self._values[key] = (expires_at if expires_at >= time.time() else time.time() + ttl, repr(current))
+            return current
+
+    def take_tokens(self, name: str, rate: float, burst: float, tokens: float = 1.0) -> float:
+        """
+        Take tokens from a shared token bucket
+
+        Returns:
+            0 when the tokens were taken, else seconds until they will be available
+        """
+        with self._lock:
+            now = time.time()
+            level, updated, _ = self._buckets.get(name, (burst, now, now))
+            level = min(burst, level + (now - updated) * rate)
+            wait = 0.0
+            if level >= tokens:
+                level -= tokens
+            else:
+                wait = (tokens - level) / rate
+            self._buckets[name] = (level, now, now + (burst - level) / rate)
+            return wait
+
+    def purge_expired(self) -> int:
+        """Drop expired keys and full token buckets; returns how many were removed"""
+        with self._lock:
+            now = time.time()
+            expired = [k for k, (expires_at, _) in self._values.items() if expires_at < now]
+            for key in expired:
+                del self._values[key]
+            full = [name for name, (_, _, full_at) in self._buckets.items() if full_at < now]
+            for name in full:
+                del self._buckets[name]
+            self.purged += len(expired) + len(full)
+            return len(expired) + len(full)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.backend, "keys": len(self._values), "buckets": len(self._buckets), "purged": self.purged}
+
+    def close(self):
+        pass
+
+
+class FileStore:
+    """SQLite-file store shared by every process that opens the same path"""
+
+    backend = "file"
+    shared = True
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self.purged = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # Never reuse a connection inherited across fork()
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, expires_at REAL NOT NULL, value TEXT NOT NULL)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS token_buckets "
+                "(name TEXT PRIMARY KEY, level REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL DEFAULT 0)"
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(token_buckets)")]
+            if "full_at" not in columns:
+                # Files written before buckets were purged; their rows are treated as full
+                conn.execute("ALTER TABLE token_buckets ADD COLUMN full_at REAL NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS kv_expires ON kv (expires_at)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT value FROM kv WHERE key = ? AND expires_at >= ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str, ttl: float):
+        with self._lock:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO kv (key, expires_at, value) VALUES (?, ?, ?)",
+                (key, time.time() + ttl, value)
+            )
+
+    def incr(self, key: str, amount: float = 1.0, ttl: float = 86400) -> float:
+        with self._lock:
+            conn = self._connection()
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT expires_at, value FROM kv WHERE key = ?", (key,)).fetchone()
+                if row and row[0] >= now:
+                    expires_at, current = row[0], float(row[1]) + amount
+                else:
+                    expires_at, current = now + ttl, amount
+                conn.execute(
+                    "INSERT OR REPLACE INTO kv (key, expires_at, value) VALUES (?, ?, ?)",
+                    (key, expires_at, repr(current))
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return current
+
+    def take_tokens(self, name: str, rate: float, burst: float, tokens: float = 1.0) -> float:
+        """
+        Take tokens from a shared token bucket
+
+        Returns:
+            0 when the tokens were taken, else seconds until they will be available
+        """
+        with self._lock:
+            conn = self._connection()
+            now = time.time()
+            # IMMEDIATE takes the write lock up front, so read-modify-write is atomic across processes
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT level, updated FROM token_buckets WHERE name = ?", (name,)).fetchone()
+                level = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+                wait = 0.0
+                if level >= tokens:
+                    level -= tokens
+                else:
+                    wait = (tokens - level) / rate
+                conn.execute(
+                    "INSERT OR REPLACE INTO token_buckets (name, level, updated, full_at) VALUES (?, ?, ?, ?)",
+                    (name, level, now, now + (burst - level) / rate)
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return wait
+
+    def purge_expired(self) -> int:
+        """Drop expired keys and full token buckets; returns how many were removed"""
+        with self._lock:
+            conn = self._connection()
+            now = time.time()
+            removed = conn.execute("DELETE FROM kv WHERE expires_at < ?", (now,)).rowcount
+            removed += conn.execute("DELETE FROM token_buckets WHERE full_at < ?", (now,)).rowcount
+        self.purged += removed
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            conn = self._connection()
+            keys = conn.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+            buckets = conn.execute("SELECT COUNT(*) FROM token_buckets").fetchone()[0]
+        return {"backend": self.backend, "path": self.path, "keys": keys, "buckets": buckets, "purged": self.purged}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+
+async def purge_forever(store, interval: float):
+    """Purge the store every `interval` seconds (run as a task by the lifespan handler)"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            removed = await asyncio.to_thread(store.purge_expired) if store.shared else store.purge_expired()
+        except Exception as e:
+            logger.warning("Shared store purge failed: %s", e)
+            continue
+        if removed:
+            logger.info("Purged %d expired shared store entries", removed)
+
+
+DEFAULT_STORE_PATH = os.path.join(tempfile.gettempdir(), "intellisearch-shared.sqlite3")
+
+
+def store_from_env():
+    """
+    Pick the shared store backend
+
+    SHARED_STORE=memory|file; when unset, 'file' is used whenever the server
+    runs more than one worker (APP_WORKERS, set by the production launcher).
+    """
+    backend = os.getenv("SHARED_STORE")
+    if not backend:
+        backend = "file" if int(os.getenv("APP_WORKERS", 1)) > 1 else "memory"
+    if backend == "file":
+        return FileStore(os.getenv("SHARED_STORE_PATH") or DEFAULT_STORE_PATH)
+    if backend == "memory":
+        return MemoryStore()
+    raise ValueError(f"Unsupported SHARED_STORE backend: {backend}")
@@ -0,0 +1,204 @@
+"""
+Single-flight request coalescing
+
+Concurrent callers asking for the same key share one execution of the
+underlying coroutine. The call runs as its own task, so a caller that goes
+away (e.g. client disconnect) does not cancel it for the others; it is only
+cancelled once every waiter has gone.
+
+Streams can be shared too: every subscriber replays what has been produced
+so far and then follows the live stream.
+"""
+
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class CoalescingLimitExceeded(Exception):
+    """Raised when a key already has the maximum number of waiters"""
+
+
+class _Call:
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class SharedStream:
+    """Fan one async iterator out to any number of subscribers"""
+
+    def __init__(self, source: AsyncIterator[Any], max_subscribers: Optional[int] = None):
+        self._source = source
+        self._items: List[Any] = []
+        self._error: Optional[BaseException] = None
+        self._done = False
+        self._changed = asyncio.Event()
+        self._subscribers = 0
+        self._max_subscribers = max_subscribers
+        self._done_callbacks: List[Callable[[], None]] = []
+        self._task = asyncio.ensure_future(self._pump())
+
+    async def _pump(self):
+        try:
+            async for item in self._source:
+                self._items.append(item)
+                self._notify()
+        except asyncio.CancelledError:
+            self._error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            self._error = e
+        finally:
+            self._done = True
+            self._notify()
+            for callback in self._done_callbacks:
+                callback()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def add_done_callback(self, callback: Callable[[], None]):
+        self._done_callbacks.append(callback)
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    def subscribe(self) -> AsyncIterator[Any]:
+        """
+        New iterator over the full stream (buffered items first)
+
+        Raises:
+            CoalescingLimitExceeded: When the subscriber limit is reached
+        """
+        if self._max_subscribers is not None and self._subscribers >= self._max_subscribers:
+            raise CoalescingLimitExceeded()
+        self._subscribers += 1
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncIterator[Any]:
+        index = 0
+        try:
+            while True:
+                if index < len(self._items):
+                    yield self._items[index]
+                    index += 1
+                    continue
+                if self._done:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                await self._changed.wait()
+        finally:
+            self._subscribers -= 1
+            # Nobody is listening any more: stop producing
+            if self._subscribers == 0 and not self._task.done():
+                self._task.cancel()
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one"""
+
+    def __init__(self, max_waiters: Optional[int] = None):
+        self.max_waiters = max_waiters
+        self._inflight: Dict[Hashable, _Call] = {}
+        self._streams: Dict[Hashable, SharedStream] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.rejected = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Run fn() once for all concurrent callers with the same key
+
+        Args:
+            key: Coalescing key
+            fn: Zero-argument coroutine factory, only called by the first caller
+
+        Returns:
+            (result, shared): fn()'s result, and False only for the caller that started it
+
+        Raises:
+            CoalescingLimitExceeded: When the key already has max_waiters waiters
+        """
+        call = self._inflight.get(key)
+        shared = call is not None
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._inflight[key] = call
+            self.leaders += 1
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        elif self.max_waiters is not None and call.waiters >= self.max_waiters:
+            self.rejected += 1
+            raise CoalescingLimitExceeded()
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task), shared
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+                # Forget it now, not in the done callback a loop iteration
+                # later, so a caller arriving meanwhile starts a fresh call
+                self._forget(key, call)
+
+    async def stream(self, key: Hashable, open_stream: Callable[[], Awaitable[AsyncIterator[Any]]]) -> AsyncIterator[Any]:
+        """
+        Share one stream among all callers with the same key
+
+        Setup (open_stream) is coalesced like do(); callers arriving while the
+        stream is still producing join it and replay it from the start.
+
+        Args:
+            key: Coalescing key
+            open_stream: Coroutine factory returning the source async iterator
+
+        Returns:
+            Async iterator over the shared stream
+
+        Raises:
+            CoalescingLimitExceeded: When the key already has max_waiters subscribers
+        """
+        live = self._streams.get(key)
+        if live is not None and not live.done:
+            try:
+                iterator = live.subscribe()
+            except CoalescingLimitExceeded:
+                self.rejected += 1
+                raise
+            self.coalesced += 1
+            return iterator
+
+        async def start() -> SharedStream:
+            stream = SharedStream(await open_stream(), self.max_waiters)
+            self._streams[key] = stream
+            stream.add_done_callback(lambda: self._forget_stream(key, stream))
+            return stream
+
+        stream, _ = await self.do(("stream", key), start)
+        try:
+            return stream.subscribe()
+        except CoalescingLimitExceeded:
+            self.rejected += 1
+            raise
+
+    def _forget(self, key: Hashable, call: _Call):
+        if self._inflight.get(key) is call:
+            del self._inflight[key]
+
+    def _forget_stream(self, key: Hashable, stream: SharedStream):
+        if self._streams.get(key) is stream:
+            del self._streams[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "inflight": len(self._inflight),
+            "live_streams": len(self._streams),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,14 @@
+"""
+Shared test setup
+
+Tests run against the mock upstreams in benchmarks/mock_upstreams.py, each
+served by a real uvicorn server on a background thread.
+
+Usage (from the backend directory):
+    python -m pytest tests
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,142 @@
+"""
+Deep retrieval against the mock upstreams' /pages/ fixtures
+
+Pages are served on 127.0.0.1, so these fetchers allow private addresses;
+the SSRF tests at the end use fetchers that do not.
+"""
+
+import asyncio
+
+import httpx
+import pytest
+
+from benchmarks.mock_upstreams import ServerThread, create_mock_app
+from deep_retrieval import DeepRetrievalSettings, PageFetchError, PageFetcher, _PublicOnlyBackend
+
+PAGES_PORT = 18125
+BASE_URL = f"http://127.0.0.1:{PAGES_PORT}/pages"
+SNIPPET = "Short search snippet."
+
+
+@pytest.fixture(scope="module", autouse=True)
+def pages():
+    server = ServerThread(create_mock_app(page_latency=0.0), PAGES_PORT).start()
+    yield
+    server.stop()
+
+
+def fetcher(**overrides) -> PageFetcher:
+    settings = {"allow_private": True, "extract_workers": 0, "deadline": 2.0, **overrides}
+    return PageFetcher(DeepRetrievalSettings(**settings))
+
+
+def enrich(page_fetcher: PageFetcher, *urls: str, repeat: int = 1):
+    """Run enrich over results linking to urls, repeat times, and return the last outcome"""
+    results = [{"title": f"Result {i}", "url": url, "content": SNIPPET} for i, url in enumerate(urls)]
+
+    async def run():
+        try:
+            for _ in range(repeat):
+                outcome = await page_fetcher.enrich(results)
+            return outcome
+        finally:
+            await page_fetcher.aclose()
+
+    return asyncio.run(run())
+
+
+def test_html_page_replaces_snippet_with_passages():
+    enriched, report = enrich(fetcher(), f"{BASE_URL}/1")
+    assert report["pages"][0]["status"] == "ok"
+    assert report["pages_used"] == 1
+    assert all(result["snippet"] == SNIPPET for result in enriched)
+    text = " ".join(result["content"] for result in enriched)
+    assert "full pages replaced search snippets" in text
+    # Navigation and cookie chrome are not part of the main text
+    assert "cookie" not in text.lower()
+
+
+def test_large_page_is_truncated_at_byte_cap():
+    page_fetcher = fetcher(max_bytes=50_000)
+    _, report = enrich(page_fetcher, f"{BASE_URL}/large")
+    page = report["pages"][0]
+    assert page["status"] == "ok"
+    assert page["truncated"] is True
+    assert page["bytes"] == 50_000
+    assert page_fetcher.stats()["truncated"] == 1
+
+
+def test_binary_page_is_skipped():
+    enriched, report = enrich(fetcher(), f"{BASE_URL}/binary")
+    assert report["pages"][0]["status"] == "skipped"
+    assert enriched[0]["content"] == SNIPPET
+
+
+def test_missing_page_keeps_snippet():
+    enriched, report = enrich(fetcher(), f"{BASE_URL}/missing")
+    page = report["pages"][0]
+    assert page["status"] == "error"
+    assert page["error"] == "HTTP 404"
+    assert enriched == [{"title": "Result 0", "url": f"{BASE_URL}/missing", "content": SNIPPET}]
+
+
+def test_slow_page_is_reported_late():
+    page_fetcher = fetcher(deadline=0.5)
+    enriched, report = enrich(page_fetcher, f"{BASE_URL}/slow", f"{BASE_URL}/2")
+    statuses = {page["url"]: page["status"] for page in report["pages"]}
+    assert statuses == {f"{BASE_URL}/slow": "late", f"{BASE_URL}/2": "ok"}
+    assert report["elapsed_ms"] < 2000
+    assert enriched[0]["content"] == SNIPPET
+    assert page_fetcher.stats()["late"] == 1
+
+
+def test_stale_page_is_revalidated_with_etag():
+    page_fetcher = fetcher(cache_ttl=0)
+    enriched, report = enrich(page_fetcher, f"{BASE_URL}/3", repeat=2)
+    assert report["pages"][0]["status"] == "not_modified"
+    assert report["pages_used"] == 1
+    assert enriched[0]["content"] != SNIPPET
+    stats = page_fetcher.stats()
+    assert stats["pages_fetched"] == 1
+    assert stats["not_modified"] == 1
+
+
+def test_fresh_page_is_served_from_cache():
+    page_fetcher = fetcher()
+    _, report = enrich(page_fetcher, f"{BASE_URL}/4", repeat=2)
+    assert report["pages"][0]["status"] == "cached"
+    assert page_fetcher.stats()["pages_fetched"] == 1
+
+
+def test_private_addresses_are_not_fetched():
+    page_fetcher = fetcher(allow_private=False)
+    enriched, report = enrich(page_fetcher, f"{BASE_URL}/1", "http://localhost/admin", "file:///etc/passwd")
+    # None of them is even attempted
+    assert report["pages"] == []
+    assert [result["content"] for result in enriched] == [SNIPPET] * 3
+
+
+def test_redirect_to_private_address_is_blocked():
+    requested = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requested.append(str(request.url))
+        if request.url.host == "example.com":
+            return httpx.Response(302, headers={"Location": "http://169.254.169.254/latest/meta-data/"})
+        return httpx.Response(200, text="<p>instance credentials</p>", headers={"Content-Type": "text/html"})
+
+    page_fetcher = fetcher(allow_private=False)
+    page_fetcher._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    enriched, report = enrich(page_fetcher, "https://example.com/article")
+    assert report["pages"][0]["status"] == "blocked"
+    assert requested == ["https://example.com/article"]
+    assert enriched[0]["content"] == SNIPPET
+
+
+def test_hostname_resolving_to_private_address_is_blocked():
+    async def connect():
+        await _PublicOnlyBackend().connect_tcp("localhost", PAGES_PORT, timeout=1)
+
+    with pytest.raises(PageFetchError) as error:
+        asyncio.run(connect())
+    assert error.value.status == "blocked"
@@ -0,0 +1,173 @@
+"""
+Hedging, failover and circuit breakers against fake LLM servers
+
+Each scenario streams through LLMRouter with real AsyncOpenAI clients
+pointed at mock OpenAI-compatible upstreams ("openai" is the primary
+provider, "qwen" the backup).
+"""
+
+import asyncio
+import time
+
+import pytest
+from openai import AsyncOpenAI, NotFoundError
+
+from benchmarks.mock_upstreams import ServerThread, create_mock_app
+from deadlines import DeadlineExceeded
+from llm_router import LLMRouter, LLMTarget
+
+FAST_PORT = 18120
+STALLING_PORT = 18121
+FAILING_PORT = 18122
+
+ANSWER = "Mock answer based on the sources."
+
+
+@pytest.fixture(scope="module", autouse=True)
+def upstreams():
+    servers = [
+        ServerThread(create_mock_app(llm_latency=0.05), FAST_PORT).start(),
+        # Never produces a first token within the tests' time frame
+        ServerThread(create_mock_app(llm_latency=0.05, llm_stall_rate=1.0, llm_stall=5.0), STALLING_PORT).start(),
+        ServerThread(create_mock_app(llm_error_rate=1.0), FAILING_PORT).start(),
+    ]
+    yield
+    for server in servers:
+        server.stop()
+
+
+def target(provider: str, port: int, path: str = "/v1") -> LLMTarget:
+    return LLMTarget(provider, "mock-model", "test-key", f"http://127.0.0.1:{port}{path}")
+
+
+class Upstreams:
+    """open_stream for LLMRouter that records how each attempt ended"""
+
+    def __init__(self):
+        self.outcomes = {}
+
+    def open_stream(self, llm_target: LLMTarget):
+        async def deltas():
+            client = AsyncOpenAI(api_key=llm_target.api_key, base_url=llm_target.base_url, max_retries=0)
+            self.outcomes[llm_target.name] = "started"
+            try:
+                stream = await client.chat.completions.create(
+                    model=llm_target.model,
+                    messages=[{"role": "user", "content": "question"}],
+                    stream=True,
+                )
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+                self.outcomes[llm_target.name] = "finished"
+            except (GeneratorExit, asyncio.CancelledError):
+                self.outcomes[llm_target.name] = "closed"
+                raise
+            finally:
+                await client.close()
+
+        return deltas()
+
+
+async def collect(router: LLMRouter, targets, upstreams: Upstreams):
+    stream = router.stream(targets, upstreams.open_stream)
+    answer = "".join([delta async for delta in stream])
+    return answer, stream.route
+
+
+def test_no_hedge_when_primary_answers_within_delay():
+    router = LLMRouter(default_delay=1.0)
+    upstreams = Upstreams()
+    answer, route = asyncio.run(collect(router, [target("openai", FAST_PORT), target("qwen", FAST_PORT)], upstreams))
+
+    assert answer == ANSWER
+    assert route["provider"] == "openai" and not route["hedged"]
+    assert router.hedges_started == 0
+    assert "qwen:mock-model" not in upstreams.outcomes
+
+
+def test_hedge_fires_after_delay_and_winner_is_used():
+    router = LLMRouter(default_delay=0.3)
+    upstreams = Upstreams()
+    started = time.perf_counter()
+    answer, route = asyncio.run(collect(router, [target("openai", STALLING_PORT), target("qwen", FAST_PORT)], upstreams))
+    elapsed = time.perf_counter() - started
+
+    # The backup starts only once the hedge delay has passed, and wins long before the stall ends
+    assert 0.3 <= elapsed < 3.0
+    assert route["hedged"] and route["provider"] == "qwen"
+    assert answer == ANSWER
+    assert router.hedges_started == 1 and router.hedges_won == 1
+
+
+def test_hedge_loser_is_cancelled():
+    router = LLMRouter(default_delay=0.3)
+    upstreams = Upstreams()
+    _, route = asyncio.run(collect(router, [target("openai", STALLING_PORT), target("qwen", FAST_PORT)], upstreams))
+
+    assert {"target": "openai:mock-model", "outcome": "cancelled"} in route["attempts"]
+    assert upstreams.outcomes == {"openai:mock-model": "closed", "qwen:mock-model": "finished"}
+    # Cancelling the loser says nothing about the provider's health
+    assert router.breaker("openai").state == "closed"
+    assert router.breaker("openai").failures == 0
+
+
+def test_failover_opens_breaker_and_skips_provider():
+    router = LLMRouter(hedging_enabled=False, breaker_failures=2, breaker_reset=60)
+    targets = [target("openai", FAILING_PORT), target("qwen", FAST_PORT)]
+
+    routes = []
+    for _ in range(3):
+        answer, route = asyncio.run(collect(router, targets, Upstreams()))
+        assert answer == ANSWER
+        routes.append(route)
+
+    for route in routes[:2]:
+        assert route["failover"] and route["provider"] == "qwen"
+        assert route["attempts"][0]["target"] == "openai:mock-model"
+        assert route["attempts"][0]["outcome"] == "error"
+    assert router.breaker("openai").state == "open"
+
+    # With the breaker open the primary is not called at all
+    assert routes[2]["attempts"][0] == {"target": "openai:mock-model", "outcome": "skipped_open_breaker"}
+    assert routes[2]["provider"] == "qwen"
+    assert router.skipped_open == 1
+
+
+def test_client_error_is_returned_without_failover():
+    router = LLMRouter(hedging_enabled=False, breaker_failures=1)
+    upstreams = Upstreams()
+    # No such route on the mock: a 404, i.e. a problem with the request, not the provider
+    targets = [target("openai", FAST_PORT, path="/missing/v1"), target("qwen", FAST_PORT)]
+
+    with pytest.raises(NotFoundError):
+        asyncio.run(collect(router, targets, upstreams))
+
+    assert "qwen:mock-model" not in upstreams.outcomes
+    assert router.failovers == 0
+    assert router.breaker("openai").state == "closed"
+    assert router.breaker("openai").failures == 0
+
+
+def test_deadline_before_first_token_does_not_trip_breaker():
+    router = LLMRouter(hedging_enabled=False, breaker_failures=1)
+    upstreams = Upstreams()
+
+    def open_stream(llm_target: LLMTarget):
+        if llm_target.provider == "openai":
+            async def out_of_time():
+                # As when the local quota or pacing wait uses up the request's budget
+                raise DeadlineExceeded("llm")
+                yield
+            return out_of_time()
+        return upstreams.open_stream(llm_target)
+
+    async def run():
+        stream = router.stream([target("openai", FAST_PORT), target("qwen", FAST_PORT)], open_stream)
+        return "".join([delta async for delta in stream]), stream.route
+
+    answer, route = asyncio.run(run())
+    assert answer == ANSWER
+    assert route["attempts"][0]["outcome"] == "error"
+    assert router.breaker("openai").state == "closed"
+    assert router.breaker("openai").failures == 0
@@ -0,0 +1,52 @@
+"""
+Request coalescing (SingleFlight)
+"""
+
+import asyncio
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def run():
+        return await asyncio.gather(*(flight.do("key", work) for _ in range(3)))
+
+    results = asyncio.run(run())
+    assert results == [("result", False), ("result", True), ("result", True)]
+    assert len(calls) == 1
+
+
+def test_caller_after_last_waiter_left_starts_a_fresh_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        try:
+            await asyncio.sleep(0.05)
+        finally:
+            # Cleanup on cancellation (closing a connection, ...) keeps the
+            # cancelled call running for a while
+            await asyncio.sleep(0.05)
+        return len(calls)
+
+    async def run():
+        # A prefetch abandoned by newer typing...
+        abandoned = asyncio.ensure_future(flight.do("key", work))
+        await asyncio.sleep(0.01)
+        abandoned.cancel()
+        await asyncio.gather(abandoned, return_exceptions=True)
+        # ...then the real request for the same query, while the cancelled
+        # call is still winding down
+        return await flight.do("key", work)
+
+    assert asyncio.run(run()) == (2, False)
+    assert len(calls) == 2
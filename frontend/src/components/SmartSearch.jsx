@@ -8,6 +8,23 @@ import React, { useState } from 'react';
 import axios from 'axios';
 
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000/api/smart_search';
+const PREFETCH_URL = import.meta.env.VITE_PREFETCH_URL || API_URL.replace(/\/smart_search$/, '/prefetch');
+
+// Speculative prefetch: partial queries are sent once typing pauses this long
+const PREFETCH_DEBOUNCE_MS = 300;
+const PREFETCH_MIN_CHARS = 4;
+
+// One id per browser tab, so the backend can cancel this tab's stale prefetches
+const getSessionId = () => {
+  let sessionId = sessionStorage.getItem('prefetchSessionId');
+  if (!sessionId) {
+    sessionId = window.crypto?.randomUUID
+      ? window.crypto.randomUUID()
+      : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    sessionStorage.setItem('prefetchSessionId', sessionId);
+  }
+  return sessionId;
+};
 
 const SmartSearch = () => {
   // State Management
@@ -25,6 +42,7 @@ const SmartSearch = () => {
   const [sources, setSources] = useState([]);
   const [metadata, setMetadata] = useState(null);
   const [error, setError] = useState('');
+  const sessionId = React.useRef(getSessionId());
 
   // Load saved config
   React.useEffect(() => {
@@ -41,6 +59,27 @@ const SmartSearch = () => {
     if (savedLlmKey) setLlmApiKey(savedLlmKey);
   }, []);
 
+  // Warm the backend search cache while the user is still typing
+  React.useEffect(() => {
+    const trimmedQuery = query.trim();
+    if (isLoading || trimmedQuery.length < PREFETCH_MIN_CHARS) return undefined;
+
+    const timer = setTimeout(() => {
+      const requestData = {
+        query: trimmedQuery,
+        search_engine: searchEngine,
+        session_id: sessionId.current,
+      };
+      if (useCustomSearchKey && searchcansApiKey) {
+        requestData.searchcans_api_key = searchcansApiKey;
+      }
+      // Best effort: if it fails, the search simply runs on submit
+      axios.post(PREFETCH_URL, requestData, { timeout: 5000 }).catch(() => {});
+    }, PREFETCH_DEBOUNCE_MS);
+
+    return () => clearTimeout(timer);
+  }, [query, searchEngine, useCustomSearchKey, searchcansApiKey, isLoading]);
+
   const saveConfig = () => {
     localStorage.setItem('llmProvider', llmProvider);
     localStorage.setItem('useCustomSearchKey', useCustomSearchKey.toString());